@@ -1,7 +1,12 @@
 from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
 import jwt
 import hashlib
+import os
+import threading
+import time
 from database import get_db
+from response_cache import response_cache
 from fastapi import Response
 
 # Настройки безопасности
@@ -9,6 +14,15 @@ SECRET_KEY = "your-secret-key-change-in-production-12345"  # Измени в п
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 дней
 
+# Кэш проверенных токенов: токен -> пользователь
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))  # секунд
+
+# Администраторы (через запятую): доступ к /api/admin/*; пусто — администраторов нет
+ADMIN_EMAILS = {
+    email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()
+}
+
 
 def hash_password(password: str) -> str:
     """
@@ -21,6 +35,11 @@ def hash_password(password: str) -> str:
     return hashlib.sha256(password_with_salt.encode()).hexdigest()
 
 
+def is_admin(user: dict) -> bool:
+    """Пользователь из ADMIN_EMAILS"""
+    return (user.get("email") or "").lower() in ADMIN_EMAILS
+
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Проверка пароля"""
     return hash_password(plain_password) == hashed_password
@@ -66,7 +85,11 @@ def create_user(email: str, password: str, full_name: str) -> int:
             "INSERT INTO users (email, password_hash, full_name) VALUES (?, ?, ?)",
             (email, password_hash, full_name)
         )
-        return cursor.lastrowid
+        user_id = cursor.lastrowid
+
+    # После коммита: списки пользователей в кэше ответов больше не актуальны
+    response_cache.invalidate("users")
+    return user_id
 
 
 def get_user_by_email(email: str):
@@ -100,3 +123,114 @@ def get_user_by_id(user_id: int):
                 "full_name": user[2]
             }
         return None
+
+
+# ========== КЭШ АУТЕНТИФИКАЦИИ ==========
+
+class TokenCache:
+    """
+    LRU + TTL кэш: проверенный JWT -> данные пользователя.
+    Позволяет не ходить в БД на каждый авторизованный запрос.
+    """
+
+    def __init__(self, max_size: int = AUTH_CACHE_SIZE, ttl: float = AUTH_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # token -> (expires_at, user)
+        self._tokens_by_user = {}  # user_id -> set(token)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, user = entry
+            if expires_at <= time.monotonic():
+                self._remove(token)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return dict(user)
+
+    def put(self, token: str, user: dict, token_exp: float = None):
+        ttl = self.ttl
+        if token_exp is not None:
+            # Не держим запись дольше, чем живёт сам токен
+            ttl = min(ttl, token_exp - time.time())
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (time.monotonic() + ttl, dict(user))
+            self._tokens_by_user.setdefault(user["id"], set()).add(token)
+
+            while len(self._entries) > self.max_size:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token: str):
+        _, user = self._entries.pop(token)
+        tokens = self._tokens_by_user.get(user["id"])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[user["id"]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+_token_cache = TokenCache()
+
+
+def get_cached_user(token: str):
+    """Пользователь по уже проверенному токену (None, если в кэше нет)"""
+    return _token_cache.get(token)
+
+
+def cache_user(token: str, user: dict, token_exp: float = None):
+    """Запомнить пользователя для проверенного токена"""
+    _token_cache.put(token, user, token_exp)
+
+
+def invalidate_user_cache(user_id: int):
+    """Сброс кэша после изменения или удаления строки пользователя"""
+    _token_cache.invalidate_user(user_id)
+
+
+def get_auth_cache_stats() -> dict:
+    return _token_cache.stats()
@@ -0,0 +1,145 @@
+"""
+Бенчмарк рассылки Telegram уведомлений на локальной замене Bot API.
+
+Поднимает fake_telegram_api.py в отдельном процессе, направляет на него
+notifications.get_telegram_bot() и измеряет для 100 / 1 000 / 10 000 получателей
+пропускную способность рассылки и задержки доставки (от начала рассылки до ответа).
+
+    python benchmark_notifications.py
+    python benchmark_notifications.py --sizes 100,1000 --rate 0 --latency-ms 20
+
+Лимиты клиента задаются теми же переменными, что и в продакшене
+(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_MAX_CONCURRENCY).
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import subprocess
+import sys
+import time
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def start_fake_server(args) -> subprocess.Popen:
+    process = subprocess.Popen([
+        sys.executable, os.path.join(BACKEND_DIR, "fake_telegram_api.py"),
+        "--port", str(args.port),
+        "--latency-ms", str(args.latency_ms),
+        "--jitter-ms", str(args.jitter_ms),
+        "--rate", str(args.rate),
+        "--chat-rate", str(args.chat_rate),
+        "--retry-after", str(args.retry_after),
+        "--not-found-percent", str(args.not_found_percent),
+        "--blocked-percent", str(args.blocked_percent)
+    ], cwd=BACKEND_DIR)
+
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{args.port}/stats", timeout=0.5)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Fake Telegram API не запустился")
+
+
+async def run_fanout(size: int, port: int) -> dict:
+    from notifications import deliver_telegram_message, format_slot_telegram_message
+
+    httpx.post(f"http://127.0.0.1:{port}/reset")
+    message = format_slot_telegram_message({
+        "course_name": "Бенчмарк",
+        "start_time": "2025-01-01 10:00",
+        "end_time": "2025-01-01 11:30",
+        "location": "Ауд. 101",
+        "status": "scheduled"
+    }, "new")
+
+    latencies = []
+    results = []
+    started = time.perf_counter()
+
+    async def send(chat_id: int):
+        result = await deliver_telegram_message(str(chat_id), message)
+        latencies.append(time.perf_counter() - started)
+        results.append(result)
+
+    await asyncio.gather(*(send(chat_id) for chat_id in range(1, size + 1)))
+    elapsed = time.perf_counter() - started
+
+    server_stats = httpx.get(f"http://127.0.0.1:{port}/stats").json()
+    delivered = sum(1 for r in results if r.ok)
+    return {
+        "size": size,
+        "elapsed": elapsed,
+        "delivered": delivered,
+        "failed": size - delivered,
+        "permanent": sum(1 for r in results if not r.ok and r.permanent),
+        "throughput": delivered / elapsed if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "server_429": server_stats["rate_limited"]
+    }
+
+
+async def run_benchmark(args):
+    # notifications читает настройки при импорте
+    import notifications
+
+    logging.getLogger(notifications.__name__).setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    await notifications.start_telegram_bot()
+    print(f"{'получателей':>12} {'время, с':>9} {'доставлено':>11} {'ошибок':>7} {'msg/s':>8} "
+          f"{'p50, с':>8} {'p99, с':>8} {'429':>6}")
+    for size in args.sizes:
+        r = await run_fanout(size, args.port)
+        print(f"{r['size']:>12} {r['elapsed']:>9.2f} {r['delivered']:>11} {r['failed']:>7} "
+              f"{r['throughput']:>8.1f} {r['p50']:>8.3f} {r['p99']:>8.3f} {r['server_429']:>6}")
+
+    stats = notifications.get_telegram_stats()
+    print(f"\nHTTP пул: {stats['http_pool']}, пик параллельных отправок: {stats['peak_in_flight']}")
+    await notifications.stop_telegram_bot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк рассылки Telegram уведомлений")
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--rate", type=float, default=30, help="лимит fake-сервера, сообщений/с; 0 — без лимита")
+    parser.add_argument("--chat-rate", type=float, default=1)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--not-found-percent", type=int, default=0)
+    parser.add_argument("--blocked-percent", type=int, default=0)
+    args = parser.parse_args()
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+
+    # Никогда не отправляем настоящий токен на тестовый сервер
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:BENCHMARK"
+    os.environ["TELEGRAM_API_BASE_URL"] = f"http://127.0.0.1:{args.port}/bot"
+
+    server = start_fake_server(args)
+    try:
+        asyncio.run(run_benchmark(args))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import logging
+from database import get_db_async
+
+logger = logging.getLogger(__name__)
+
+# Сколько хранить журнал изменений и как часто его компактизировать
+CHANGE_LOG_RETENTION_DAYS = int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "7"))
+CHANGE_LOG_COMPACT_INTERVAL = float(os.getenv("CHANGE_LOG_COMPACT_INTERVAL", "3600"))  # секунд
+CHANGE_LOG_COMPACT_BATCH = 5000
+MAX_CHANGES_PAGE = 1000
+
+# Имена сущностей в ответе API
+ENTITY_NAMES = {
+    "class_slots": "slot",
+    "courses": "course",
+    "participants": "participant"
+}
+
+
+async def _load_rows(db, table: str, ids: list) -> dict:
+    """Текущее состояние изменённых строк одним запросом на таблицу"""
+    if not ids:
+        return {}
+
+    placeholders = ", ".join("?" for _ in ids)
+    if table == "class_slots":
+        cursor = await db.execute(f"""
+            SELECT id, course_id, title, date_time, location, instructor, max_participants, status
+            FROM class_slots WHERE id IN ({placeholders})
+        """, ids)
+        return {
+            row[0]: {
+                "id": row[0],
+                "course_id": row[1],
+                "title": row[2],
+                "date_time": row[3],
+                "location": row[4],
+                "instructor": row[5],
+                "max_participants": row[6],
+                "status": row[7]
+            }
+            for row in cursor.fetchall()
+        }
+
+    if table == "courses":
+        cursor = await db.execute(f"""
+            SELECT id, name, description, instructor, start_date, end_date
+            FROM courses WHERE id IN ({placeholders})
+        """, ids)
+        return {
+            row[0]: {
+                "id": row[0],
+                "name": row[1],
+                "description": row[2],
+                "instructor": row[3],
+                "start_date": row[4],
+                "end_date": row[5]
+            }
+            for row in cursor.fetchall()
+        }
+
+    cursor = await db.execute(f"""
+        SELECT id, class_slot_id, user_id, status
+        FROM participants WHERE id IN ({placeholders})
+    """, ids)
+    return {
+        row[0]: {"id": row[0], "class_slot_id": row[1], "user_id": row[2], "status": row[3]}
+        for row in cursor.fetchall()
+    }
+
+
+async def get_changes(since: int = 0, limit: int = MAX_CHANGES_PAGE) -> dict:
+    """
+    Изменения занятий, курсов и записей участников после sequence-номера since.
+    Несколько изменений одной строки схлопываются в последнее состояние.
+    Если нужные записи журнала уже удалены компактизацией — full_resync=True.
+    """
+    limit = max(1, min(limit, MAX_CHANGES_PAGE))
+
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_log'")
+        row = cursor.fetchone()
+        current_seq = row[0] if row else 0
+
+        cursor = await db.execute("SELECT value FROM sync_state WHERE key = 'compacted_through'")
+        row = cursor.fetchone()
+        compacted_through = row[0] if row else 0
+
+        if since < compacted_through or since > current_seq:
+            return {
+                "changes": [],
+                "last_seq": current_seq,
+                "has_more": False,
+                "full_resync": True
+            }
+
+        cursor = await db.execute("""
+            SELECT seq, table_name, row_id, op, changed_at
+            FROM change_log
+            WHERE seq > ?
+            ORDER BY seq
+            LIMIT ?
+        """, (since, limit + 1))
+        rows = cursor.fetchall()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        last_seq = rows[-1][0] if rows else since
+
+        # Последнее изменение каждой строки
+        latest = {}
+        for seq, table_name, row_id, op, changed_at in rows:
+            latest[(table_name, row_id)] = (seq, op, changed_at)
+
+        ids_by_table = {}
+        for (table_name, row_id), (_, op, _) in latest.items():
+            if op != "delete":
+                ids_by_table.setdefault(table_name, []).append(row_id)
+
+        current_rows = {}
+        for table_name, ids in ids_by_table.items():
+            current_rows[table_name] = await _load_rows(db, table_name, ids)
+
+    changes = []
+    for (table_name, row_id), (seq, op, changed_at) in sorted(latest.items(), key=lambda item: item[1][0]):
+        data = current_rows.get(table_name, {}).get(row_id)
+        if op != "delete" and data is None:
+            # Строка удалена позже, но удаление не попало в эту страницу
+            op = "delete"
+        changes.append({
+            "seq": seq,
+            "entity": ENTITY_NAMES.get(table_name, table_name),
+            "id": row_id,
+            "op": op,
+            "changed_at": changed_at,
+            "data": data if op != "delete" else None
+        })
+
+    return {
+        "changes": changes,
+        "last_seq": last_seq,
+        "has_more": has_more,
+        "full_resync": False
+    }
+
+
+async def compact_change_log(retention_days: int = CHANGE_LOG_RETENTION_DAYS) -> int:
+    """Удаление старых записей журнала пачками; сдвигает границу compacted_through"""
+    removed = 0
+    while True:
+        async with get_db_async() as db:
+            cursor = await db.execute("""
+                SELECT MAX(seq) FROM (
+                    SELECT seq FROM change_log
+                    WHERE changed_at < datetime('now', ?)
+                    ORDER BY seq
+                    LIMIT ?
+                )
+            """, (f"-{retention_days} days", CHANGE_LOG_COMPACT_BATCH))
+            upto = cursor.fetchone()[0]
+            if upto is None:
+                break
+
+            cursor = await db.execute("DELETE FROM change_log WHERE seq <= ?", (upto,))
+            await db.execute("""
+                INSERT INTO sync_state (key, value) VALUES ('compacted_through', ?)
+                ON CONFLICT(key) DO UPDATE SET value = MAX(value, excluded.value)
+            """, (upto,))
+            removed += cursor.rowcount
+
+    if removed:
+        logger.info(f"🧹 Журнал изменений: удалено {removed} записей старше {retention_days} дн.")
+    return removed
+
+
+async def change_log_compactor():
+    """Фоновая задача: периодическая компактизация журнала"""
+    while True:
+        try:
+            await compact_change_log()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка компактизации журнала изменений: {e}")
+        await asyncio.sleep(CHANGE_LOG_COMPACT_INTERVAL)
@@ -41,7 +41,11 @@ def clear_all_data():
 
     try:
         # Получаем список всех таблиц
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+        # Служебные таблицы не трогаем: версия схемы и счётчики изменений (ETag) должны сохраниться
+        cursor.execute("""
+            SELECT name FROM sqlite_master
+            WHERE type='table' AND name NOT LIKE 'sqlite_%' AND name NOT IN ('schema_version', 'table_versions')
+        """)
         tables = cursor.fetchall()
 
         print("📋 Найденные таблицы:")
@@ -104,6 +108,10 @@ def reset_database():
     if os.path.exists(DATABASE_PATH):
         print(f"🗑️  Удаление старой базы данных...")
         os.remove(DATABASE_PATH)
+        # Файлы WAL-журнала тоже удаляем, иначе они попадут в новую БД
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(DATABASE_PATH + suffix):
+                os.remove(DATABASE_PATH + suffix)
         print(f"✅ База данных удалена: {DATABASE_PATH}")
     else:
         print("ℹ️  База данных не существует")
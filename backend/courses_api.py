@@ -1,5 +1,7 @@
 from fastapi import HTTPException
-from database import get_db
+from database import get_db_async
+from response_cache import invalidate_on_commit
+from pagination import decode_cursor, page_limit, split_page
 from models import CourseCreate, CourseUpdate, CourseResponse
 from typing import Optional, List
 import logging
@@ -12,12 +14,15 @@ async def get_courses(
         instructor: Optional[str] = None,
         semester: Optional[str] = None,
         limit: int = 100,
-        offset: int = 0
-) -> List[dict]:
-    """Получение списка курсов с фильтрацией"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+        offset: int = 0,
+        cursor: Optional[str] = None
+) -> dict:
+    """
+    Получение списка курсов с фильтрацией.
+    Постраничный вывод по ключу (name, id): возвращает {"items": [...], "next_cursor": ...}
+    """
+    limit = page_limit(limit)
+    async with get_db_async() as db:
         query = "SELECT id, name, description, instructor, start_date, end_date FROM courses WHERE 1=1"
         params = []
 
@@ -29,31 +34,38 @@ async def get_courses(
             query += " AND instructor LIKE ?"
             params.append(f"%{instructor}%")
 
-        query += " ORDER BY name LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
+        if cursor:
+            after_name, after_id = decode_cursor(cursor, 2)
+            query += " AND (name, id) > (?, ?)"
+            params.extend([after_name, after_id])
+            offset = 0
+
+        query += " ORDER BY name, id LIMIT ? OFFSET ?"
+        params.extend([limit + 1, offset])
 
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        result = await db.execute(query, params)
+        rows, next_cursor = split_page(result.fetchall(), limit, key=lambda row: (row[1], row[0]))
 
-        return [
-            {
-                "id": row[0],
-                "name": row[1],
-                "description": row[2],
-                "instructor": row[3],
-                "start_date": row[4],
-                "end_date": row[5]
-            }
-            for row in rows
-        ]
+        return {
+            "items": [
+                {
+                    "id": row[0],
+                    "name": row[1],
+                    "description": row[2],
+                    "instructor": row[3],
+                    "start_date": row[4],
+                    "end_date": row[5]
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor
+        }
 
 
 async def create_course(data: CourseCreate) -> dict:
     """Создание нового курса"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute(
+    async with get_db_async() as db:
+        cursor = await db.execute(
             """
             INSERT INTO courses (name, description, instructor, start_date, end_date)
             VALUES (?, ?, ?, ?, ?)
@@ -62,6 +74,7 @@ async def create_course(data: CourseCreate) -> dict:
         )
 
         course_id = cursor.lastrowid
+        invalidate_on_commit(db, "courses")
 
         logger.info(f"✅ Создан курс ID={course_id}: {data.name}")
 
@@ -77,9 +90,8 @@ async def create_course(data: CourseCreate) -> dict:
 
 async def get_course(course_id: int) -> dict:
     """Получение курса по ID"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+    async with get_db_async() as db:
+        cursor = await db.execute(
             "SELECT id, name, description, instructor, start_date, end_date FROM courses WHERE id = ?",
             (course_id,)
         )
@@ -100,11 +112,9 @@ async def get_course(course_id: int) -> dict:
 
 async def update_course(course_id: int, data: CourseUpdate) -> dict:
     """Обновление курса"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Проверяем существование курса
-        cursor.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
+        cursor = await db.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Курс с ID {course_id} не найден")
 
@@ -138,7 +148,8 @@ async def update_course(course_id: int, data: CourseUpdate) -> dict:
         # Выполняем обновление
         params.append(course_id)
         query = f"UPDATE courses SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
+        await db.execute(query, params)
+        invalidate_on_commit(db, "courses", f"course:{course_id}")
 
         logger.info(f"✅ Обновлён курс ID={course_id}")
 
@@ -148,16 +159,16 @@ async def update_course(course_id: int, data: CourseUpdate) -> dict:
 
 async def delete_course(course_id: int) -> dict:
     """Удаление курса"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Проверяем существование курса
-        cursor.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
+        cursor = await db.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Курс с ID {course_id} не найден")
 
         # Удаляем курс (каскадно удалятся все связанные занятия и участники)
-        cursor.execute("DELETE FROM courses WHERE id = ?", (course_id,))
+        await db.execute("DELETE FROM courses WHERE id = ?", (course_id,))
+        # Каскадно удалены и занятия курса: сбрасываем список расписания и их карточки
+        invalidate_on_commit(db, "courses", f"course:{course_id}", "schedule", f"course_slots:{course_id}")
 
         logger.info(f"🗑️  Удалён курс ID={course_id}")
 
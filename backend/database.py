@@ -1,92 +1,324 @@
 import sqlite3
 import os
-from contextlib import contextmanager
+import logging
+import queue
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from migrations import run_migrations, latest_version
+
+logger = logging.getLogger(__name__)
 
 DATABASE_PATH = os.getenv("DATABASE_PATH", "./database.db")
 
+# Настройки пула подключений
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))  # 256 МБ
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(64 * 1024)))  # 64 МБ на подключение
+
+# Сколько запросов к БД одновременно выполняется из async-обработчиков
+DB_MAX_CONCURRENCY = int(os.getenv("DB_MAX_CONCURRENCY", str(DB_POOL_SIZE)))
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул SQLite подключений.
+    Каждое подключение настраивается один раз при создании (PRAGMA),
+    дальше переиспользуется между запросами.
+    """
+
+    def __init__(self, database_path: str, size: int = DB_POOL_SIZE, timeout: float = DB_POOL_TIMEOUT):
+        self.database_path = database_path
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """Создание и однократная настройка подключения"""
+        conn = sqlite3.connect(
+            self.database_path,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        """Взять подключение из пула (ждёт, если все заняты)"""
+        started = time.perf_counter()
+        conn = None
+
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+            if can_create:
+                try:
+                    conn = self._create_connection()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    conn = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    with self._lock:
+                        self._timeouts += 1
+                    raise TimeoutError(
+                        f"Нет свободных подключений к БД за {self.timeout} с (размер пула: {self.size})"
+                    )
+                with self._lock:
+                    self._waits += 1
+
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._checkouts += 1
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+        return conn
+
+    def release(self, conn: sqlite3.Connection, broken: bool = False):
+        """Вернуть подключение в пул"""
+        with self._lock:
+            self._in_use -= 1
+
+        if broken:
+            self._discard(conn)
+            return
+
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            self._discard(conn)
+
+    def _discard(self, conn: sqlite3.Connection):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close_all(self):
+        """Закрыть все простаивающие подключения"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self) -> dict:
+        """Метрики пула: ожидание выдачи и загрузка"""
+        with self._lock:
+            checkouts = self._checkouts
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "peak_in_use": self._peak_in_use,
+                "utilization": round(self._in_use / self.size, 3) if self.size else 0.0,
+                "checkouts": checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "avg_wait_ms": round(self._total_wait / checkouts * 1000, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self._max_wait * 1000, 3)
+            }
+
+
+_pool = ConnectionPool(DATABASE_PATH)
+
+# Подключение, уже выданное текущему потоку/задаче: вложенные get_db() работают в той же транзакции
+_current_conn: ContextVar = ContextVar("current_db_connection", default=None)
+
 
 @contextmanager
 def get_db():
     """Context manager для подключения к БД"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    outer = _current_conn.get()
+    if outer is not None:
+        # Вложенный вызов: коммит/откат делает внешний get_db()
+        yield outer
+        return
+
+    conn = _pool.acquire()
+    token = _current_conn.set(conn)
+    broken = False
     try:
         yield conn
         conn.commit()
     except Exception:
-        conn.rollback()
+        try:
+            conn.rollback()
+        except sqlite3.Error:
+            broken = True
         raise
     finally:
-        conn.close()
+        _current_conn.reset(token)
+        _pool.release(conn, broken=broken)
+
+
+# ========== АСИНХРОННЫЙ ДОСТУП ==========
+
+# Отдельный пул потоков для SQLite: event loop не ждёт диск и блокировки записи
+_db_executor = ThreadPoolExecutor(max_workers=DB_MAX_CONCURRENCY, thread_name_prefix="db")
+_db_semaphore = asyncio.Semaphore(DB_MAX_CONCURRENCY)
+_current_async_db: ContextVar = ContextVar("current_async_db", default=None)
+
+
+class BufferedCursor:
+    """Результат запроса, полностью прочитанный в потоке БД"""
+
+    def __init__(self, rows: list, lastrowid: int, rowcount: int):
+        self.rows = rows
+        self.lastrowid = lastrowid
+        self.rowcount = rowcount
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self) -> list:
+        return self.rows
+
+
+def _execute_buffered(conn: sqlite3.Connection, sql: str, params) -> BufferedCursor:
+    cursor = conn.execute(sql, params)
+    rows = cursor.fetchall()
+    return BufferedCursor(rows, cursor.lastrowid, cursor.rowcount)
+
+
+def _executemany_buffered(conn: sqlite3.Connection, sql: str, seq_of_params) -> BufferedCursor:
+    cursor = conn.executemany(sql, seq_of_params)
+    return BufferedCursor([], cursor.lastrowid, cursor.rowcount)
+
+
+def _call_with_connection(conn: sqlite3.Connection, func, args, kwargs):
+    # Синхронный код внутри func, вызывающий get_db(), попадёт в ту же транзакцию
+    token = _current_conn.set(conn)
+    try:
+        return func(conn, *args, **kwargs)
+    finally:
+        _current_conn.reset(token)
+
+
+async def _in_db_thread(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, func, *args)
+
+
+class AsyncConnection:
+    """Обёртка над подключением из пула: все операции выполняются в потоке БД"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._on_commit = []
+
+    def on_commit(self, callback):
+        """Вызвать callback() после успешного коммита внешней транзакции (сброс кэшей и т.п.)"""
+        self._on_commit.append(callback)
+
+    async def execute(self, sql: str, params=()) -> BufferedCursor:
+        return await _in_db_thread(_execute_buffered, self._conn, sql, params)
+
+    async def executemany(self, sql: str, seq_of_params) -> BufferedCursor:
+        return await _in_db_thread(_executemany_buffered, self._conn, sql, list(seq_of_params))
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить func(conn, *args, **kwargs) в потоке БД в рамках текущей транзакции"""
+        return await _in_db_thread(_call_with_connection, self._conn, func, args, kwargs)
+
+
+@asynccontextmanager
+async def get_db_async():
+    """Асинхронный context manager для подключения к БД (не блокирует event loop)"""
+    outer = _current_async_db.get()
+    if outer is not None:
+        # Вложенный вызов: коммит/откат делает внешний get_db_async()
+        yield outer
+        return
+
+    async with _db_semaphore:
+        conn = await _in_db_thread(_pool.acquire)
+        db = AsyncConnection(conn)
+        token = _current_async_db.set(db)
+        broken = False
+        try:
+            yield db
+            await _in_db_thread(conn.commit)
+        except BaseException:
+            try:
+                await _in_db_thread(conn.rollback)
+            except Exception:
+                broken = True
+            raise
+        finally:
+            _current_async_db.reset(token)
+            _pool.release(conn, broken=broken)
+
+    for callback in db._on_commit:
+        try:
+            callback()
+        except Exception:
+            logger.exception("Ошибка в обработчике после коммита")
+
+
+async def run_in_db(func, *args, **kwargs):
+    """Выполнить синхронную функцию, работающую с get_db(), в потоке БД"""
+    outer = _current_async_db.get()
+    if outer is not None:
+        return await outer.run(lambda conn: func(*args, **kwargs))
+
+    async with _db_semaphore:
+        return await _in_db_thread(lambda: func(*args, **kwargs))
 
 
 def init_db():
-    """Инициализация базы данных с созданием всех необходимых таблиц"""
+    """Инициализация базы данных: проверка версии схемы и применение недостающих миграций"""
     with get_db() as conn:
-        cursor = conn.cursor()
-
-        # Таблица пользователей (с telegram_id)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                email TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                full_name TEXT NOT NULL,
-                telegram_id TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Таблица курсов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS courses (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                description TEXT,
-                instructor TEXT,
-                start_date TEXT,
-                end_date TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        # Таблица слотов (занятий)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS class_slots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                course_id INTEGER,
-                title TEXT NOT NULL,
-                date_time TEXT NOT NULL,
-                location TEXT,
-                instructor TEXT,
-                max_participants INTEGER,
-                status TEXT DEFAULT 'scheduled',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
-            )
-        """)
-
-        # Таблица участников
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS participants (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                class_slot_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                status TEXT DEFAULT 'registered',
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(class_slot_id, user_id),
-                FOREIGN KEY (class_slot_id) REFERENCES class_slots(id) ON DELETE CASCADE,
-                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-            )
-        """)
-
-        # Проверяем, существует ли колонка telegram_id в users
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in cursor.fetchall()]
-
-        if 'telegram_id' not in columns:
-            print("⚠️  Добавление колонки telegram_id в таблицу users...")
-            cursor.execute("ALTER TABLE users ADD COLUMN telegram_id TEXT")
-            print("✅ Колонка telegram_id добавлена")
+        applied = run_migrations(conn)
 
+    if applied:
+        print(f"✅ База данных обновлена до версии {latest_version()}")
+    else:
         print("✅ База данных инициализирована")
+
+
+def get_pool_stats() -> dict:
+    """Статистика пула подключений"""
+    stats = _pool.stats()
+    stats["max_concurrency"] = DB_MAX_CONCURRENCY
+    return stats
+
+
+def close_pool():
+    """Закрытие подключений пула (при остановке приложения)"""
+    _db_executor.shutdown(wait=True)
+    _pool.close_all()
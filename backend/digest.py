@@ -0,0 +1,136 @@
+"""
+Режим сводок: вместо сообщения на каждое событие пользователь получает одну
+сводку за день или неделю. События копятся в digest_events (outbox.enqueue_notifications),
+планировщик в назначенное время превращает их в строки outbox.
+"""
+
+import asyncio
+import json
+import os
+import logging
+from datetime import datetime, timedelta
+from database import get_db_async
+from outbox import enqueue_notifications
+from message_templates import render_digest
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_MODES = ("instant", "daily", "weekly")
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "8"))  # час отправки сводок (локальное время)
+DIGEST_WEEKDAY = int(os.getenv("DIGEST_WEEKDAY", "0"))  # день недельной сводки, 0 — понедельник
+DIGEST_USER_BATCH = 500
+
+
+def collapse_events(rows: list) -> list:
+    """Одна строка сводки на занятие: итоговое состояние, «новое» остаётся новым"""
+    by_slot = {}
+    for event_type, slot_id, payload in rows:
+        key = slot_id if slot_id is not None else ("event", len(by_slot))
+        previous = by_slot.get(key)
+        if previous is not None and previous[0] == "new":
+            event_type = "new"
+        by_slot[key] = (event_type, payload)
+    return list(by_slot.values())
+
+
+async def _flush_users(db, users: list) -> int:
+    """Сводки пользователям users [(user_id, telegram_id, locale)] и удаление их событий"""
+    queued = 0
+    user_ids = [row[0] for row in users]
+    placeholders = ", ".join("?" for _ in user_ids)
+    # События забираются одним DELETE ... RETURNING: планировщик работает в каждом
+    # процессе API, и при раздельных SELECT и DELETE два процесса успевали прочитать
+    # одни и те же события и отправить сводку дважды. DELETE берёт блокировку записи,
+    # поэтому второй процесс дождётся коммита и получит уже пустой набор.
+    cursor = await db.execute(f"""
+        DELETE FROM digest_events
+        WHERE user_id IN ({placeholders})
+        RETURNING id, user_id, event_type, slot_id, payload
+    """, user_ids)
+
+    events_by_user = {}
+    # Порядок строк RETURNING не определён — сортируем сами
+    for event_id, user_id, event_type, slot_id, payload in sorted(cursor.fetchall(), key=lambda row: (row[1], row[0])):
+        events_by_user.setdefault(user_id, []).append((event_type, slot_id, json.loads(payload)))
+
+    # Постановка сводок — в той же транзакции, что и удаление событий
+    for user_id, chat_id, locale in users:
+        events = events_by_user.get(user_id)
+        if not events or not chat_id:
+            continue
+        recipient = [{"id": user_id, "telegram_chat_id": chat_id}]
+        for part in render_digest(collapse_events(events), locale):
+            queued += await enqueue_notifications(db, "digest", None, recipient, {"text": part})
+    return queued
+
+
+async def flush_digests(mode: str) -> int:
+    """Сводки всем пользователям режима mode; возвращает число поставленных сообщений"""
+    queued = 0
+    last_user_id = 0
+    while True:
+        async with get_db_async() as db:
+            cursor = await db.execute("""
+                SELECT DISTINCT d.user_id, u.telegram_id, u.locale
+                FROM digest_events d
+                INNER JOIN users u ON u.id = d.user_id
+                WHERE u.notification_mode = ? AND d.user_id > ?
+                ORDER BY d.user_id
+                LIMIT ?
+            """, (mode, last_user_id, DIGEST_USER_BATCH))
+            users = cursor.fetchall()
+            if not users:
+                break
+            last_user_id = users[-1][0]
+            queued += await _flush_users(db, users)
+
+    if queued:
+        logger.info(f"📋 Сводки ({mode}): поставлено сообщений {queued}")
+    return queued
+
+
+async def flush_user_digest(db, user_id: int) -> int:
+    """
+    Сводка одного пользователя сразу — при смене режима уведомлений.
+    Иначе события, накопленные в прежнем режиме, не попадут ни в одну сводку.
+    """
+    cursor = await db.execute("""
+        SELECT DISTINCT d.user_id, u.telegram_id, u.locale
+        FROM digest_events d
+        INNER JOIN users u ON u.id = d.user_id
+        WHERE d.user_id = ?
+    """, (user_id,))
+    users = cursor.fetchall()
+    if not users:
+        return 0
+    return await _flush_users(db, users)
+
+
+def next_flush_at(now: datetime) -> datetime:
+    flush_at = now.replace(hour=DIGEST_HOUR, minute=0, second=0, microsecond=0)
+    if flush_at <= now:
+        flush_at += timedelta(days=1)
+    return flush_at
+
+
+async def digest_scheduler():
+    """Фоновая задача: ежедневные сводки в DIGEST_HOUR, недельные — в DIGEST_WEEKDAY"""
+    while True:
+        now = datetime.now()
+        flush_at = next_flush_at(now)
+        await asyncio.sleep((flush_at - now).total_seconds())
+        try:
+            await flush_digests("daily")
+            if flush_at.weekday() == DIGEST_WEEKDAY:
+                await flush_digests("weekly")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки сводок: {e}")
+
+
+async def get_digest_stats() -> dict:
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT COUNT(*), COUNT(DISTINCT user_id) FROM digest_events")
+        events, users = cursor.fetchone()
+    return {"pending_events": events, "pending_users": users, "hour": DIGEST_HOUR, "weekday": DIGEST_WEEKDAY}
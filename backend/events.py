@@ -0,0 +1,150 @@
+import asyncio
+import json
+import os
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Ограничения на один процесс (uvicorn worker)
+SSE_MAX_SUBSCRIBERS = int(os.getenv("SSE_MAX_SUBSCRIBERS", "2000"))
+SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscriber:
+    """Подписчик SSE: ограниченная очередь событий"""
+
+    def __init__(self, queue_size: int):
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        # Клиент не успевает читать: вместо неограниченного буфера отключаем его,
+        # после переподключения он догоняет через /api/schedule/changes
+        self.overflowed = False
+
+
+class EventBroker:
+    """Рассылка событий расписания всем открытым SSE-подключениям процесса"""
+
+    def __init__(self, max_subscribers: int = SSE_MAX_SUBSCRIBERS, queue_size: int = SSE_QUEUE_SIZE):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._next_id = 0
+        self.published = 0
+        self.dropped_subscribers = 0
+        self.rejected_subscribers = 0
+
+    def has_capacity(self) -> bool:
+        """Проверка до начала ответа (для 503); место занимает только subscribe()"""
+        if len(self._subscribers) >= self.max_subscribers:
+            self.rejected_subscribers += 1
+            return False
+        return True
+
+    def subscribe(self) -> Subscriber:
+        if len(self._subscribers) >= self.max_subscribers:
+            self.rejected_subscribers += 1
+            raise TooManySubscribers()
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def publish(self, event_type: str, data: dict):
+        """Неблокирующая публикация: медленные подписчики отключаются, а не тормозят остальных"""
+        self._next_id += 1
+        event = (self._next_id, event_type, data)
+        self.published += 1
+
+        for subscriber in list(self._subscribers):
+            if subscriber.overflowed:
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscriber.overflowed = True
+                self.dropped_subscribers += 1
+                self._subscribers.discard(subscriber)
+                logger.warning("⚠️ SSE: подписчик не успевает читать события, отключаем")
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "max_subscribers": self.max_subscribers,
+            "queue_size": self.queue_size,
+            "published": self.published,
+            "dropped_subscribers": self.dropped_subscribers,
+            "rejected_subscribers": self.rejected_subscribers
+        }
+
+
+broker = EventBroker()
+
+
+def format_sse(event_type: str, data: dict, event_id: Optional[int] = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def event_stream(request):
+    """
+    Генератор SSE-потока для одного клиента.
+    Подписка — внутри генератора: если клиент отключился до первой итерации,
+    генератор не запускается и подписчик не создаётся, иначе его освобождает finally.
+    """
+    try:
+        subscriber = broker.subscribe()
+    except TooManySubscribers:
+        # Места закончились между проверкой в обработчике и первой итерацией
+        yield "retry: 30000\n\n" + format_sse("overflow", {"message": "Слишком много подключений, переподключитесь позже"})
+        return
+
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            if subscriber.overflowed:
+                yield format_sse("overflow", {"message": "Слишком медленное чтение, переподключитесь"})
+                break
+            if await request.is_disconnected():
+                break
+
+            try:
+                event_id, event_type, data = await asyncio.wait_for(
+                    subscriber.queue.get(), timeout=SSE_HEARTBEAT_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # Комментарий-пинг держит соединение через прокси
+                yield ": ping\n\n"
+                continue
+
+            yield format_sse(event_type, data, event_id)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+# ========== СОБЫТИЯ ЗАНЯТИЙ ==========
+
+def publish_slot_created(slot: dict):
+    broker.publish("slot_created", dict(slot))
+
+
+def publish_slot_updated(slot: dict):
+    broker.publish("slot_updated", dict(slot))
+
+
+def publish_slot_status_changed(slot: dict, old_status: str):
+    broker.publish("slot_status_changed", {**slot, "old_status": old_status})
+
+
+def publish_slot_deleted(slot_id: int):
+    broker.publish("slot_deleted", {"id": slot_id})
@@ -0,0 +1,167 @@
+"""
+Локальная замена Telegram Bot API для тестов и бенчмарков рассылки.
+
+Имитирует задержку ответа, флуд-контроль (429 + retry_after) и ошибки
+«chat not found» / «bot was blocked». Запуск:
+
+    python fake_telegram_api.py --port 8081 --latency-ms 50 --rate 30
+
+и в .env: TELEGRAM_API_BASE_URL=http://127.0.0.1:8081/bot
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from rate_limiter import TokenBucket, KeyedTokenBuckets
+
+# Параметры имитации (переопределяются аргументами командной строки)
+FAKE_TG_LATENCY_MS = float(os.getenv("FAKE_TG_LATENCY_MS", "50"))
+FAKE_TG_JITTER_MS = float(os.getenv("FAKE_TG_JITTER_MS", "20"))
+FAKE_TG_RATE = float(os.getenv("FAKE_TG_RATE", "30"))  # сообщений/с на бота, 0 — без лимита
+FAKE_TG_CHAT_RATE = float(os.getenv("FAKE_TG_CHAT_RATE", "1"))  # сообщений/с в один чат, 0 — без лимита
+FAKE_TG_RETRY_AFTER = int(os.getenv("FAKE_TG_RETRY_AFTER", "1"))  # секунд
+FAKE_TG_NOT_FOUND_PERCENT = int(os.getenv("FAKE_TG_NOT_FOUND_PERCENT", "0"))
+FAKE_TG_BLOCKED_PERCENT = int(os.getenv("FAKE_TG_BLOCKED_PERCENT", "0"))
+
+app = FastAPI(title="Fake Telegram Bot API")
+
+_state = {}
+
+
+def reset_state():
+    _state.update({
+        "global_bucket": TokenBucket(FAKE_TG_RATE, FAKE_TG_RATE) if FAKE_TG_RATE > 0 else None,
+        "chat_buckets": KeyedTokenBuckets(FAKE_TG_CHAT_RATE, FAKE_TG_CHAT_RATE) if FAKE_TG_CHAT_RATE > 0 else None,
+        "message_id": 0,
+        "stats": {
+            "requests": 0,
+            "delivered": 0,
+            "rate_limited": 0,
+            "chat_not_found": 0,
+            "blocked": 0,
+            "started_at": time.time()
+        }
+    })
+
+
+reset_state()
+
+
+def _ok(result) -> JSONResponse:
+    return JSONResponse({"ok": True, "result": result})
+
+
+def _error(status_code: int, description: str, retry_after: int = None) -> JSONResponse:
+    body = {"ok": False, "error_code": status_code, "description": description}
+    if retry_after is not None:
+        body["parameters"] = {"retry_after": retry_after}
+    return JSONResponse(body, status_code=status_code)
+
+
+async def _read_params(request: Request) -> dict:
+    content_type = request.headers.get("content-type", "")
+    if "application/json" in content_type:
+        return await request.json()
+    if "form" in content_type:
+        return dict(await request.form())
+    return dict(request.query_params)
+
+
+@app.get("/stats")
+async def stats():
+    result = dict(_state["stats"])
+    elapsed = time.time() - result.pop("started_at")
+    result["elapsed_seconds"] = round(elapsed, 3)
+    result["delivered_per_second"] = round(result["delivered"] / elapsed, 1) if elapsed else 0.0
+    return result
+
+
+@app.post("/reset")
+async def reset():
+    reset_state()
+    return {"ok": True}
+
+
+@app.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    params = await _read_params(request)
+    stats = _state["stats"]
+    stats["requests"] += 1
+
+    if method == "getMe":
+        return _ok({"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"})
+    if method != "sendMessage":
+        return _ok(True)
+
+    latency = max(0.0, random.gauss(FAKE_TG_LATENCY_MS, FAKE_TG_JITTER_MS)) / 1000
+    await asyncio.sleep(latency)
+
+    chat_id = int(params.get("chat_id", 0))
+
+    global_bucket = _state["global_bucket"]
+    chat_buckets = _state["chat_buckets"]
+    if (global_bucket and not global_bucket.try_acquire()) or \
+            (chat_buckets and not chat_buckets.get(chat_id).try_acquire()):
+        stats["rate_limited"] += 1
+        return _error(429, f"Too Many Requests: retry after {FAKE_TG_RETRY_AFTER}", FAKE_TG_RETRY_AFTER)
+
+    # Детерминированно по chat_id: одни и те же «мёртвые» чаты между прогонами
+    if abs(chat_id) % 100 < FAKE_TG_NOT_FOUND_PERCENT:
+        stats["chat_not_found"] += 1
+        return _error(400, "Bad Request: chat not found")
+    if abs(chat_id) % 100 >= 100 - FAKE_TG_BLOCKED_PERCENT:
+        stats["blocked"] += 1
+        return _error(403, "Forbidden: bot was blocked by the user")
+
+    _state["message_id"] += 1
+    stats["delivered"] += 1
+    entities = params.get("entities")
+    return _ok({
+        "message_id": _state["message_id"],
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "text": params.get("text", ""),
+        "entities": json.loads(entities) if isinstance(entities, str) else []
+    })
+
+
+def main():
+    global FAKE_TG_LATENCY_MS, FAKE_TG_JITTER_MS, FAKE_TG_RATE, FAKE_TG_CHAT_RATE, FAKE_TG_RETRY_AFTER, \
+        FAKE_TG_NOT_FOUND_PERCENT, FAKE_TG_BLOCKED_PERCENT
+
+    parser = argparse.ArgumentParser(description="Локальная замена Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=FAKE_TG_LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=FAKE_TG_JITTER_MS)
+    parser.add_argument("--rate", type=float, default=FAKE_TG_RATE, help="сообщений/с на бота, 0 — без лимита")
+    parser.add_argument("--chat-rate", type=float, default=FAKE_TG_CHAT_RATE, help="сообщений/с в чат, 0 — без лимита")
+    parser.add_argument("--retry-after", type=int, default=FAKE_TG_RETRY_AFTER)
+    parser.add_argument("--not-found-percent", type=int, default=FAKE_TG_NOT_FOUND_PERCENT)
+    parser.add_argument("--blocked-percent", type=int, default=FAKE_TG_BLOCKED_PERCENT)
+    args = parser.parse_args()
+
+    FAKE_TG_LATENCY_MS = args.latency_ms
+    FAKE_TG_JITTER_MS = args.jitter_ms
+    FAKE_TG_RATE = args.rate
+    FAKE_TG_CHAT_RATE = args.chat_rate
+    FAKE_TG_RETRY_AFTER = args.retry_after
+    FAKE_TG_NOT_FOUND_PERCENT = args.not_found_percent
+    FAKE_TG_BLOCKED_PERCENT = args.blocked_percent
+    reset_state()
+
+    print(f"🤖 Fake Telegram Bot API: http://{args.host}:{args.port}/bot")
+    print(f"   Задержка: {FAKE_TG_LATENCY_MS}±{FAKE_TG_JITTER_MS} мс, лимит: {FAKE_TG_RATE}/с, "
+          f"в чат: {FAKE_TG_CHAT_RATE}/с, retry_after: {FAKE_TG_RETRY_AFTER} с")
+    print(f"   chat not found: {FAKE_TG_NOT_FOUND_PERCENT}%, blocked: {FAKE_TG_BLOCKED_PERCENT}%")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
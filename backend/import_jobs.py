@@ -0,0 +1,516 @@
+"""
+Фоновый импорт расписания из Excel.
+
+Загрузка пишется на диск частями и сразу возвращает id задачи. Разбор и запись в БД
+идут в пуле процессов (контекст spawn: дочерние процессы не наследуют event loop,
+потоки и подключения API), поэтому большой файл не блокирует обработку запросов.
+Дочерний процесс присылает прогресс и ошибки строк через очередь; состояние задач
+хранится в памяти процесса API (GET /api/schedule/upload/{job_id}).
+
+Пакетный импорт (несколько книг и/или все листы книги) разбирает каждый лист
+в отдельной задаче пула — параллельно по ядрам. Результаты сливаются в порядке
+файлов и листов (а не завершения разбора), точные дубликаты отбрасываются,
+конфликты попадают в отчёт задачи; затем всё пишется пачками (save_schedule_entries).
+
+При загрузке считается sha256 файла (для пакета — по всем файлам): если такой файл
+уже импортировался, задача сразу завершается без разбора (skipped). Иначе
+save_schedule_entries применяет к БД только разницу с текущим расписанием.
+"""
+
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Optional
+from fastapi import HTTPException, UploadFile
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(os.cpu_count() or 2)))
+IMPORT_UPLOAD_DIR = os.getenv("IMPORT_UPLOAD_DIR") or tempfile.gettempdir()
+IMPORT_MAX_UPLOAD_MB = int(os.getenv("IMPORT_MAX_UPLOAD_MB", "50"))
+IMPORT_CHUNK_SIZE = 1024 * 1024  # байт за одно чтение загрузки
+# Сколько ошибок строк и конфликтов хранить в задаче (остальные только считаются)
+IMPORT_MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "200"))
+# Сколько завершённых задач помнить
+IMPORT_JOBS_KEEP = int(os.getenv("IMPORT_JOBS_KEEP", "100"))
+# Как часто (в разобранных строках) дочерний процесс сообщает прогресс
+IMPORT_PROGRESS_EVERY = 1000
+
+JOB_FINISHED = ("done", "failed")
+
+_jobs = OrderedDict()  # job_id -> состояние задачи
+_jobs_lock = threading.Lock()
+_executor: Optional[ProcessPoolExecutor] = None
+_progress_queue = None
+_watchers = set()
+
+
+# ========== ДОЧЕРНИЙ ПРОЦЕСС ==========
+
+_worker_queue = None
+
+
+def _init_worker(progress_queue):
+    global _worker_queue
+    _worker_queue = progress_queue
+
+
+def _report(job_id: str, **fields):
+    _worker_queue.put((job_id, fields))
+
+
+def run_import(job_id: str, file_path: str, file_hash: Optional[str] = None,
+               filename: Optional[str] = None) -> dict:
+    """Разбор и запись файла (выполняется в процессе пула)"""
+    from parser import parse_excel_schedule
+    from schedule_api import save_schedule_entries
+
+    _report(job_id, status="running", started_at=time.time())
+    parsed = 0
+    errors_total = 0
+
+    def on_error(row: int, message: str):
+        nonlocal errors_total
+        errors_total += 1
+        if errors_total <= IMPORT_MAX_ERRORS:
+            _report(job_id, row_error={"row": row, "error": message})
+
+    def counted(entries):
+        nonlocal parsed
+        for entry in entries:
+            parsed += 1
+            if parsed % IMPORT_PROGRESS_EVERY == 0:
+                _report(job_id, rows_parsed=parsed)
+            yield entry
+
+    stats = save_schedule_entries(
+        counted(parse_excel_schedule(file_path, stream=True, on_error=on_error)),
+        on_batch=lambda rows: _report(job_id, rows_parsed=parsed, rows_saved=rows),
+        file_hash=file_hash,
+        filename=filename
+    )
+    stats["rows_parsed"] = parsed
+    stats["errors_total"] = errors_total
+    return stats
+
+
+def parse_unit(file_path: str, sheet_name: Optional[str]) -> dict:
+    """Разбор одного листа для пакетного импорта (выполняется в процессе пула)"""
+    from parser import parse_excel_schedule
+
+    errors = []
+    entries = parse_excel_schedule(
+        file_path, sheet_name=sheet_name,
+        on_error=lambda row, message: errors.append((row, message))
+    )
+    return {"entries": entries, "errors": errors}
+
+
+# ========== СЛИЯНИЕ ПАКЕТА ==========
+
+def _describe(entry: dict, source: dict) -> dict:
+    return {
+        "subject": entry["subject"],
+        "teacher": entry.get("teacher"),
+        "room": entry.get("room"),
+        "course_name": entry["course_name"],
+        **source
+    }
+
+
+def merge_units(units: List[tuple]) -> tuple:
+    """
+    Слияние разобранных листов [(source, entries), ...] в заданном порядке.
+    source — {"file": ..., "sheet": ...}. Точные дубликаты (тот же курс, день, пара,
+    предмет, преподаватель, аудитория) пропускаются. Конфликты сообщаются, но строки
+    сохраняются: разные занятия одного курса в одну пару (type = "course") и разные
+    курсы в одной аудитории в одну пару (type = "room").
+    Возвращает (entries, duplicates, conflicts).
+    """
+    merged = []
+    duplicates = 0
+    conflicts = []
+    seen = set()
+    by_course_slot = {}  # (курс, день, пара) -> (entry, source)
+    by_room_slot = {}  # (аудитория, день, пара) -> (entry, source)
+
+    for source, entries in units:
+        for entry in entries:
+            key = (entry["course_name"], entry["day_of_week"], entry["time_slot"],
+                   entry["subject"], entry.get("teacher"), entry.get("room"))
+            if key in seen:
+                duplicates += 1
+                continue
+            seen.add(key)
+            merged.append(entry)
+
+            slot = (entry["day_of_week"], entry["time_slot"])
+            first = by_course_slot.setdefault((entry["course_name"], *slot), (entry, source))
+            if first[0] is not entry:
+                conflicts.append({
+                    "type": "course",
+                    "day_of_week": slot[0],
+                    "time_slot": slot[1],
+                    "first": _describe(*first),
+                    "second": _describe(entry, source)
+                })
+
+            if entry.get("room"):
+                first = by_room_slot.setdefault((entry["room"], *slot), (entry, source))
+                if first[0] is not entry and first[0]["course_name"] != entry["course_name"]:
+                    conflicts.append({
+                        "type": "room",
+                        "day_of_week": slot[0],
+                        "time_slot": slot[1],
+                        "first": _describe(*first),
+                        "second": _describe(entry, source)
+                    })
+
+    return merged, duplicates, conflicts
+
+
+# ========== ПРОЦЕСС API ==========
+
+def _listen_progress(progress_queue):
+    """Поток-приёмник сообщений о прогрессе от процессов пула"""
+    while True:
+        message = progress_queue.get()
+        if message is None:
+            return
+        job_id, fields = message
+        _update_job(job_id, **fields)
+
+
+def _update_job(job_id: str, final: bool = False, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return
+        # Сообщения из очереди могут прийти позже итога задачи — итог не перезаписываем
+        if job["status"] in JOB_FINISHED and not final:
+            return
+        row_error = fields.pop("row_error", None)
+        if row_error is not None:
+            job["errors_total"] += 1
+            if len(job["errors"]) < IMPORT_MAX_ERRORS:
+                job["errors"].append(row_error)
+        job.update(fields)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor, _progress_queue
+    if _executor is None:
+        context = multiprocessing.get_context("spawn")
+        _progress_queue = context.Queue()
+        _executor = ProcessPoolExecutor(
+            max_workers=IMPORT_WORKERS,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(_progress_queue,)
+        )
+        threading.Thread(
+            target=_listen_progress, args=(_progress_queue,), name="import-progress", daemon=True
+        ).start()
+    return _executor
+
+
+def _reset_broken_executor():
+    """Процесс пула упал (например, OOM): следующий импорт создаст новый пул"""
+    global _executor, _progress_queue
+    if _executor is not None and getattr(_executor, "_broken", False):
+        _executor.shutdown(wait=False)
+        _progress_queue.put(None)
+        _executor = None
+        _progress_queue = None
+
+
+def _snapshot(job: dict) -> dict:
+    result = dict(job)
+    result["errors"] = list(job["errors"])
+    if "conflicts" in job:
+        result["conflicts"] = list(job["conflicts"])
+    end = job["finished_at"] or time.time()
+    result["elapsed_seconds"] = round(end - (job["started_at"] or end), 3)
+    return result
+
+
+async def _save_upload(file: UploadFile) -> tuple:
+    """
+    Запись загрузки во временный файл частями по IMPORT_CHUNK_SIZE;
+    возвращает (путь, размер, sha256 содержимого)
+    """
+    limit = IMPORT_MAX_UPLOAD_MB * 1024 * 1024
+    fd, path = tempfile.mkstemp(suffix=".xlsx", dir=IMPORT_UPLOAD_DIR)
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(IMPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(status_code=413, detail=f"File is larger than {IMPORT_MAX_UPLOAD_MB} MB")
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, size, digest.hexdigest()
+
+
+async def _watch_job(job_id: str, future, file_path: str):
+    try:
+        stats = await future
+        _update_job(
+            job_id, final=True,
+            status="done",
+            rows_parsed=stats["rows_parsed"],
+            rows_saved=stats["rows"],
+            errors_total=stats["errors_total"],
+            stats=stats,
+            finished_at=time.time()
+        )
+        response_cache.invalidate("courses", "schedule")
+        logger.info(f"📥 Импорт {job_id}: {stats['rows']} строк, ошибок {stats['errors_total']}")
+    except BaseException as e:
+        # Транзакция импорта в дочернем процессе откатывается целиком
+        if isinstance(e, BrokenProcessPool):
+            _reset_broken_executor()
+        _update_job(job_id, final=True, status="failed", error=str(e) or type(e).__name__,
+                    finished_at=time.time())
+        logger.error(f"❌ Импорт {job_id} не выполнен: {e!r}")
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _register_job(**fields) -> dict:
+    job_id = uuid.uuid4().hex
+    job = {
+        "id": job_id,
+        "status": "queued",
+        "rows_parsed": 0,
+        "rows_saved": 0,
+        "errors_total": 0,
+        "errors": [],
+        "error": None,
+        "stats": None,
+        "created_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "skipped": False,
+        **fields
+    }
+    with _jobs_lock:
+        _jobs[job_id] = job
+        _trim_jobs()
+        return _snapshot(job)
+
+
+def _track(coro):
+    watcher = asyncio.create_task(coro)
+    _watchers.add(watcher)
+    watcher.add_done_callback(_watchers.discard)
+
+
+async def _skip_if_imported(file_hash: str, file_paths: List[str], **fields) -> Optional[dict]:
+    """Файл с таким sha256 уже импортирован: задача завершается сразу, без разбора"""
+    from schedule_api import find_previous_import
+    from database import run_in_db
+
+    previous = await run_in_db(find_previous_import, file_hash)
+    if previous is None:
+        return None
+    for file_path in file_paths:
+        os.unlink(file_path)
+    logger.info(f"📥 Импорт {fields.get('filename')} пропущен: файл уже загружался (импорт {previous['id']})")
+    now = time.time()
+    return _register_job(
+        status="done", skipped=True, file_hash=file_hash,
+        stats={"skipped": True, "previous_import": previous},
+        started_at=now, finished_at=now, **fields
+    )
+
+
+async def create_import_job(file: UploadFile) -> dict:
+    """Сохранить загрузку на диск и поставить импорт в пул процессов; возвращает задачу"""
+    file_path, size, file_hash = await _save_upload(file)
+
+    fields = {"kind": "single", "filename": file.filename, "size_bytes": size}
+    skipped = await _skip_if_imported(file_hash, [file_path], **fields)
+    if skipped:
+        return skipped
+
+    job = _register_job(file_hash=file_hash, **fields)
+    future = asyncio.wrap_future(
+        _get_executor().submit(run_import, job["id"], file_path, file_hash, file.filename)
+    )
+    _track(_watch_job(job["id"], future, file_path))
+    return job
+
+
+async def _run_batch_job(job_id: str, uploads: List[tuple], all_sheets: bool, file_hash: str):
+    """Пакетный импорт: листы разбираются параллельно в пуле, запись — пачками в API"""
+    from parser import list_sheets
+    from schedule_api import save_schedule_entries
+    from database import run_in_db
+
+    try:
+        _update_job(job_id, status="running", started_at=time.time())
+        loop = asyncio.get_running_loop()
+        executor = _get_executor()
+
+        sources = []
+        for filename, file_path in uploads:
+            sheets = await asyncio.to_thread(list_sheets, file_path) if all_sheets else [None]
+            sources.extend(({"file": filename, "sheet": sheet}, file_path) for sheet in sheets)
+        _update_job(job_id, units_total=len(sources))
+
+        units_done = 0
+        rows_parsed = 0
+
+        async def parse(source: dict, file_path: str) -> dict:
+            nonlocal units_done, rows_parsed
+            try:
+                result = await loop.run_in_executor(executor, parse_unit, file_path, source["sheet"])
+            except Exception as e:
+                raise RuntimeError(f"{source['file']} / {source['sheet'] or 'активный лист'}: {e}") from e
+            units_done += 1
+            rows_parsed += len(result["entries"])
+            _update_job(job_id, units_done=units_done, rows_parsed=rows_parsed)
+            for row, message in result["errors"]:
+                _update_job(job_id, row_error={**source, "row": row, "error": message})
+            return result
+
+        # gather сохраняет порядок задач — слияние не зависит от того, какой лист разобран первым
+        results = await asyncio.gather(*(parse(source, file_path) for source, file_path in sources))
+
+        entries, duplicates, conflicts = merge_units([
+            (source, result["entries"]) for (source, _), result in zip(sources, results)
+        ])
+        _update_job(
+            job_id,
+            duplicates=duplicates,
+            conflicts_total=len(conflicts),
+            conflicts=conflicts[:IMPORT_MAX_ERRORS]
+        )
+
+        stats = await run_in_db(
+            save_schedule_entries, entries,
+            on_batch=lambda rows: _update_job(job_id, rows_saved=rows),
+            file_hash=file_hash,
+            filename=", ".join(filename for filename, _ in uploads)
+        )
+        stats.update(rows_parsed=rows_parsed, duplicates=duplicates, conflicts_total=len(conflicts))
+        _update_job(job_id, final=True, status="done", rows_saved=stats["rows"], stats=stats,
+                    finished_at=time.time())
+        response_cache.invalidate("courses", "schedule")
+        logger.info(
+            f"📥 Пакетный импорт {job_id}: {len(sources)} листов, {stats['rows']} строк, "
+            f"дубликатов {duplicates}, конфликтов {len(conflicts)}"
+        )
+    except BaseException as e:
+        if isinstance(e, BrokenProcessPool):
+            _reset_broken_executor()
+        _update_job(job_id, final=True, status="failed", error=str(e) or type(e).__name__,
+                    finished_at=time.time())
+        logger.error(f"❌ Пакетный импорт {job_id} не выполнен: {e!r}")
+        if not isinstance(e, Exception):
+            raise
+    finally:
+        for _, file_path in uploads:
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
+
+
+async def create_batch_import_job(files: List[UploadFile], all_sheets: bool = True) -> dict:
+    """
+    Пакетный импорт нескольких книг; all_sheets — разбирать все листы каждой книги
+    (иначе только активный). Файлы сливаются в порядке загрузки.
+    """
+    uploads = []
+    size = 0
+    # Отпечаток пакета: файлы в порядке загрузки и режим листов
+    digest = hashlib.sha256(f"batch:all_sheets={all_sheets}".encode())
+    try:
+        for file in files:
+            file_path, file_size, file_hash = await _save_upload(file)
+            uploads.append((file.filename, file_path))
+            size += file_size
+            digest.update(file_hash.encode())
+    except BaseException:
+        for _, file_path in uploads:
+            os.unlink(file_path)
+        raise
+
+    fields = {
+        "kind": "batch",
+        "filename": ", ".join(filename for filename, _ in uploads),
+        "files": [filename for filename, _ in uploads],
+        "size_bytes": size
+    }
+    batch_hash = digest.hexdigest()
+    skipped = await _skip_if_imported(batch_hash, [file_path for _, file_path in uploads], **fields)
+    if skipped:
+        return skipped
+
+    job = _register_job(
+        file_hash=batch_hash,
+        **fields,
+        units_total=0,
+        units_done=0,
+        duplicates=0,
+        conflicts_total=0,
+        conflicts=[]
+    )
+    _track(_run_batch_job(job["id"], uploads, all_sheets, batch_hash))
+    return job
+
+
+def _trim_jobs():
+    finished = [job_id for job_id, job in _jobs.items() if job["status"] in JOB_FINISHED]
+    for job_id in finished[:max(0, len(finished) - IMPORT_JOBS_KEEP)]:
+        del _jobs[job_id]
+
+
+def get_import_job(job_id: str) -> Optional[dict]:
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return _snapshot(job) if job else None
+
+
+def get_import_stats() -> dict:
+    with _jobs_lock:
+        counts = {}
+        for job in _jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+    return {"workers": IMPORT_WORKERS, "jobs": counts}
+
+
+async def shutdown_import_jobs():
+    """Остановка пула при завершении приложения: ожидающие задачи отменяются"""
+    global _executor, _progress_queue
+    if _executor is None:
+        return
+    await asyncio.to_thread(_executor.shutdown, wait=True, cancel_futures=True)
+    _progress_queue.put(None)
+    _executor = None
+    _progress_queue = None
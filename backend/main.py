@@ -1,9 +1,12 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Query, Response, Cookie
+from fastapi import FastAPI, HTTPException, Depends, Header, UploadFile, File, Query, Request, Response, Cookie
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from typing import Optional, List
 from pydantic import BaseModel, EmailStr
 import uvicorn
+import asyncio
 import secrets
+from contextlib import asynccontextmanager
 import sqlite3
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
@@ -21,19 +24,32 @@ print(f"📂 База данных: {os.getenv('DATABASE_PATH', './database.db')
 print("=" * 60 + "\n")
 
 # ========== ИМПОРТЫ ==========
-from models import RegisterRequest, LoginRequest, TokenResponse, UserResponse, ClassSlotCreate, ClassSlotUpdate
+from models import RegisterRequest, LoginRequest, TokenResponse, UserResponse, ClassSlotCreate, ClassSlotUpdate, \
+    DeadLetterRetryRequest
 from auth import create_user, get_user_by_email, get_user_by_id, verify_password, create_access_token, decode_token, \
-    set_auth_cookie, hash_password
-from database import init_db, get_db
+    set_auth_cookie, hash_password, get_cached_user, cache_user, invalidate_user_cache, get_auth_cache_stats, is_admin
+from database import init_db, get_db_async, run_in_db, get_pool_stats, close_pool
 from courses_api import get_courses, create_course, get_course, update_course, delete_course, CourseCreate, \
     CourseUpdate, CourseResponse
-from slots_api import create_class_slot, get_class_slot, update_class_slot, delete_class_slot
+from slots_api import create_class_slot, get_class_slot, get_class_slots_page, update_class_slot, delete_class_slot
 from participants_api import get_participants, create_participant, get_participant, delete_participant
-from schedule_api import upload_schedule
+from schedule_api import upload_schedule, upload_schedule_batch
+from import_jobs import get_import_job, get_import_stats, shutdown_import_jobs
+from changes_api import get_changes, change_log_compactor
+from pagination import NEXT_CURSOR_HEADER, set_next_cursor
+from response_cache import response_cache, invalidate_on_commit, check_not_modified
+from outbox import enqueue_notifications, get_outbox_stats, list_dead_letters, retry_dead_letters, \
+    NOTIFICATION_WORKERS, OUTBOX_INPROCESS_DISPATCHER
+from reminders import reminder_scheduler
+from digest import digest_scheduler, flush_user_digest, get_digest_stats, NOTIFICATION_MODES
+from events import broker, event_stream, publish_slot_created, publish_slot_updated, \
+    publish_slot_status_changed, publish_slot_deleted
 
 # Импорт уведомлений с проверкой
+# Без модуля уведомлений строки outbox копятся в БД и будут отправлены после его появления
 try:
-    from notifications import notify_slot_created, notify_slot_status_changed
+    from notifications import outbox_dispatcher, get_telegram_stats, start_telegram_bot, stop_telegram_bot, \
+        configure_rate_share
 
     NOTIFICATIONS_ENABLED = True
     print("✅ Модуль уведомлений загружен успешно\n")
@@ -41,17 +57,43 @@ except Exception as e:
     print(f"⚠️  Модуль уведомлений не загружен: {e}\n")
     NOTIFICATIONS_ENABLED = False
 
+# ========== ПРИЛОЖЕНИЕ ==========
 
-    # Заглушки если модуль не загрузился
-    async def notify_slot_created(*args, **kwargs):
-        return {"success_count": 0, "failed_count": 0}
+# Фоновые задачи процесса (останавливаются при shutdown)
+_background_tasks = []
 
 
-    async def notify_slot_status_changed(*args, **kwargs):
-        return {"success_count": 0, "failed_count": 0}
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Ресурсы процесса: БД, Telegram Bot с общим HTTP пулом, фоновые задачи"""
+    init_db()
 
-# ========== ПРИЛОЖЕНИЕ ==========
-app = FastAPI(title="Умное расписание СурГУ", version="3.0.0")
+    # Один бот на процесс: его пул соединений делят диспетчер outbox и все рассылки
+    app.state.telegram_bot = await start_telegram_bot() if NOTIFICATIONS_ENABLED else None
+
+    _background_tasks.append(asyncio.create_task(change_log_compactor()))
+    _background_tasks.append(asyncio.create_task(reminder_scheduler.run()))
+    _background_tasks.append(asyncio.create_task(digest_scheduler()))
+    if NOTIFICATIONS_ENABLED and OUTBOX_INPROCESS_DISPATCHER:
+        # Рядом с воркерами диспетчер API получает свою долю общего лимита бота
+        configure_rate_share(NOTIFICATION_WORKERS + 1)
+        _background_tasks.append(asyncio.create_task(outbox_dispatcher()))
+    print("✅ СЕРВЕР ЗАПУЩЕН: http://0.0.0.0:8000")
+    print("📖 API Документация: http://0.0.0.0:8000/docs\n")
+
+    yield
+
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    await shutdown_import_jobs()
+    if NOTIFICATIONS_ENABLED:
+        await stop_telegram_bot()
+    close_pool()
+
+
+app = FastAPI(title="Умное расписание СурГУ", version="3.0.0", lifespan=lifespan)
 
 # CORS - РАЗРЕШАЕМ ВСЁ ДЛЯ РАЗРАБОТКИ
 app.add_middleware(
@@ -60,16 +102,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 
-@app.on_event("startup")
-def startup():
-    init_db()
-    print("✅ СЕРВЕР ЗАПУЩЕН: http://0.0.0.0:8000")
-    print("📖 API Документация: http://0.0.0.0:8000/docs\n")
-
-
 # ========== AUTH DEPENDENCY ==========
 async def get_current_user(authorization: Optional[str] = Header(None), access_token: Optional[str] = Cookie(None)):
     """Получение текущего пользователя из токена"""
@@ -77,22 +113,36 @@ async def get_current_user(authorization: Optional[str] = Header(None), access_t
         "Bearer ") else access_token or (authorization.split()[1] if authorization and " " in authorization else None)
     if not token:
         raise HTTPException(401, "Not authenticated")
+
+    # Токен уже проверялся недавно — без декодирования и без запроса к БД
+    user = get_cached_user(token)
+    if user:
+        return user
+
     payload = decode_token(token)
     if not payload:
         raise HTTPException(401, "Invalid token")
-    user = get_user_by_id(payload.get("user_id"))
+    user = await run_in_db(get_user_by_id, payload.get("user_id"))
     if not user:
         raise HTTPException(401, "User not found")
+    cache_user(token, user, payload.get("exp"))
     return user
 
 
+async def get_admin_user(u=Depends(get_current_user)):
+    """Текущий пользователь с правами администратора (ADMIN_EMAILS)"""
+    if not is_admin(u):
+        raise HTTPException(403, "Admin only")
+    return u
+
+
 # ========== AUTH ENDPOINTS ==========
 @app.post("/api/auth/register", response_model=TokenResponse, tags=["auth"])
 async def register(data: RegisterRequest, response: Response):
     """Регистрация нового пользователя"""
-    if get_user_by_email(data.email):
+    if await run_in_db(get_user_by_email, data.email):
         raise HTTPException(400, "Email exists")
-    user_id = create_user(data.email, data.password, data.full_name)
+    user_id = await run_in_db(create_user, data.email, data.password, data.full_name)
     token = create_access_token({"user_id": user_id})
     set_auth_cookie(response, token)
     return {
@@ -105,7 +155,7 @@ async def register(data: RegisterRequest, response: Response):
 @app.post("/api/auth/login", response_model=TokenResponse, tags=["auth"])
 async def login(data: LoginRequest, response: Response):
     """Вход пользователя"""
-    user = get_user_by_email(data.email)
+    user = await run_in_db(get_user_by_email, data.email)
     if not user or not verify_password(data.password, user["password_hash"]):
         raise HTTPException(401, "Invalid credentials")
     token = create_access_token({"user_id": user["id"]})
@@ -133,59 +183,93 @@ async def logout(response: Response):
 # ========== РАСПИСАНИЕ ==========
 @app.get("/api/schedule", response_model=List[dict], tags=["schedule"])
 async def get_schedule_list(
+        request: Request,
+        response: Response,
         date: Optional[str] = None,
         date_from: Optional[str] = None,
         date_to: Optional[str] = None,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[str] = None
 ):
-    """Получение расписания с фильтрами"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        query = """
-            SELECT id, title, date_time, location, instructor, status
-            FROM class_slots
-            WHERE 1=1
-        """
-        params = []
-
-        if date_from and date_to:
-            query += " AND date(date_time) >= ? AND date(date_time) <= ?"
-            params.extend([date_from, date_to])
-        elif date:
-            query += " AND date(date_time) = ?"
-            params.append(date)
-
-        real_limit = 2000 if (date_from or date_to) else limit
-        query += " ORDER BY date_time DESC LIMIT ? OFFSET ?"
-        params.extend([real_limit, offset])
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+    """
+    Получение расписания с фильтрами.
+    Постраничный вывод по ключу (start_at, id): курсор следующей страницы в заголовке X-Next-Cursor
+    """
+    not_modified = await check_not_modified(request, response, ["class_slots"])
+    if not_modified:
+        return not_modified
+
+    page = await response_cache.get_or_load(
+        response_cache.make_key(request),
+        ["schedule"],
+        lambda: get_class_slots_page(date, date_from, date_to, limit, offset, cursor)
+    )
+    set_next_cursor(response, page["next_cursor"])
+    return page["items"]
+
+
+@app.get("/api/schedule/changes", tags=["schedule"])
+async def get_schedule_changes(since: int = 0, limit: int = 1000):
+    """
+    Дельта-синхронизация: изменения занятий, курсов и записей участников после since.
+    Клиент сохраняет last_seq и передаёт его в следующем запросе;
+    при full_resync=true нужно заново загрузить данные целиком.
+    """
+    return await get_changes(since, limit)
 
-        return [
-            {
-                "id": r[0],
-                "title": r[1] or "Без названия",
-                "date_time": str(r[2]),
-                "room": r[3],
-                "teacher": r[4],
-                "status": r[5]
-            }
-            for r in rows
-        ]
 
+@app.get("/api/schedule/events", tags=["schedule"])
+async def schedule_events(request: Request):
+    """
+    Поток событий занятий (Server-Sent Events) вместо опроса /api/schedule:
+    slot_created, slot_updated, slot_status_changed, slot_deleted.
+    Медленный клиент получает событие overflow и должен догнать через /api/schedule/changes.
+    """
+    if not broker.has_capacity():
+        raise HTTPException(
+            status_code=503,
+            detail="Слишком много подключений к потоку событий",
+            headers={"Retry-After": "30"}
+        )
+
+    return StreamingResponse(
+        event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-@app.post("/api/schedule/upload", tags=["schedule"])
+
+@app.post("/api/schedule/upload", status_code=202, tags=["schedule"])
 async def upload_schedule_ep(file: UploadFile = File(...), u=Depends(get_current_user)):
-    """Загрузка расписания из Excel"""
+    """Загрузка расписания из Excel: импорт выполняется в фоне, в ответе — id задачи"""
     return await upload_schedule(file)
 
 
+@app.post("/api/schedule/upload/batch", status_code=202, tags=["schedule"])
+async def upload_schedule_batch_ep(
+        files: List[UploadFile] = File(...),
+        all_sheets: bool = True,
+        u=Depends(get_current_user)
+):
+    """Пакетная загрузка расписания: несколько книг и листов разбираются параллельно"""
+    return await upload_schedule_batch(files, all_sheets)
+
+
+@app.get("/api/schedule/upload/{job_id}", tags=["schedule"])
+async def upload_status_ep(job_id: str, u=Depends(get_current_user)):
+    """Прогресс импорта: статус, число разобранных и записанных строк, ошибки строк"""
+    job = get_import_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job
+
+
 @app.post("/api/schedule", response_model=dict, tags=["schedule"])
 async def create_slot_ep(data: ClassSlotCreate, u=Depends(get_current_user)):
     """
-    Создание занятия с автоматической отправкой Telegram уведомлений участникам курса
+    Создание занятия. Telegram уведомления участникам курса ставятся в очередь outbox
+    в той же транзакции и отправляются фоновым диспетчером
     """
     print("\n" + "=" * 60)
     print("📝 СОЗДАНИЕ НОВОГО СЛОТА")
@@ -196,22 +280,19 @@ async def create_slot_ep(data: ClassSlotCreate, u=Depends(get_current_user)):
     print(f"   Место: {data.location}")
 
     try:
-        # Создаём слот
-        slot = await create_class_slot(data)
-        print(f"✅ Слот создан: ID={slot['id']}")
-
-        # Получаем участников курса с telegram_chat_id
-        with get_db() as conn:
-            cursor = conn.cursor()
+        async with get_db_async() as db:
+            # Создаём слот (в общей транзакции с очередью уведомлений)
+            slot = await create_class_slot(data)
+            print(f"✅ Слот создан: ID={slot['id']}")
 
             # Получаем информацию о курсе
-            cursor.execute("SELECT name FROM courses WHERE id = ?", (data.course_id,))
+            cursor = await db.execute("SELECT name FROM courses WHERE id = ?", (data.course_id,))
             course = cursor.fetchone()
             course_name = course[0] if course else "Неизвестный курс"
             print(f"📚 Курс: {course_name}")
 
             # Получаем всех участников курса с Telegram ID
-            cursor.execute("""
+            cursor = await db.execute("""
                 SELECT DISTINCT u.id, u.full_name, u.telegram_id
                 FROM users u
                 WHERE u.telegram_id IS NOT NULL
@@ -223,16 +304,11 @@ async def create_slot_ep(data: ClassSlotCreate, u=Depends(get_current_user)):
                 )
             """, (data.course_id,))
 
-            participants_raw = cursor.fetchall()
-
             participants = [
                 {"id": row[0], "telegram_chat_id": row[2]}
-                for row in participants_raw
+                for row in cursor.fetchall()
             ]
-
             print(f"👥 Найдено участников с Telegram: {len(participants)}")
-            for row in participants_raw:
-                print(f"      - {row[1]} (chat_id: {row[2]})")
 
             # Формируем данные для уведомления
             slot_data = {
@@ -243,28 +319,17 @@ async def create_slot_ep(data: ClassSlotCreate, u=Depends(get_current_user)):
                 "status": "scheduled"
             }
 
-            notification_result = {"success_count": 0, "failed_count": 0}
+            queued = await enqueue_notifications(db, "new", slot["id"], participants, slot_data)
 
-            if participants and NOTIFICATIONS_ENABLED:
-                try:
-                    print(f"\n📤 Отправка Telegram уведомлений о новом занятии...")
-                    notification_result = await notify_slot_created(participants, slot_data)  # АСИНХРОННЫЙ ВЫЗОВ
-                    print(f"✅ Уведомления отправлены:")
-                    print(f"   ✓ Успешно: {notification_result['success_count']}")
-                    if notification_result['failed_count'] > 0:
-                        print(f"   ✗ Ошибок: {notification_result['failed_count']}")
-                        if notification_result.get('failed_chat_ids'):
-                            print(f"   Не удалось отправить на: {notification_result['failed_chat_ids']}")
-                except Exception as e:
-                    print(f"❌ Ошибка отправки уведомлений: {e}")
-                    traceback.print_exc()
-            elif not NOTIFICATIONS_ENABLED:
-                print("⚠️  Уведомления отключены (модуль не загружен)")
-            else:
-                print(f"⚠️  Нет участников с Telegram для курса ID={data.course_id}")
+        publish_slot_created(slot)
+        await reminder_scheduler.refresh_slot(slot["id"])
+
+        if queued:
+            print(f"📤 В очередь уведомлений поставлено: {queued}")
+        else:
+            print(f"⚠️  Нет участников с Telegram для курса ID={data.course_id}")
 
-            slot["notifications_sent"] = notification_result['success_count']
-            slot["notifications_failed"] = notification_result['failed_count']
+        slot["notifications_queued"] = queued
 
         print("=" * 60 + "\n")
         return slot
@@ -277,21 +342,28 @@ async def create_slot_ep(data: ClassSlotCreate, u=Depends(get_current_user)):
 
 
 @app.get("/api/schedule/{slot_id}", response_model=dict, tags=["schedule"])
-async def get_slot_ep(slot_id: int):
+async def get_slot_ep(slot_id: int, request: Request, response: Response):
     """Получение занятия по ID"""
-    return await get_class_slot(slot_id)
+    not_modified = await check_not_modified(request, response, ["class_slots"])
+    if not_modified:
+        return not_modified
+
+    return await response_cache.get_or_load(
+        response_cache.make_key(request),
+        lambda slot: [f"slot:{slot_id}", f"course_slots:{slot['course_id']}"],
+        lambda: get_class_slot(slot_id)
+    )
 
 
 @app.put("/api/schedule/{slot_id}", response_model=dict, tags=["schedule"])
 async def update_slot_ep(slot_id: int, data: ClassSlotUpdate, u=Depends(get_current_user)):
     """
-    Обновление занятия с автоматической отправкой Telegram уведомлений при изменении статуса
+    Обновление занятия. При изменении статуса Telegram уведомления участникам
+    ставятся в очередь outbox в той же транзакции, что и обновление
     """
-
-    # Получаем текущий статус до обновления
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
+    async with get_db_async() as db:
+        # Получаем текущий статус до обновления
+        cursor = await db.execute("""
             SELECT status, course_id, title, date_time, location 
             FROM class_slots 
             WHERE id = ?
@@ -308,50 +380,41 @@ async def update_slot_ep(slot_id: int, data: ClassSlotUpdate, u=Depends(get_curr
         date_time = current_slot[3]
         location = current_slot[4]
 
-    # Обновляем слот
-    updated_slot = await update_class_slot(slot_id, data)
+        # Обновляем слот
+        updated_slot = await update_class_slot(slot_id, data)
 
-    # Проверяем, изменился ли статус
-    new_status = data.status if data.status else old_status
+        # Проверяем, изменился ли статус
+        new_status = data.status if data.status else old_status
+        queued = 0
 
-    if new_status != old_status:
-        print("\n" + "=" * 60)
-        print("🔄 ИЗМЕНЕНИЕ СТАТУСА СЛОТА")
-        print("=" * 60)
-        print(f"   Слот ID: {slot_id}")
-        print(f"   Название: {title}")
-        print(f"   Старый статус: {old_status}")
-        print(f"   Новый статус: {new_status}")
-
-        try:
-            # Получаем информацию о курсе и участниках
-            with get_db() as conn:
-                cursor = conn.cursor()
-
-                cursor.execute("SELECT name FROM courses WHERE id = ?", (course_id,))
-                course = cursor.fetchone()
-                course_name = course[0] if course else "Неизвестный курс"
-                print(f"📚 Курс: {course_name}")
-
-                # Получаем участников ЭТОГО слота с Telegram ID
-                cursor.execute("""
-                    SELECT u.id, u.full_name, u.telegram_id
-                    FROM users u
-                    INNER JOIN participants p ON u.id = p.user_id
-                    WHERE p.class_slot_id = ?
-                    AND u.telegram_id IS NOT NULL
-                """, (slot_id,))
-
-                participants_raw = cursor.fetchall()
-
-                participants = [
-                    {"id": row[0], "telegram_chat_id": row[2]}
-                    for row in participants_raw
-                ]
-
-                print(f"👥 Найдено участников с Telegram: {len(participants)}")
-                for row in participants_raw:
-                    print(f"      - {row[1]} (chat_id: {row[2]})")
+        if new_status != old_status:
+            print("\n" + "=" * 60)
+            print("🔄 ИЗМЕНЕНИЕ СТАТУСА СЛОТА")
+            print("=" * 60)
+            print(f"   Слот ID: {slot_id}")
+            print(f"   Название: {title}")
+            print(f"   Старый статус: {old_status}")
+            print(f"   Новый статус: {new_status}")
+
+            cursor = await db.execute("SELECT name FROM courses WHERE id = ?", (course_id,))
+            course = cursor.fetchone()
+            course_name = course[0] if course else "Неизвестный курс"
+            print(f"📚 Курс: {course_name}")
+
+            # Получаем участников ЭТОГО слота с Telegram ID
+            cursor = await db.execute("""
+                SELECT u.id, u.full_name, u.telegram_id
+                FROM users u
+                INNER JOIN participants p ON u.id = p.user_id
+                WHERE p.class_slot_id = ?
+                AND u.telegram_id IS NOT NULL
+            """, (slot_id,))
+
+            participants = [
+                {"id": row[0], "telegram_chat_id": row[2]}
+                for row in cursor.fetchall()
+            ]
+            print(f"👥 Найдено участников с Telegram: {len(participants)}")
 
             # Формируем данные для уведомления
             slot_data = {
@@ -359,45 +422,28 @@ async def update_slot_ep(slot_id: int, data: ClassSlotUpdate, u=Depends(get_curr
                 "start_time": date_time,
                 "end_time": date_time,
                 "location": location or "Не указано",
-                "status": new_status
+                "status": new_status,
+                "old_status": old_status
             }
 
-            # Отправляем уведомления
-            notification_result = {"success_count": 0, "failed_count": 0}
-
-            if participants and NOTIFICATIONS_ENABLED:
-                try:
-                    print(f"\n📤 Отправка Telegram уведомлений об изменении статуса...")
-                    notification_result = await notify_slot_status_changed(participants, slot_data,
-                                                                           old_status)  # АСИНХРОННЫЙ ВЫЗОВ
-                    print(f"✅ Уведомления отправлены:")
-                    print(f"   ✓ Успешно: {notification_result['success_count']}")
-                    if notification_result['failed_count'] > 0:
-                        print(f"   ✗ Ошибок: {notification_result['failed_count']}")
-                        if notification_result.get('failed_chat_ids'):
-                            print(f"   Не удалось отправить на: {notification_result['failed_chat_ids']}")
-                except Exception as e:
-                    print(f"❌ Ошибка отправки уведомлений: {e}")
-                    traceback.print_exc()
-            elif not NOTIFICATIONS_ENABLED:
-                print("⚠️  Уведомления отключены (модуль не загружен)")
-            else:
-                print("⚠️  Нет участников с Telegram для этого занятия")
+            queued = await enqueue_notifications(db, "status_changed", slot_id, participants, slot_data)
+            print(f"📤 В очередь уведомлений поставлено: {queued}")
+            print("=" * 60 + "\n")
+        else:
+            print(f"ℹ️  Статус слота ID={slot_id} не изменился ({new_status})")
 
-            # Добавляем информацию об уведомлениях в ответ
-            updated_slot["status_changed"] = True
-            updated_slot["old_status"] = old_status
-            updated_slot["notifications_sent"] = notification_result['success_count']
-            updated_slot["notifications_failed"] = notification_result['failed_count']
+    # Перенос или отмена занятия меняет напоминание
+    await reminder_scheduler.refresh_slot(slot_id)
 
-            print("=" * 60 + "\n")
+    if new_status != old_status:
+        publish_slot_status_changed(updated_slot, old_status)
 
-        except Exception as e:
-            print(f"❌ ОШИБКА: {e}")
-            traceback.print_exc()
-            print("=" * 60 + "\n")
+        # Добавляем информацию об уведомлениях в ответ
+        updated_slot["status_changed"] = True
+        updated_slot["old_status"] = old_status
+        updated_slot["notifications_queued"] = queued
     else:
-        print(f"ℹ️  Статус слота ID={slot_id} не изменился ({new_status})")
+        publish_slot_updated(updated_slot)
 
     return updated_slot
 
@@ -412,14 +458,28 @@ async def change_slot_status(slot_id: int, status: str, u=Depends(get_current_us
 @app.delete("/api/schedule/{slot_id}", tags=["schedule"])
 async def delete_slot_ep(slot_id: int, u=Depends(get_current_user)):
     """Удаление занятия"""
-    return await delete_class_slot(slot_id)
+    result = await delete_class_slot(slot_id)
+    reminder_scheduler.cancel(slot_id)
+    publish_slot_deleted(slot_id)
+    return result
 
 
 # ========== КУРСЫ ==========
 @app.get("/api/courses", response_model=List[CourseResponse], tags=["courses"])
-async def get_courses_ep(name: Optional[str] = None, limit: int = 100, offset: int = 0):
-    """Получение списка курсов"""
-    return await get_courses(name, None, None, limit, offset)
+async def get_courses_ep(request: Request, response: Response, name: Optional[str] = None, limit: int = 100, offset: int = 0,
+                         cursor: Optional[str] = None):
+    """Получение списка курсов (курсор следующей страницы в заголовке X-Next-Cursor)"""
+    not_modified = await check_not_modified(request, response, ["courses"])
+    if not_modified:
+        return not_modified
+
+    page = await response_cache.get_or_load(
+        response_cache.make_key(request),
+        ["courses"],
+        lambda: get_courses(name, None, None, limit, offset, cursor)
+    )
+    set_next_cursor(response, page["next_cursor"])
+    return page["items"]
 
 
 @app.post("/api/courses", response_model=CourseResponse, tags=["courses"])
@@ -429,9 +489,17 @@ async def create_course_ep(data: CourseCreate, u=Depends(get_current_user)):
 
 
 @app.get("/api/courses/{course_id}", response_model=CourseResponse, tags=["courses"])
-async def get_course_ep(course_id: int):
+async def get_course_ep(course_id: int, request: Request, response: Response):
     """Получение курса по ID"""
-    return await get_course(course_id)
+    not_modified = await check_not_modified(request, response, ["courses"])
+    if not_modified:
+        return not_modified
+
+    return await response_cache.get_or_load(
+        response_cache.make_key(request),
+        [f"course:{course_id}"],
+        lambda: get_course(course_id)
+    )
 
 
 @app.put("/api/courses/{course_id}", response_model=CourseResponse, tags=["courses"])
@@ -449,16 +517,27 @@ async def delete_course_ep(course_id: int, u=Depends(get_current_user)):
 # ========== УЧАСТНИКИ КУРСОВ ==========
 
 @app.get("/api/courses/{course_id}/participants", tags=["participants"])
-async def get_course_participants(course_id: int):
+async def get_course_participants(course_id: int, request: Request, response: Response):
     """Получение участников курса"""
-    with get_db() as conn:
-        cursor = conn.cursor()
+    not_modified = await check_not_modified(request, response, ["courses", "users"])
+    if not_modified:
+        return not_modified
+
+    return await response_cache.get_or_load(
+        response_cache.make_key(request),
+        ["users", f"course:{course_id}", f"course_participants:{course_id}"],
+        lambda: load_course_participants(course_id)
+    )
+
 
-        cursor.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
+async def load_course_participants(course_id: int) -> list:
+    """Загрузка участников курса из БД"""
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="Курс не найден")
 
-        cursor.execute("""
+        cursor = await db.execute("""
             SELECT id, email, full_name, telegram_id
             FROM users
             WHERE id > 1
@@ -489,10 +568,8 @@ async def add_course_participant(course_id: int, data: dict, u=Depends(get_curre
     print(f"   Данные: {data}")
 
     try:
-        with get_db() as conn:
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT id, name FROM courses WHERE id = ?", (course_id,))
+        async with get_db_async() as db:
+            cursor = await db.execute("SELECT id, name FROM courses WHERE id = ?", (course_id,))
             course = cursor.fetchone()
             if not course:
                 raise HTTPException(status_code=404, detail="Курс не найден")
@@ -511,7 +588,7 @@ async def add_course_participant(course_id: int, data: dict, u=Depends(get_curre
             if telegram_id:
                 print(f"🤖 Telegram Chat ID: {telegram_id}")
 
-            cursor.execute("SELECT id FROM users WHERE email = ?", (email,))
+            cursor = await db.execute("SELECT id FROM users WHERE email = ?", (email,))
             existing = cursor.fetchone()
 
             if existing:
@@ -520,25 +597,30 @@ async def add_course_participant(course_id: int, data: dict, u=Depends(get_curre
 
                 # Обновляем telegram_id если передан
                 if telegram_id:
-                    cursor.execute("UPDATE users SET telegram_id = ? WHERE id = ?", (telegram_id, user_id))
+                    await db.execute("UPDATE users SET telegram_id = ? WHERE id = ?", (telegram_id, user_id))
+                    db.on_commit(lambda: invalidate_user_cache(user_id))
+                    invalidate_on_commit(db, "users")
                     print(f"✅ Обновлён telegram_id: {telegram_id}")
             else:
                 name = data.get("name") or email.split("@")[0]
                 password = secrets.token_urlsafe(12)
                 password_hash = hash_password(password)
 
-                cursor.execute("""
+                cursor = await db.execute("""
                     INSERT INTO users (email, password_hash, full_name, telegram_id)
                     VALUES (?, ?, ?, ?)
                 """, (email, password_hash, name, telegram_id))
 
                 user_id = cursor.lastrowid
+                invalidate_on_commit(db, "users")
                 print(f"✅ Создан новый пользователь: ID={user_id}")
                 if telegram_id:
                     print(f"✅ С telegram_id: {telegram_id}")
 
+            invalidate_on_commit(db, f"course_participants:{course_id}")
+
             # Получаем все слоты курса
-            cursor.execute("SELECT id, title FROM class_slots WHERE course_id = ?", (course_id,))
+            cursor = await db.execute("SELECT id, title FROM class_slots WHERE course_id = ?", (course_id,))
             slots = cursor.fetchall()
 
             print(f"📋 Найдено слотов курса: {len(slots)}")
@@ -561,7 +643,7 @@ async def add_course_participant(course_id: int, data: dict, u=Depends(get_curre
                 slot_id = slot[0]
                 slot_title = slot[1]
                 try:
-                    cursor.execute("""
+                    await db.execute("""
                         INSERT INTO participants (class_slot_id, user_id, status, registered_at)
                         VALUES (?, ?, 'registered', ?)
                     """, (slot_id, user_id, now))
@@ -594,14 +676,12 @@ async def add_course_participant(course_id: int, data: dict, u=Depends(get_curre
 @app.delete("/api/courses/{course_id}/participants/{user_id}", tags=["participants"])
 async def remove_course_participant(course_id: int, user_id: int, u=Depends(get_current_user)):
     """Удаление участника из курса"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT id FROM courses WHERE id = ?", (course_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail="Курс не найден")
 
-        cursor.execute("""
+        cursor = await db.execute("""
             DELETE FROM participants
             WHERE user_id = ?
             AND class_slot_id IN (SELECT id FROM class_slots WHERE course_id = ?)
@@ -612,6 +692,8 @@ async def remove_course_participant(course_id: int, user_id: int, u=Depends(get_
         if deleted_count == 0:
             raise HTTPException(status_code=404, detail="Участник не найден в этом курсе")
 
+        invalidate_on_commit(db, f"course_participants:{course_id}")
+
         return {
             "message": f"Участник удалён с {deleted_count} занятий курса",
             "course_id": course_id,
@@ -625,13 +707,53 @@ async def remove_course_participant(course_id: int, user_id: int, u=Depends(get_
 @app.post("/api/notifications/subscribe-telegram", tags=["notifications"])
 async def subscribe_telegram(telegram_id: str, u=Depends(get_current_user)):
     """Подписка на Telegram уведомления"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("UPDATE users SET telegram_id = ? WHERE id = ?", (telegram_id, u["id"]))
+    async with get_db_async() as db:
+        await db.execute("UPDATE users SET telegram_id = ? WHERE id = ?", (telegram_id, u["id"]))
+        db.on_commit(lambda: invalidate_user_cache(u["id"]))
+        invalidate_on_commit(db, "users")
     print(f"✅ Пользователь ID={u['id']} подписался на Telegram: {telegram_id}")
     return {"message": "Telegram подписка активирована", "telegram_id": telegram_id}
 
 
+@app.put("/api/notifications/mode", tags=["notifications"])
+async def set_notification_mode(mode: str, u=Depends(get_current_user)):
+    """
+    Режим Telegram уведомлений: instant — сразу, daily / weekly — одной сводкой за период
+    """
+    if mode not in NOTIFICATION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Недопустимый режим. Допустимые значения: {', '.join(NOTIFICATION_MODES)}"
+        )
+
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT notification_mode FROM users WHERE id = ?", (u["id"],))
+        row = cursor.fetchone()
+        await db.execute("UPDATE users SET notification_mode = ? WHERE id = ?", (mode, u["id"]))
+        # Накопленное в прежнем режиме сводок отправляем сразу, иначе оно не уйдёт никогда
+        if row and row[0] != mode:
+            await flush_user_digest(db, u["id"])
+        invalidate_on_commit(db, "users")
+    print(f"✅ Пользователь ID={u['id']} выбрал режим уведомлений: {mode}")
+    return {"message": "Режим уведомлений обновлён", "mode": mode}
+
+
+@app.get("/api/admin/dead-letters", response_model=List[dict], tags=["notifications"])
+async def get_dead_letters(response: Response, limit: int = 100, cursor: Optional[str] = None,
+                           u=Depends(get_admin_user)):
+    """Недоставленные Telegram уведомления с причиной; следующая страница — в X-Next-Cursor"""
+    page = await list_dead_letters(limit, cursor)
+    set_next_cursor(response, page["next_cursor"])
+    return page["items"]
+
+
+@app.post("/api/admin/dead-letters/retry", tags=["notifications"])
+async def retry_dead_letters_ep(data: DeadLetterRetryRequest, u=Depends(get_admin_user)):
+    """Повторная отправка недоставленных уведомлений (выбранных ids или всех)"""
+    retried = await retry_dead_letters(data.ids)
+    return {"message": f"Повторно поставлено в очередь: {retried}", "retried": retried}
+
+
 # ========== HEALTH CHECK ==========
 
 @app.get("/api/health", tags=["system"])
@@ -645,6 +767,22 @@ async def health_check():
     }
 
 
+@app.get("/api/system/stats", tags=["system"])
+async def system_stats():
+    """Метрики производительности: пул подключений к БД, кэши, SSE, очередь уведомлений"""
+    return {
+        "db_pool": get_pool_stats(),
+        "auth_cache": get_auth_cache_stats(),
+        "response_cache": response_cache.stats(),
+        "sse": broker.stats(),
+        "outbox": await get_outbox_stats(),
+        "reminders": reminder_scheduler.stats(),
+        "digest": await get_digest_stats(),
+        "imports": get_import_stats(),
+        "telegram": get_telegram_stats() if NOTIFICATIONS_ENABLED else None
+    }
+
+
 # ========== ЗАПУСК ==========
 
 if __name__ == "__main__":
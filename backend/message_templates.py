@@ -0,0 +1,222 @@
+"""
+Шаблоны Telegram сообщений о занятиях.
+
+Текст сообщения зависит только от версии занятия (данных payload), типа уведомления
+и языка, поэтому он собирается один раз и переиспользуется для всех получателей
+рассылки и повторных попыток. Все подставляемые значения экранируются для
+parse_mode=HTML. Персональная часть добавляется дешёвым суффиксом.
+"""
+
+import hashlib
+import html
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_LOCALE = os.getenv("NOTIFICATION_DEFAULT_LOCALE", "ru")
+MESSAGE_CACHE_SIZE = int(os.getenv("MESSAGE_CACHE_SIZE", "2000"))
+# Максимальная длина текста сообщения Telegram — 4096 символов; как и в telegramm-bot.py,
+# режем по 4000, оставляя запас на эмодзи (2 UTF-16 символа) и разметку
+TELEGRAM_MESSAGE_LIMIT = 4000
+# Добавлять ли к сообщению имя получателя
+NOTIFICATION_PERSONALIZE = os.getenv("NOTIFICATION_PERSONALIZE", "false").lower() == "true"
+
+STATUS_EMOJI = {
+    "scheduled": "📅",
+    "in_progress": "▶️",
+    "completed": "✅",
+    "cancelled": "❌"
+}
+
+TEMPLATES = {
+    "ru": {
+        "headers": {
+            "new": "🆕 <b>Новое занятие добавлено!</b>",
+            "status_changed": "🔄 <b>Изменение статуса занятия</b>",
+            "reminder": "⏰ <b>Напоминание о занятии</b>"
+        },
+        "default_header": "📌 <b>Уведомление о занятии</b>",
+        "body": (
+            "{header}\n"
+            "\n"
+            "📚 <b>Курс:</b> {course_name}\n"
+            "⏰ <b>Начало:</b> {start_time}\n"
+            "⏱ <b>Конец:</b> {end_time}\n"
+            "📍 <b>Место:</b> {location}\n"
+            "🏷 <b>Статус:</b> {status}\n"
+        ),
+        "old_status": "\n🔀 <b>Предыдущий статус:</b> {old_status}",
+        "not_set": "Не указано",
+        "course_not_set": "Не указан",
+        "statuses": {},
+        "personal": "\n\n👤 {full_name}",
+        "digest_header": "📋 <b>Сводка изменений расписания</b>\n",
+        "digest_line": "{icon} {course_name} — {start_time}, {location} ({status})"
+    },
+    "en": {
+        "headers": {
+            "new": "🆕 <b>New class added!</b>",
+            "status_changed": "🔄 <b>Class status changed</b>",
+            "reminder": "⏰ <b>Class reminder</b>"
+        },
+        "default_header": "📌 <b>Class notification</b>",
+        "body": (
+            "{header}\n"
+            "\n"
+            "📚 <b>Course:</b> {course_name}\n"
+            "⏰ <b>Starts:</b> {start_time}\n"
+            "⏱ <b>Ends:</b> {end_time}\n"
+            "📍 <b>Location:</b> {location}\n"
+            "🏷 <b>Status:</b> {status}\n"
+        ),
+        "old_status": "\n🔀 <b>Previous status:</b> {old_status}",
+        "not_set": "Not specified",
+        "course_not_set": "Not specified",
+        "statuses": {
+            "scheduled": "scheduled",
+            "in_progress": "in progress",
+            "completed": "completed",
+            "cancelled": "cancelled"
+        },
+        "personal": "\n\n👤 {full_name}",
+        "digest_header": "📋 <b>Schedule digest</b>\n",
+        "digest_line": "{icon} {course_name} — {start_time}, {location} ({status})"
+    }
+}
+
+DIGEST_ICONS = {
+    "new": "🆕",
+    "status_changed": "🔄",
+    "reminder": "⏰"
+}
+
+
+def resolve_locale(locale: Optional[str]) -> str:
+    return locale if locale in TEMPLATES else DEFAULT_LOCALE
+
+
+def _status_text(template: dict, status: str) -> str:
+    label = template["statuses"].get(status, status)
+    return f"{STATUS_EMOJI.get(status, '📌')} {html.escape(str(label))}"
+
+
+def _render(payload: dict, notification_type: str, template: dict) -> str:
+    if notification_type == "digest":
+        # Текст сводки собран и экранирован заранее (render_digest)
+        return payload["text"]
+
+    def value(key: str, default: str) -> str:
+        return html.escape(str(payload.get(key, default)))
+
+    message = template["body"].format(
+        header=template["headers"].get(notification_type, template["default_header"]),
+        course_name=value("course_name", template["course_not_set"]),
+        start_time=value("start_time", template["not_set"]),
+        end_time=value("end_time", template["not_set"]),
+        location=value("location", template["not_set"]),
+        status=_status_text(template, payload.get("status", "scheduled"))
+    )
+
+    if notification_type == "status_changed" and payload.get("old_status"):
+        message += template["old_status"].format(old_status=_status_text(template, payload["old_status"]))
+
+    return message
+
+
+def payload_version(payload: dict) -> str:
+    """Версия занятия для ключа кэша: отпечаток данных сообщения"""
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+class MessageCache:
+    """LRU готовых сообщений по (занятие, версия, тип, язык)"""
+
+    def __init__(self, max_size: int = MESSAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._messages = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, payload: dict, notification_type: str, locale: Optional[str] = None,
+               slot_id: Optional[int] = None, version: Optional[str] = None) -> str:
+        locale = resolve_locale(locale)
+        key = (slot_id, version or payload_version(payload), notification_type, locale)
+        with self._lock:
+            message = self._messages.get(key)
+            if message is not None:
+                self._messages.move_to_end(key)
+                self.hits += 1
+                return message
+            self.misses += 1
+
+        message = _render(payload, notification_type, TEMPLATES[locale])
+        with self._lock:
+            self._messages[key] = message
+            while len(self._messages) > self.max_size:
+                self._messages.popitem(last=False)
+        return message
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._messages),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+
+message_cache = MessageCache()
+
+
+def personalize(message: str, locale: Optional[str] = None, full_name: Optional[str] = None) -> str:
+    """Персональный суффикс к готовому сообщению (без повторного рендера)"""
+    if not NOTIFICATION_PERSONALIZE or not full_name:
+        return message
+    return message + TEMPLATES[resolve_locale(locale)]["personal"].format(full_name=html.escape(full_name))
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> list:
+    """Разбиение длинного текста на сообщения по границам строк (не разрывая HTML-теги)"""
+    parts = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > limit:
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > limit:
+            parts.append(current)
+            current = line
+        else:
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def render_digest(events: list, locale: Optional[str] = None) -> list:
+    """
+    Сводка по событиям [(event_type, payload), ...]: одна строка на занятие
+    в итоговом состоянии. Возвращает список сообщений длиной не более лимита Telegram.
+    """
+    template = TEMPLATES[resolve_locale(locale)]
+    lines = [template["digest_header"]]
+    for event_type, payload in events:
+        lines.append(template["digest_line"].format(
+            icon=DIGEST_ICONS.get(event_type, "📌"),
+            course_name=html.escape(str(payload.get("course_name", template["course_not_set"]))),
+            start_time=html.escape(str(payload.get("start_time", template["not_set"]))),
+            location=html.escape(str(payload.get("location", template["not_set"]))),
+            status=_status_text(template, payload.get("status", "scheduled"))
+        ))
+    return split_message("\n".join(lines))
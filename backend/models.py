@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr
-from typing import Optional
+from typing import Optional, List
 
 # ========== AUTH MODELS ==========
 
@@ -98,3 +98,8 @@ class ClassSlotResponse(BaseModel):
     instructor: Optional[str] = None
     max_participants: Optional[int] = None
     status: str
+
+# ========== NOTIFICATION MODELS ==========
+
+class DeadLetterRetryRequest(BaseModel):
+    ids: Optional[List[int]] = None  # None — повторить все недоставленные
@@ -0,0 +1,150 @@
+"""
+Воркеры рассылки уведомлений из outbox — отдельно от API.
+
+    python notification_worker.py --workers 4          # 4 процесса, по шарду на каждый
+    python notification_worker.py --shard 1 --shards 4 # один шард (например, под systemd)
+
+Строка outbox относится к шарду crc32(chat_id) % shards: все сообщения одного чата
+обрабатывает один процесс, поэтому лимит «1 сообщение/с в чат» соблюдается локально,
+а общий лимит бота TELEGRAM_GLOBAL_RATE делится между шардами.
+Строки забираются в аренду (outbox.claim_batch), так что одно сообщение не уйдёт
+дважды; строки упавшего воркера вернутся в очередь через OUTBOX_LEASE_SECONDS.
+Каждый шард должен обслуживаться, иначе его очередь не разбирается.
+
+Число шардов указывается и для API: NOTIFICATION_WORKERS=4 — тогда встроенный
+диспетчер API по умолчанию выключен. Если его всё же включить
+(OUTBOX_INPROCESS_DISPATCHER=true), он тоже получает долю общего лимита.
+
+Без TELEGRAM_BOT_TOKEN воркер завершается с кодом WORKER_EXIT_NO_TOKEN,
+и супервизор останавливается, а не перезапускает его бесконечно.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import sys
+import time
+from dotenv import load_dotenv
+
+# Добавляем путь для импорта модулей backend
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+load_dotenv()
+
+# Пауза перед перезапуском упавшего воркера
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "5"))  # секунд
+# Код выхода воркера без токена бота: перезапуск бесполезен
+WORKER_EXIT_NO_TOKEN = 3
+
+
+async def _serve_shard(shard: int, shards: int) -> bool:
+    """Разбор очереди шарда до сигнала остановки; False — бот не настроен"""
+    import notifications
+    from outbox import default_worker_id, OUTBOX_INPROCESS_DISPATCHER
+
+    # Общий лимит бота делят все разборщики очереди, включая диспетчер API
+    notifications.configure_rate_share(shards + (1 if OUTBOX_INPROCESS_DISPATCHER else 0))
+    bot = await notifications.start_telegram_bot()
+    if bot is None:
+        return False
+
+    dispatcher = asyncio.create_task(
+        notifications.outbox_dispatcher(f"{default_worker_id()}/{shard}", shard, shards)
+    )
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, dispatcher.cancel)
+    try:
+        await dispatcher
+    except asyncio.CancelledError:
+        pass
+    finally:
+        await notifications.stop_telegram_bot()
+    return True
+
+
+def run_worker(shard: int, shards: int):
+    """Процесс одного шарда: свой пул БД, свой бот и свои лимиты"""
+    from database import close_pool
+
+    print(f"📮 Воркер уведомлений: шард {shard} из {shards} (pid {os.getpid()})")
+    try:
+        served = asyncio.run(_serve_shard(shard, shards))
+    finally:
+        close_pool()
+    if not served:
+        print(f"❌ Воркер шарда {shard}: TELEGRAM_BOT_TOKEN не установлен")
+        sys.exit(WORKER_EXIT_NO_TOKEN)
+    print(f"🛑 Воркер шарда {shard} остановлен")
+
+
+def run_supervisor(shards: int) -> int:
+    """Запуск процесса на каждый шард; упавшие процессы перезапускаются. Возвращает код выхода"""
+    context = multiprocessing.get_context("spawn")
+    processes = {}
+    stopping = False
+    exit_code = 0
+
+    def start(shard: int):
+        process = context.Process(target=run_worker, args=(shard, shards), name=f"notification-worker-{shard}")
+        process.start()
+        processes[shard] = process
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for shard in range(shards):
+        start(shard)
+
+    while not stopping:
+        time.sleep(1)
+        for shard, process in list(processes.items()):
+            if not process.is_alive() and not stopping:
+                if process.exitcode == WORKER_EXIT_NO_TOKEN:
+                    # Токен общий для всех шардов: остальные воркеры тоже не смогут отправлять
+                    print("❌ Бот не настроен, воркеры уведомлений останавливаются")
+                    stopping = True
+                    exit_code = WORKER_EXIT_NO_TOKEN
+                    break
+                print(f"⚠️ Воркер шарда {shard} завершился (код {process.exitcode}), перезапуск")
+                time.sleep(WORKER_RESTART_DELAY)
+                start(shard)
+
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join()
+    print("🛑 Все воркеры уведомлений остановлены")
+    return exit_code
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Воркеры рассылки уведомлений из outbox")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="число процессов (= число шардов)")
+    parser.add_argument("--shard", type=int, help="запустить только этот шард в текущем процессе")
+    parser.add_argument("--shards", type=int, help="общее число шардов (вместе с --shard)")
+    args = parser.parse_args()
+
+    # Миграции применяются один раз, до запуска воркеров
+    from database import init_db
+    init_db()
+
+    if args.shard is not None:
+        shards = args.shards or args.workers
+        if not 0 <= args.shard < shards:
+            parser.error("--shard должен быть в диапазоне [0, --shards)")
+        run_worker(args.shard, shards)
+    else:
+        sys.exit(run_supervisor(max(1, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,16 @@
 import logging
-from typing import List, Dict
+from typing import List, Dict, Optional
 import os
 from dotenv import load_dotenv
 import asyncio
+import random
 import telegram
-from telegram.error import TelegramError
+from telegram.request import HTTPXRequest
+from telegram.error import TelegramError, RetryAfter, BadRequest, Forbidden, NetworkError
+from outbox import claim_batch, complete_batch, release_expired_leases, wait_for_outbox, seconds_until_next_due, \
+    default_worker_id, OUTBOX_POLL_INTERVAL
+from rate_limiter import TokenBucket, KeyedTokenBuckets
+from message_templates import message_cache, personalize
 
 load_dotenv()
 
@@ -15,72 +21,255 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Адрес Bot API; для локальных тестов — fake_telegram_api.py, например http://127.0.0.1:8081/bot
+TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "https://api.telegram.org/bot")
 _bot_instance = None
 
+# Лимиты Telegram Bot API: ~30 сообщений/с на бота и ~1 сообщение/с в один чат
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "1"))
+TELEGRAM_MAX_CONCURRENCY = int(os.getenv("TELEGRAM_MAX_CONCURRENCY", "32"))
+TELEGRAM_SEND_RETRIES = int(os.getenv("TELEGRAM_SEND_RETRIES", "5"))
+TELEGRAM_BACKOFF_BASE = float(os.getenv("TELEGRAM_BACKOFF_BASE", "0.5"))  # секунд
+TELEGRAM_BACKOFF_MAX = float(os.getenv("TELEGRAM_BACKOFF_MAX", "30"))  # секунд
+
+# HTTP-клиент бота: пул keep-alive соединений HTTP/1.1 не меньше числа параллельных отправок
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", str(TELEGRAM_MAX_CONCURRENCY)))
+TELEGRAM_POOL_TIMEOUT = float(os.getenv("TELEGRAM_POOL_TIMEOUT", "5"))  # секунд ожидания свободного соединения
+TELEGRAM_CONNECT_TIMEOUT = float(os.getenv("TELEGRAM_CONNECT_TIMEOUT", "5"))
+TELEGRAM_READ_TIMEOUT = float(os.getenv("TELEGRAM_READ_TIMEOUT", "10"))
+TELEGRAM_WRITE_TIMEOUT = float(os.getenv("TELEGRAM_WRITE_TIMEOUT", "10"))
+
+_global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+_chat_buckets = KeyedTokenBuckets(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+_send_semaphore = asyncio.Semaphore(TELEGRAM_MAX_CONCURRENCY)
+_send_stats = {
+    "sent": 0,
+    "failed": 0,
+    "retries": 0,
+    "rate_limited": 0,
+    "throttle_wait_seconds": 0.0,
+    "in_flight": 0,
+    "peak_in_flight": 0
+}
+
+
+def configure_rate_share(shards: int):
+    """
+    Лимит TELEGRAM_GLOBAL_RATE действует на бота целиком: при разборе очереди
+    несколькими процессами каждый получает свою долю. Лимит на чат не делится —
+    чат целиком обрабатывается одним шардом.
+    """
+    global _global_bucket
+    rate = TELEGRAM_GLOBAL_RATE / max(1, shards)
+    _global_bucket = TokenBucket(rate, max(1.0, rate))
+
+
+def create_telegram_bot() -> telegram.Bot:
+    """Бот с явно заданным пулом HTTP соединений и таймаутами"""
+    if not TELEGRAM_BOT_TOKEN:
+        raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env")
+    request = HTTPXRequest(
+        connection_pool_size=TELEGRAM_POOL_SIZE,
+        pool_timeout=TELEGRAM_POOL_TIMEOUT,
+        connect_timeout=TELEGRAM_CONNECT_TIMEOUT,
+        read_timeout=TELEGRAM_READ_TIMEOUT,
+        write_timeout=TELEGRAM_WRITE_TIMEOUT,
+        http_version="1.1"
+    )
+    return telegram.Bot(token=TELEGRAM_BOT_TOKEN, base_url=TELEGRAM_API_BASE_URL, request=request)
+
 
 def get_telegram_bot():
     """Получает экземпляр Telegram бота (singleton)"""
     global _bot_instance
     if _bot_instance is None:
-        if not TELEGRAM_BOT_TOKEN:
-            raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env")
-        _bot_instance = telegram.Bot(token=TELEGRAM_BOT_TOKEN)
-        logger.info("Telegram Bot инициализирован")
+        _bot_instance = create_telegram_bot()
+        logger.info(f"Telegram Bot инициализирован ({TELEGRAM_API_BASE_URL})")
     return _bot_instance
 
 
-async def send_telegram_message_async(chat_id: str, message: str) -> bool:
-    """Асинхронная отправка сообщения в Telegram"""
+async def start_telegram_bot():
+    """
+    Открытие бота на время жизни процесса (lifespan приложения или воркера):
+    один HTTP пул на все рассылки процесса
+    """
+    global _bot_instance
+    if not TELEGRAM_BOT_TOKEN:
+        logger.warning("⚠️ TELEGRAM_BOT_TOKEN не установлен, отправка уведомлений недоступна")
+        return None
+
+    bot = get_telegram_bot()
     try:
-        bot = get_telegram_bot()
-        await bot.send_message(
-            chat_id=int(chat_id),
-            text=message,
-            parse_mode='HTML'
-        )
-        logger.info(f"✅ Сообщение отправлено в чат {chat_id}")
-        return True
+        await bot.initialize()
+        logger.info(f"✅ Telegram Bot @{bot.username} готов (пул соединений: {TELEGRAM_POOL_SIZE})")
     except TelegramError as e:
-        logger.error(f"❌ Telegram ошибка для чата {chat_id}: {e}")
-        return False
+        # Сеть может быть недоступна на старте: бот всё равно подключится при первой отправке
+        logger.error(f"❌ Не удалось инициализировать Telegram Bot: {e}")
+    return bot
+
+
+async def stop_telegram_bot():
+    """Закрытие HTTP пула бота при остановке процесса"""
+    global _bot_instance
+    if _bot_instance is None:
+        return
+    try:
+        await _bot_instance.shutdown()
     except Exception as e:
-        logger.error(f"❌ Ошибка отправки: {e}")
-        return False
+        logger.error(f"❌ Ошибка остановки Telegram Bot: {e}")
+    _bot_instance = None
 
 
-def format_slot_telegram_message(slot_data: dict, notification_type: str = "new") -> str:
-    """Формирует текстовое сообщение для Telegram"""
-    headers = {
-        "new": "🆕 <b>Новое занятие добавлено!</b>",
-        "status_changed": "🔄 <b>Изменение статуса занятия</b>",
-        "reminder": "⏰ <b>Напоминание о занятии</b>"
+def _get_pool_connections() -> Optional[dict]:
+    """Состояние пула соединений httpx (внутренние объекты httpcore; None, если недоступно)"""
+    if _bot_instance is None:
+        return None
+    try:
+        client = _bot_instance.request._client
+        connections = client._transport._pool.connections
+    except AttributeError:
+        return None
+    return {
+        "open": len(connections),
+        "idle": sum(1 for conn in connections if conn.is_idle()),
+        "active": sum(1 for conn in connections if not conn.is_idle())
     }
-    header = headers.get(notification_type, "📌 <b>Уведомление о занятии</b>")
 
-    status_emoji = {
-        "scheduled": "📅",
-        "in_progress": "▶️",
-        "completed": "✅",
-        "cancelled": "❌"
-    }
 
-    status = slot_data.get('status', 'scheduled')
-    status_text = f"{status_emoji.get(status, '📌')} {status}"
+# Ответы BadRequest, означающие, что чата для бота больше нет
+INVALID_CHAT_ERRORS = ("chat not found", "user not found", "peer_id_invalid", "chat_id is empty")
+
+
+class DeliveryResult:
+    """
+    Итог отправки одного сообщения; permanent — повтор бессмыслен,
+    chat_invalid — в этот чат писать больше нельзя (бот заблокирован, чат не найден)
+    """
+    __slots__ = ("ok", "error", "permanent", "chat_invalid")
+
+    def __init__(self, ok: bool, error: str = None, permanent: bool = False, chat_invalid: bool = False):
+        self.ok = ok
+        self.error = error
+        self.permanent = permanent or chat_invalid
+        self.chat_invalid = chat_invalid
 
-    message = f"""{header}
 
-📚 <b>Курс:</b> {slot_data.get('course_name', 'Не указан')}
-⏰ <b>Начало:</b> {slot_data.get('start_time', 'Не указано')}
-⏱ <b>Конец:</b> {slot_data.get('end_time', 'Не указано')}
-📍 <b>Место:</b> {slot_data.get('location', 'Не указано')}
-🏷 <b>Статус:</b> {status_text}
-"""
+def is_invalid_chat_error(error: TelegramError) -> bool:
+    if isinstance(error, Forbidden):
+        return True
+    message = str(error).lower()
+    return any(marker in message for marker in INVALID_CHAT_ERRORS)
+
+
+def _retry_after_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
 
-    if notification_type == "status_changed" and slot_data.get('old_status'):
-        old_status = slot_data['old_status']
-        message += f"\n🔀 <b>Предыдущий статус:</b> {status_emoji.get(old_status, '📌')} {old_status}"
+def _backoff_delay(attempt: int) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(TELEGRAM_BACKOFF_MAX, TELEGRAM_BACKOFF_BASE * (2 ** (attempt - 1))))
+
+
+async def deliver_telegram_message(chat_id: str, message: str) -> DeliveryResult:
+    """
+    Отправка с учётом лимитов Telegram: token bucket на бота и на чат,
+    ограниченная параллельность, ожидание RetryAfter и повторы сетевых ошибок
+    """
+    try:
+        chat = int(chat_id)
+    except (TypeError, ValueError):
+        _send_stats["failed"] += 1
+        return DeliveryResult(False, f"Некорректный chat_id: {chat_id}", chat_invalid=True)
 
-    return message
+    try:
+        bot = get_telegram_bot()
+    except Exception as e:
+        logger.error(f"❌ Ошибка отправки: {e}")
+        _send_stats["failed"] += 1
+        return DeliveryResult(False, str(e))
+
+    error = None
+    for attempt in range(1, TELEGRAM_SEND_RETRIES + 1):
+        # Сначала лимит чата, потом общий: токен бота не простаивает в ожидании чата
+        waited = await _chat_buckets.acquire(chat)
+        waited += await _global_bucket.acquire()
+        _send_stats["throttle_wait_seconds"] += waited
+
+        try:
+            async with _send_semaphore:
+                _send_stats["in_flight"] += 1
+                _send_stats["peak_in_flight"] = max(_send_stats["peak_in_flight"], _send_stats["in_flight"])
+                try:
+                    await bot.send_message(
+                        chat_id=chat,
+                        text=message,
+                        parse_mode='HTML'
+                    )
+                finally:
+                    _send_stats["in_flight"] -= 1
+            logger.info(f"✅ Сообщение отправлено в чат {chat_id}")
+            _send_stats["sent"] += 1
+            return DeliveryResult(True)
+        except RetryAfter as e:
+            # Флуд-контроль действует на весь бот: приостанавливаем общий bucket
+            delay = _retry_after_seconds(e)
+            _send_stats["rate_limited"] += 1
+            _global_bucket.pause(delay)
+            logger.warning(f"⏳ Telegram RetryAfter {delay} с (чат {chat_id})")
+            error = str(e)
+        except (BadRequest, Forbidden) as e:
+            logger.error(f"❌ Telegram ошибка для чата {chat_id}: {e}")
+            _send_stats["failed"] += 1
+            return DeliveryResult(False, str(e), permanent=True, chat_invalid=is_invalid_chat_error(e))
+        except NetworkError as e:
+            logger.warning(f"⚠️ Сетевая ошибка Telegram для чата {chat_id} (попытка {attempt}): {e}")
+            error = str(e)
+            await asyncio.sleep(_backoff_delay(attempt))
+        except TelegramError as e:
+            logger.error(f"❌ Telegram ошибка для чата {chat_id}: {e}")
+            _send_stats["failed"] += 1
+            return DeliveryResult(False, str(e))
+        except Exception as e:
+            logger.error(f"❌ Ошибка отправки: {e}")
+            _send_stats["failed"] += 1
+            return DeliveryResult(False, str(e))
+
+        _send_stats["retries"] += 1
+
+    _send_stats["failed"] += 1
+    return DeliveryResult(False, error)
+
+
+async def send_telegram_message_async(chat_id: str, message: str) -> bool:
+    """Асинхронная отправка сообщения в Telegram"""
+    result = await deliver_telegram_message(chat_id, message)
+    return result.ok
+
+
+def get_telegram_stats() -> dict:
+    stats = dict(_send_stats)
+    stats["throttle_wait_seconds"] = round(stats["throttle_wait_seconds"], 3)
+    stats["global_rate"] = TELEGRAM_GLOBAL_RATE
+    stats["chat_rate"] = TELEGRAM_CHAT_RATE
+    stats["max_concurrency"] = TELEGRAM_MAX_CONCURRENCY
+    stats["chat_buckets"] = len(_chat_buckets)
+    stats["message_cache"] = message_cache.stats()
+    stats["http_pool"] = {
+        "size": TELEGRAM_POOL_SIZE,
+        "pool_timeout": TELEGRAM_POOL_TIMEOUT,
+        "connections": _get_pool_connections()
+    }
+    return stats
+
+
+def format_slot_telegram_message(slot_data: dict, notification_type: str = "new", locale: str = None) -> str:
+    """Формирует текстовое сообщение для Telegram (готовые сообщения кэшируются, значения экранируются)"""
+    return message_cache.render(slot_data, notification_type, locale)
 
 
 async def notify_participants_telegram_async(
@@ -90,7 +279,7 @@ async def notify_participants_telegram_async(
 ) -> Dict[str, any]:
     """
     АСИНХРОННАЯ отправка уведомлений в Telegram
-    Работает в существующем event loop FastAPI
+    Работает в существующем event loop FastAPI; темп отправки ограничивает deliver_telegram_message
     """
     logger.info(f"📤 Отправка уведомлений ({notification_type}) для {len(participants)} участников")
     message = format_slot_telegram_message(slot_data, notification_type)
@@ -160,11 +349,72 @@ async def notify_slot_created(participants: List[dict], slot_data: dict) -> Dict
 
 async def notify_slot_status_changed(participants: List[dict], slot_data: dict, old_status: str) -> Dict[str, any]:
     """Асинхронное уведомление об изменении статуса слота"""
-    slot_data['old_status'] = old_status
-    return await notify_participants_telegram_async(participants, slot_data, notification_type="status_changed")
+    return await notify_participants_telegram_async(
+        participants, {**slot_data, "old_status": old_status}, notification_type="status_changed"
+    )
 
 
 # Для обратной совместимости
 def notify_users(participants: List[dict], slot_data: dict, notification_type: str = "new") -> Dict[str, any]:
     """Устаревшая функция - используйте notify_slot_created или notify_slot_status_changed"""
     return notify_participants_telegram(participants, slot_data, notification_type)
+
+
+# ========== ДИСПЕТЧЕР ОЧЕРЕДИ OUTBOX ==========
+
+async def deliver_outbox_batch(worker_id: str, shard: int = 0, shards: int = 1) -> int:
+    """Отправка одной пачки строк шарда; возвращает число обработанных строк"""
+    batch = await claim_batch(worker_id, shard=shard, shards=shards)
+    if not batch:
+        return 0
+
+    # Сообщение рендерится один раз на (занятие, версия, тип, язык) — и для всей рассылки, и для повторов
+    tasks = []
+    skipped = []
+    for item in batch:
+        if item["chat_invalid"]:
+            skipped.append(item)
+            continue
+        message = message_cache.render(
+            item["payload"], item["event_type"], item["locale"],
+            slot_id=item["slot_id"], version=item["version"]
+        )
+        message = personalize(message, item["locale"], item["full_name"])
+        tasks.append(deliver_telegram_message(item["chat_id"], message))
+
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    sent = []
+    failed = [(item["id"], item["attempts"], "Чат помечен недоступным", True) for item in skipped]
+    invalid_chats = []
+    for item, result in zip([item for item in batch if not item["chat_invalid"]], results):
+        if isinstance(result, Exception):
+            failed.append((item["id"], item["attempts"], str(result), False))
+        elif result.ok:
+            sent.append(item["id"])
+        else:
+            failed.append((item["id"], item["attempts"], result.error, result.permanent))
+            if result.chat_invalid:
+                invalid_chats.append((item["user_id"], item["chat_id"], result.error))
+
+    await complete_batch(worker_id, sent, failed, invalid_chats)
+    logger.info(f"📬 Outbox: отправлено {len(sent)}, ошибок {len(failed)} (без отправки: {len(skipped)})")
+    return len(batch)
+
+
+async def outbox_dispatcher(worker_id: Optional[str] = None, shard: int = 0, shards: int = 1):
+    """Фоновая задача: разбор очереди outbox (шард shard из shards; по умолчанию — вся очередь)"""
+    worker_id = worker_id or default_worker_id()
+    logger.info(f"📮 Диспетчер outbox {worker_id}: шард {shard} из {shards}")
+    while True:
+        timeout = OUTBOX_POLL_INTERVAL
+        try:
+            await release_expired_leases()
+            while await deliver_outbox_batch(worker_id, shard, shards):
+                pass
+            timeout = await seconds_until_next_due(shard, shards)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Ошибка диспетчера outbox: {e}")
+        await wait_for_outbox(timeout)
@@ -0,0 +1,506 @@
+"""
+Очередь исходящих уведомлений (transactional outbox).
+
+Эндпоинты не ждут Telegram: строки outbox пишутся в той же транзакции, что и
+изменение занятия, а фоновый диспетчер (notifications.outbox_dispatcher)
+забирает их и отправляет. Если процесс упадёт, очередь переживёт перезапуск.
+
+Статусы строки: queued → sending → sent; при ошибке — failed (ждёт повтора,
+причина в last_error), после исчерпания попыток или постоянной ошибки — dead.
+
+Строки могут разбирать несколько процессов (notification_worker.py). Каждая строка
+относится к шарду crc32(chat_id) % shards и забирается в аренду: status = 'sending',
+lease_owner — id воркера, lease_until — срок аренды. Захват — один UPDATE ... RETURNING,
+поэтому одну строку не получат два воркера; строки упавшего воркера возвращаются
+в очередь после истечения аренды.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import time
+import zlib
+import logging
+from typing import List, Optional
+from database import get_db_async
+from pagination import decode_cursor, page_limit, split_page
+from response_cache import invalidate_on_commit
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))  # секунд
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "2"))  # секунд
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "600"))  # секунд
+# Окно слияния: изменения занятия за это время уходят одним сообщением с итоговым состоянием
+OUTBOX_DEBOUNCE_SECONDS = float(os.getenv("OUTBOX_DEBOUNCE_SECONDS", "10"))
+# Повтор последнего сообщения тому же получателю об этом занятии за это время не ставится
+OUTBOX_DEDUP_WINDOW = int(os.getenv("OUTBOX_DEDUP_WINDOW", "600"))  # секунд
+# Срок аренды строки воркером: дольше самой медленной отправки пачки (с учётом RetryAfter)
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+# Число шардов notification_worker.py; 0 — очередь разбирает только диспетчер API
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", "0"))
+# Разбор outbox внутри API: по умолчанию выключен, если очередь разбирают воркеры
+OUTBOX_INPROCESS_DISPATCHER = os.getenv(
+    "OUTBOX_INPROCESS_DISPATCHER", "false" if NOTIFICATION_WORKERS else "true"
+).lower() == "true"
+
+# Типы уведомлений, которые сливаются между собой в окне OUTBOX_DEBOUNCE_SECONDS
+MERGEABLE_EVENT_TYPES = ("new", "status_changed")
+
+# Типы уведомлений, которые пользователи в режиме сводки получают в daily/weekly дайджесте
+DIGEST_EVENT_TYPES = ("new", "status_changed")
+
+# Лимит параметров в одном IN (...) для SQLite
+_IN_CHUNK = 500
+
+# Будит диспетчер сразу после коммита новых строк (иначе — опрос раз в OUTBOX_POLL_INTERVAL)
+_outbox_event: Optional[asyncio.Event] = None
+
+
+def _get_outbox_event() -> asyncio.Event:
+    global _outbox_event
+    if _outbox_event is None:
+        _outbox_event = asyncio.Event()
+    return _outbox_event
+
+
+def wake_dispatcher():
+    _get_outbox_event().set()
+
+
+async def wait_for_outbox(timeout: float = OUTBOX_POLL_INTERVAL):
+    """Ожидание новых строк или истечения интервала опроса"""
+    event = _get_outbox_event()
+    try:
+        await asyncio.wait_for(event.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        pass
+    event.clear()
+
+
+def shard_key(chat_id) -> int:
+    """Ключ шарда: все сообщения одного чата обрабатывает один воркер"""
+    return zlib.crc32(str(chat_id).encode())
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def make_dedup_key(event_type: str, slot_id: Optional[int], chat_id: str, payload: dict) -> str:
+    """Ключ идемпотентности: тип, занятие, получатель и содержимое сообщения"""
+    raw = json.dumps([event_type, slot_id, str(chat_id), payload], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def merge_payload(pending_type: str, pending: dict, event_type: str, payload: dict) -> tuple:
+    """
+    Слияние ожидающего уведомления с новым событием того же занятия.
+    Возвращает (event_type, payload) итогового сообщения или None, если изменения взаимно отменились.
+    """
+    if pending_type == "new":
+        # Занятие ещё не анонсировано: достаточно объявить его в итоговом состоянии
+        merged = {key: value for key, value in payload.items() if key != "old_status"}
+        return "new", merged
+
+    merged = dict(payload)
+    if pending_type == "status_changed" and event_type == "status_changed":
+        # Исходный статус — из первого изменения в окне
+        merged["old_status"] = pending.get("old_status")
+        if merged["old_status"] == merged.get("status"):
+            return None
+    return event_type, merged
+
+
+async def _latest_dedup_keys(db, slot_id: Optional[int], chat_ids: List[str]) -> dict:
+    """
+    chat_id → ключ последнего сообщения этому чату об этом занятии за OUTBOX_DEDUP_WINDOW.
+    Сравнивать нужно только с последним: после «отмена → возврат» новая отмена — не дубликат.
+    """
+    latest = {}
+    for start in range(0, len(chat_ids), _IN_CHUNK):
+        chunk = chat_ids[start:start + _IN_CHUNK]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor = await db.execute(f"""
+            SELECT chat_id, dedup_key FROM outbox
+            WHERE slot_id IS ? AND chat_id IN ({placeholders})
+            AND status IN ('queued', 'sending', 'sent', 'failed')
+            AND created_at >= datetime('now', ?)
+            ORDER BY id
+        """, [slot_id, *chunk, f"-{OUTBOX_DEDUP_WINDOW} seconds"])
+        latest.update((row[0], row[1]) for row in cursor.fetchall())
+    return latest
+
+
+async def _filter_recipients(db, event_type: str, slot_id: Optional[int], recipients: list,
+                             payload_json: str) -> list:
+    """
+    Отбрасывает чаты, помеченные недоступными, и откладывает в digest_events
+    события для пользователей в режиме сводки. Возвращает получателей для outbox.
+    """
+    user_ids = [user_id for user_id, _ in recipients if user_id is not None]
+    digest_users = set()
+    invalid_users = set()
+    for start in range(0, len(user_ids), _IN_CHUNK):
+        chunk = user_ids[start:start + _IN_CHUNK]
+        placeholders = ", ".join("?" for _ in chunk)
+        cursor = await db.execute(f"""
+            SELECT id, telegram_invalid_at IS NOT NULL, COALESCE(notification_mode, 'instant') != 'instant'
+            FROM users
+            WHERE id IN ({placeholders})
+            AND (telegram_invalid_at IS NOT NULL OR COALESCE(notification_mode, 'instant') != 'instant')
+        """, chunk)
+        for user_id, invalid, digest in cursor.fetchall():
+            if invalid:
+                invalid_users.add(user_id)
+            elif digest:
+                digest_users.add(user_id)
+
+    if invalid_users:
+        recipients = [(user_id, chat_id) for user_id, chat_id in recipients if user_id not in invalid_users]
+    if not digest_users or event_type not in DIGEST_EVENT_TYPES:
+        return recipients
+
+    await db.executemany("""
+        INSERT INTO digest_events (user_id, chat_id, event_type, slot_id, payload)
+        VALUES (?, ?, ?, ?, ?)
+    """, [
+        (user_id, chat_id, event_type, slot_id, payload_json)
+        for user_id, chat_id in recipients
+        if user_id in digest_users
+    ])
+    return [(user_id, chat_id) for user_id, chat_id in recipients if user_id not in digest_users]
+
+
+async def enqueue_notifications(db, event_type: str, slot_id: Optional[int], participants: List[dict],
+                                payload: dict) -> int:
+    """
+    Постановка уведомлений в очередь внутри транзакции db.
+    participants — список {"id": ..., "telegram_chat_id": ...}.
+    Ещё не отправленные уведомления того же занятия тому же участнику сливаются
+    в одно с итоговым состоянием, точные дубликаты отбрасываются.
+    Для пользователей в режиме сводки событие откладывается в digest_events,
+    недоступные чаты (users.telegram_invalid_at) пропускаются.
+    Возвращает число поставленных или обновлённых уведомлений.
+    """
+    now = time.time()
+    recipients = []
+    seen_chats = set()
+    for p in participants:
+        chat_id = p.get("telegram_chat_id")
+        if chat_id and str(chat_id) not in seen_chats:
+            seen_chats.add(str(chat_id))
+            recipients.append((p.get("id"), str(chat_id)))
+    if not recipients:
+        return 0
+
+    payload_json = json.dumps(payload, ensure_ascii=False, default=str)
+    recipients = await _filter_recipients(db, event_type, slot_id, recipients, payload_json)
+    if not recipients:
+        return 0
+
+    pending = {}
+    if slot_id is not None and event_type in MERGEABLE_EVENT_TYPES:
+        cursor = await db.execute("""
+            SELECT id, chat_id, event_type, payload, dedup_key FROM outbox
+            WHERE slot_id = ? AND status = 'queued' AND event_type IN ('new', 'status_changed')
+        """, (slot_id,))
+        pending = {row[1]: (row[0], row[2], json.loads(row[3]), row[4]) for row in cursor.fetchall()}
+
+    inserts = []
+    updates = []
+    deletes = []
+    unchanged = 0
+    for user_id, chat_id in recipients:
+        if chat_id in pending:
+            row_id, pending_type, pending_payload, pending_key = pending[chat_id]
+            merged = merge_payload(pending_type, pending_payload, event_type, payload)
+            if merged is None:
+                deletes.append((row_id,))
+                continue
+
+            merged_type, merged_payload = merged
+            merged_key = make_dedup_key(merged_type, slot_id, chat_id, merged_payload)
+            if merged_key == pending_key:
+                unchanged += 1
+                continue
+            updates.append((
+                merged_type,
+                json.dumps(merged_payload, ensure_ascii=False, default=str),
+                merged_key,
+                row_id
+            ))
+        else:
+            inserts.append((user_id, chat_id, make_dedup_key(event_type, slot_id, chat_id, payload)))
+
+    latest = await _latest_dedup_keys(db, slot_id, [chat_id for _, chat_id, _ in inserts]) if inserts else {}
+    duplicates = [chat_id for _, chat_id, key in inserts if latest.get(chat_id) == key]
+    rows = [
+        (event_type, slot_id, user_id, chat_id, shard_key(chat_id), payload_json, now + OUTBOX_DEBOUNCE_SECONDS, key)
+        for user_id, chat_id, key in inserts
+        if latest.get(chat_id) != key
+    ]
+
+    if rows:
+        await db.executemany("""
+            INSERT INTO outbox (event_type, slot_id, user_id, chat_id, shard_key, payload, available_at, dedup_key)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+    if updates:
+        await db.executemany(
+            "UPDATE outbox SET event_type = ?, payload = ?, dedup_key = ? WHERE id = ? AND status = 'queued'",
+            updates
+        )
+    if deletes:
+        await db.executemany("DELETE FROM outbox WHERE id = ? AND status = 'queued'", deletes)
+
+    if updates or deletes or duplicates or unchanged:
+        logger.info(
+            f"📭 Outbox: слито {len(updates)}, отменено {len(deletes)}, "
+            f"дубликатов {len(duplicates) + unchanged} (занятие {slot_id})"
+        )
+    if rows:
+        db.on_commit(wake_dispatcher)
+    return len(rows) + len(updates)
+
+
+# Условие шарда: при shards = 1 подходят все строки
+_SHARD_FILTER = "(? = 1 OR shard_key % ? = ?)"
+
+
+async def seconds_until_next_due(shard: int = 0, shards: int = 1) -> float:
+    """Сколько ждать до ближайшей строки шарда (с учётом окна слияния), не дольше интервала опроса"""
+    async with get_db_async() as db:
+        cursor = await db.execute(f"""
+            SELECT MIN(available_at) FROM outbox INDEXED BY idx_outbox_due
+            WHERE status IN ('queued', 'failed') AND {_SHARD_FILTER}
+        """, (shards, shards, shard))
+        next_due = cursor.fetchone()[0]
+    if next_due is None:
+        return OUTBOX_POLL_INTERVAL
+    return min(OUTBOX_POLL_INTERVAL, max(0.0, next_due - time.time()))
+
+
+async def release_expired_leases() -> int:
+    """
+    Строки в 'sending' с истёкшей арендой (воркер упал или завис) возвращаем в очередь.
+    Строка, на которой воркеры падают раз за разом, после OUTBOX_MAX_ATTEMPTS становится dead.
+    """
+    async with get_db_async() as db:
+        cursor = await db.execute("""
+            UPDATE outbox
+            SET status = CASE WHEN attempts >= ? THEN 'dead' ELSE 'failed' END,
+                lease_owner = NULL,
+                last_error = COALESCE(last_error, 'Истекла аренда воркера')
+            WHERE status = 'sending' AND (lease_until IS NULL OR lease_until < ?)
+        """, (OUTBOX_MAX_ATTEMPTS, time.time()))
+        if cursor.rowcount:
+            logger.warning(f"⚠️ Outbox: возвращено в очередь {cursor.rowcount} отправок с истёкшей арендой")
+        return cursor.rowcount
+
+
+async def claim_batch(worker_id: str, limit: int = OUTBOX_BATCH_SIZE, shard: int = 0, shards: int = 1) -> list:
+    """Забрать в аренду готовые к отправке строки шарда (status = 'sending')"""
+    now = time.time()
+    async with get_db_async() as db:
+        # Выбор и захват — одна инструкция: между ними не вклинится другой воркер
+        cursor = await db.execute(f"""
+            UPDATE outbox
+            SET status = 'sending', attempts = attempts + 1, lease_owner = ?, lease_until = ?
+            WHERE id IN (
+                SELECT id FROM outbox INDEXED BY idx_outbox_due
+                WHERE status IN ('queued', 'failed') AND available_at <= ? AND {_SHARD_FILTER}
+                ORDER BY available_at, id
+                LIMIT ?
+            )
+            RETURNING id, event_type, slot_id, user_id, chat_id, payload, attempts
+        """, (worker_id, now + OUTBOX_LEASE_SECONDS, now, shards, shards, shard, limit))
+        rows = sorted(cursor.fetchall(), key=lambda row: row[0])
+        if not rows:
+            return []
+
+        users = {}
+        user_ids = list({row[3] for row in rows if row[3] is not None})
+        for start in range(0, len(user_ids), _IN_CHUNK):
+            chunk = user_ids[start:start + _IN_CHUNK]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor = await db.execute(f"""
+                SELECT id, full_name, locale, telegram_id, telegram_invalid_at IS NOT NULL
+                FROM users WHERE id IN ({placeholders})
+            """, chunk)
+            users.update({row[0]: row[1:] for row in cursor.fetchall()})
+
+    batch = []
+    for row in rows:
+        full_name, locale, telegram_id, invalid = users.get(row[3], (None, None, None, False))
+        batch.append({
+            "id": row[0],
+            "event_type": row[1],
+            "slot_id": row[2],
+            "user_id": row[3],
+            "chat_id": row[4],
+            "payload": json.loads(row[5]),
+            # Версия сообщения — отпечаток сохранённого payload (ключ кэша готовых сообщений)
+            "version": hashlib.sha1(row[5].encode()).hexdigest(),
+            "attempts": row[6],
+            "full_name": full_name,
+            "locale": locale,
+            # Чат помечен недоступным после постановки в очередь — отправлять не нужно
+            "chat_invalid": bool(invalid) and telegram_id == row[4]
+        })
+    return batch
+
+
+def retry_delay(attempts: int) -> float:
+    """Экспоненциальная задержка повтора с джиттером (строки не возвращаются пачкой одновременно)"""
+    delay = min(OUTBOX_RETRY_BASE * (2 ** (attempts - 1)), OUTBOX_RETRY_MAX)
+    return random.uniform(delay / 2, delay)
+
+
+async def complete_batch(worker_id: str, sent: List[int], failed: List[tuple], invalid_chats: List[tuple] = ()):
+    """
+    Фиксация результатов аренды worker_id: sent — id доставленных строк,
+    failed — (id, attempts, error, permanent): 'failed' до повтора, постоянные ошибки
+    и исчерпавшие попытки — 'dead';
+    invalid_chats — (user_id, chat_id, error): чаты, куда бот больше не может писать.
+    Строки, аренду которых уже перехватил другой воркер, не трогаем.
+    """
+    now = time.time()
+    async with get_db_async() as db:
+        if sent:
+            await db.executemany("""
+                UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP, last_error = NULL
+                WHERE id = ? AND lease_owner = ?
+            """, [(row_id, worker_id) for row_id in sent])
+        if failed:
+            await db.executemany("""
+                UPDATE outbox
+                SET status = CASE WHEN ? OR attempts >= ? THEN 'dead' ELSE 'failed' END,
+                    available_at = ?,
+                    last_error = ?
+                WHERE id = ? AND lease_owner = ?
+            """, [
+                (permanent, OUTBOX_MAX_ATTEMPTS, now + retry_delay(attempts), error, row_id, worker_id)
+                for row_id, attempts, error, permanent in failed
+            ])
+        if invalid_chats:
+            # Только если у пользователя всё ещё этот chat_id (мог переподписаться)
+            await db.executemany("""
+                UPDATE users SET telegram_invalid_at = CURRENT_TIMESTAMP, telegram_error = ?
+                WHERE id = ? AND telegram_id = ?
+            """, [(error, user_id, chat_id) for user_id, chat_id, error in invalid_chats if user_id is not None])
+            invalidate_on_commit(db, "users")
+
+    for user_id, chat_id, error in invalid_chats:
+        logger.warning(f"🚫 Чат {chat_id} (пользователь {user_id}) недоступен: {error}")
+
+
+async def get_outbox_stats() -> dict:
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        counts = {row[0]: row[1] for row in cursor.fetchall()}
+        cursor = await db.execute("SELECT MIN(available_at) FROM outbox WHERE status IN ('queued', 'failed')")
+        oldest = cursor.fetchone()[0]
+        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE telegram_invalid_at IS NOT NULL")
+        invalid_chats = cursor.fetchone()[0]
+        cursor = await db.execute(
+            "SELECT lease_owner, COUNT(*) FROM outbox WHERE status = 'sending' GROUP BY lease_owner"
+        )
+        leases = {row[0] or "unknown": row[1] for row in cursor.fetchall()}
+    return {
+        "counts": counts,
+        "leases": leases,
+        "oldest_queued_age_seconds": round(max(0.0, time.time() - oldest), 1) if oldest else 0.0,
+        "invalid_chats": invalid_chats
+    }
+
+
+# ========== DEAD LETTERS ==========
+
+async def list_dead_letters(limit: int = 100, cursor: Optional[str] = None) -> dict:
+    """Недоставленные уведомления (status = 'dead'), новые сначала; постранично по id"""
+    limit = page_limit(limit)
+    query = """
+        SELECT o.id, o.event_type, o.slot_id, o.user_id, u.full_name, o.chat_id,
+               o.attempts, o.last_error, o.created_at, u.telegram_invalid_at
+        FROM outbox o
+        LEFT JOIN users u ON u.id = o.user_id
+        WHERE o.status = 'dead'
+    """
+    params = []
+    if cursor:
+        (last_id,) = decode_cursor(cursor, 1)
+        query += " AND o.id < ?"
+        params.append(last_id)
+    query += " ORDER BY o.id DESC LIMIT ?"
+    params.append(limit + 1)
+
+    async with get_db_async() as db:
+        rows = (await db.execute(query, params)).fetchall()
+
+    rows, next_cursor = split_page(rows, limit, lambda row: (row[0],))
+    return {
+        "items": [
+            {
+                "id": row[0],
+                "event_type": row[1],
+                "slot_id": row[2],
+                "user_id": row[3],
+                "user_name": row[4],
+                "chat_id": row[5],
+                "attempts": row[6],
+                "last_error": row[7],
+                "created_at": row[8],
+                "chat_invalid": row[9] is not None
+            }
+            for row in rows
+        ],
+        "next_cursor": next_cursor
+    }
+
+
+async def retry_dead_letters(ids: Optional[List[int]] = None) -> int:
+    """
+    Повторная постановка недоставленных: выбранных ids или всех.
+    Строки в недоступные чаты остаются dead, пока пользователь не переподпишется.
+    """
+    query = """
+        UPDATE outbox
+        SET status = 'queued', attempts = 0, available_at = ?
+        WHERE status = 'dead'
+        AND NOT EXISTS (
+            SELECT 1 FROM users u
+            WHERE u.id = outbox.user_id AND u.telegram_invalid_at IS NOT NULL AND u.telegram_id = outbox.chat_id
+        )
+    """
+    now = time.time()
+    async with get_db_async() as db:
+        # Строки без ключа шарда не заберёт ни один воркер при shards > 1
+        cursor = await db.execute("SELECT id, chat_id FROM outbox WHERE status = 'dead' AND shard_key IS NULL")
+        missing = cursor.fetchall()
+        if missing:
+            await db.executemany(
+                "UPDATE outbox SET shard_key = ? WHERE id = ?",
+                [(shard_key(chat_id), outbox_id) for outbox_id, chat_id in missing]
+            )
+
+        if ids is None:
+            cursor = await db.execute(query, (now,))
+            retried = cursor.rowcount
+        else:
+            retried = 0
+            for start in range(0, len(ids), _IN_CHUNK):
+                chunk = ids[start:start + _IN_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                cursor = await db.execute(query + f" AND id IN ({placeholders})", (now, *chunk))
+                retried += cursor.rowcount
+        if retried:
+            db.on_commit(wake_dispatcher)
+
+    logger.info(f"♻️ Outbox: повторно поставлено {retried} недоставленных уведомлений")
+    return retried
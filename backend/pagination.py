@@ -0,0 +1,50 @@
+import base64
+import json
+from typing import Optional
+from fastapi import HTTPException
+
+# Заголовок ответа с курсором следующей страницы (тело списков остаётся массивом)
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(*values) -> str:
+    """Упаковка ключа последней строки страницы в непрозрачный курсор"""
+    raw = json.dumps(list(values), ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> list:
+    """Распаковка курсора; ожидается ровно size значений ключа"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации")
+
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Некорректный курсор пагинации")
+    return values
+
+
+def page_limit(limit: int) -> int:
+    """Проверка размера страницы"""
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit должен быть положительным")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def split_page(rows: list, limit: int, key) -> tuple:
+    """
+    Отделяет лишнюю (limit + 1)-ю строку и строит курсор следующей страницы.
+    key(row) возвращает кортеж значений ключа сортировки.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def set_next_cursor(response, next_cursor: Optional[str]):
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
@@ -1,5 +1,5 @@
 import openpyxl
-from typing import List, Dict
+from typing import Callable, Dict, Iterator, List, Optional, Union
 import re
 
 # Сопоставление дней недели
@@ -25,64 +25,95 @@ PAIR_TIMES = {
     8: "20:20-21:50"
 }
 
+# Паттерны для извлечения данных
+COURSE_PATTERN = re.compile(r'(\d{3}-\d{2}м?)')  # 606-51, 603-51м и т.д.
 
-def parse_excel_schedule(file_path: str) -> List[Dict]:
+
+def list_sheets(file_path: str) -> List[str]:
+    """Имена листов книги в порядке следования (читается только оглавление книги)"""
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return list(workbook.sheetnames)
+    finally:
+        workbook.close()
+
+
+def iter_excel_schedule(file_path: str, on_error: Optional[Callable[[int, str], None]] = None,
+                        sheet_name: Optional[str] = None) -> Iterator[Dict]:
     """
-    Парсинг реального Excel файла с расписанием СурГУ
-    Возвращает список занятий
+    Потоковый парсинг Excel файла с расписанием СурГУ.
+    Книга открывается в режиме read_only: строки читаются из XML по одной, объекты ячеек
+    не накапливаются, поэтому память не растёт с размером файла. Занятия отдаются
+    генератором — запись в БД может идти, пока файл ещё читается.
+    on_error(номер строки, текст ошибки) вызывается для строк, которые не удалось разобрать.
+    sheet_name — лист для разбора (по умолчанию активный).
     """
-    workbook = openpyxl.load_workbook(file_path, data_only=True)
-    sheet = workbook.active
-
-    schedule_entries = []
-    current_course = None  # переименовано из current_group
-    current_day = None
-
-    # Паттерны для извлечения данных
-    course_pattern = re.compile(r'(\d{3}-\d{2}м?)')  # 606-51, 603-51м и т.д.
-
-    for row_idx, row in enumerate(sheet.iter_rows(values_only=True), start=1):
-        # Пропускаем пустые строки
-        if not row or not any(row):
-            continue
-
-        first_cell = str(row[0] or '').strip()
-
-        # Ищем название курса
-        course_match = course_pattern.search(first_cell)
-        if course_match or ('курс' in first_cell.lower()):
-            current_course = first_cell
-            continue
-
-        # Ищем день недели
-        if first_cell in DAY_MAPPING:
-            current_day = DAY_MAPPING[first_cell]
-            continue
-
-        # Обрабатываем строку с предметом
-        if current_course and current_day and len(row) >= 4:
-            try:
-                pair_num = int(row[0]) if row[0] and str(row[0]).isdigit() else None
-                subject = str(row[1] or '').strip()
-                teacher = str(row[2] or '').strip()
-                room = str(row[3] or '').strip()
-
-                if not subject or subject == '-':
-                    continue
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        sheet = workbook[sheet_name] if sheet_name is not None else workbook.active
+
+        current_course = None  # переименовано из current_group
+        current_day = None
 
-                time_slot = PAIR_TIMES.get(pair_num, "00:00-00:00")
+        for row_idx, row in enumerate(sheet.iter_rows(values_only=True), start=1):
+            # Пропускаем пустые строки
+            if not row or not any(row):
+                continue
 
-                schedule_entries.append({
-                    'course_name': current_course,  # переименовано из group_name
-                    'day_of_week': current_day,
-                    'time_slot': time_slot,
-                    'subject': subject,
-                    'teacher': teacher if teacher else None,
-                    'room': room if room else None
-                })
+            first_cell = str(row[0] or '').strip()
 
-            except Exception as e:
-                print(f"⚠️  Ошибка в строке {row_idx}: {e}")
+            # Ищем название курса
+            course_match = COURSE_PATTERN.search(first_cell)
+            if course_match or ('курс' in first_cell.lower()):
+                current_course = first_cell
                 continue
 
-    return schedule_entries
+            # Ищем день недели
+            if first_cell in DAY_MAPPING:
+                current_day = DAY_MAPPING[first_cell]
+                continue
+
+            # Обрабатываем строку с предметом
+            if current_course and current_day:
+                # В read_only строки без размеров листа бывают короче: недостающие ячейки пустые
+                if len(row) < 4:
+                    row = tuple(row) + (None,) * (4 - len(row))
+                try:
+                    pair_num = int(row[0]) if row[0] and str(row[0]).isdigit() else None
+                    subject = str(row[1] or '').strip()
+                    teacher = str(row[2] or '').strip()
+                    room = str(row[3] or '').strip()
+
+                    if not subject or subject == '-':
+                        continue
+
+                    time_slot = PAIR_TIMES.get(pair_num, "00:00-00:00")
+
+                    yield {
+                        'course_name': current_course,  # переименовано из group_name
+                        'day_of_week': current_day,
+                        'time_slot': time_slot,
+                        'subject': subject,
+                        'teacher': teacher if teacher else None,
+                        'room': room if room else None
+                    }
+
+                except Exception as e:
+                    print(f"⚠️  Ошибка в строке {row_idx}: {e}")
+                    if on_error:
+                        on_error(row_idx, str(e))
+                    continue
+    finally:
+        # Книга в read_only держит файл открытым до явного закрытия
+        workbook.close()
+
+
+def parse_excel_schedule(file_path: str, stream: bool = False,
+                         on_error: Optional[Callable[[int, str], None]] = None,
+                         sheet_name: Optional[str] = None) -> Union[List[Dict], Iterator[Dict]]:
+    """
+    Парсинг реального Excel файла с расписанием СурГУ
+    Возвращает список занятий; stream=True — генератор (см. iter_excel_schedule)
+    """
+    entries = iter_excel_schedule(file_path, on_error, sheet_name)
+    return entries if stream else list(entries)
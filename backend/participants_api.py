@@ -1,5 +1,8 @@
 from fastapi import HTTPException
-from database import get_db
+from database import get_db_async
+from auth import invalidate_user_cache
+from response_cache import invalidate_on_commit
+from pagination import decode_cursor, page_limit, split_page
 from typing import Optional
 import logging
 
@@ -10,11 +13,9 @@ async def create_participant(data: dict):
     """
     Создание участника с поддержкой telegram Chat ID
     """
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Проверяем, существует ли пользователь с таким email
-        cursor.execute("SELECT id FROM users WHERE email = ?", (data.get('email'),))
+        cursor = await db.execute("SELECT id FROM users WHERE email = ?", (data.get('email'),))
         existing_user = cursor.fetchone()
 
         if existing_user:
@@ -22,9 +23,10 @@ async def create_participant(data: dict):
 
             # Обновляем telegram_id если он предоставлен
             if data.get('telegram'):
-                cursor.execute("""
+                await db.execute("""
                     UPDATE users SET telegram_id = ? WHERE id = ?
                 """, (data.get('telegram'), user_id))
+                db.on_commit(lambda: invalidate_user_cache(user_id))
                 logger.info(f"✅ Обновлён telegram_id для пользователя ID={user_id}")
         else:
             # Создаём нового пользователя
@@ -34,7 +36,7 @@ async def create_participant(data: dict):
             temp_password = secrets.token_urlsafe(12)
             password_hash = hash_password(temp_password)
 
-            cursor.execute("""
+            cursor = await db.execute("""
                 INSERT INTO users (email, password_hash, full_name, telegram_id)
                 VALUES (?, ?, ?, ?)
             """, (
@@ -47,10 +49,12 @@ async def create_participant(data: dict):
             user_id = cursor.lastrowid
             logger.info(f"✅ Создан новый пользователь ID={user_id} с telegram_id={data.get('telegram')}")
 
+        invalidate_on_commit(db, "users")
+
         # Добавляем участника к слоту если указан
         if data.get('class_slot_id'):
             try:
-                cursor.execute("""
+                await db.execute("""
                     INSERT INTO participants (class_slot_id, user_id, status)
                     VALUES (?, ?, ?)
                 """, (data.get('class_slot_id'), user_id, data.get('status', 'registered')))
@@ -61,7 +65,7 @@ async def create_participant(data: dict):
 
         # Добавляем участника ко всем слотам курса если указан course_id
         if data.get('course_id'):
-            cursor.execute("""
+            cursor = await db.execute("""
                 SELECT id FROM class_slots WHERE course_id = ?
             """, (data.get('course_id'),))
 
@@ -70,7 +74,7 @@ async def create_participant(data: dict):
 
             for slot in slots:
                 try:
-                    cursor.execute("""
+                    await db.execute("""
                         INSERT INTO participants (class_slot_id, user_id, status)
                         VALUES (?, ?, ?)
                     """, (slot[0], user_id, data.get('status', 'registered')))
@@ -94,14 +98,15 @@ async def get_participants(
         course_id: Optional[int] = None,
         slot_id: Optional[int] = None,
         limit: int = 100,
-        offset: int = 0
+        offset: int = 0,
+        cursor: Optional[str] = None
 ):
     """
-    Получение списка участников с фильтрацией
+    Получение списка участников с фильтрацией.
+    Постраничный вывод по ключу id: возвращает {"items": [...], "next_cursor": ...}
     """
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    limit = page_limit(limit)
+    async with get_db_async() as db:
         query = """
             SELECT DISTINCT u.id, u.email, u.full_name, u.telegram_id
             FROM users u
@@ -127,34 +132,42 @@ async def get_participants(
             conditions.append("u.email LIKE ?")
             params.append(f"%{email}%")
 
+        if cursor:
+            (after_id,) = decode_cursor(cursor, 1)
+            conditions.append("u.id > ?")
+            params.append(after_id)
+            offset = 0
+
         if conditions:
             if 'WHERE' in query:
                 query += " AND " + " AND ".join(conditions)
             else:
                 query += " WHERE " + " AND ".join(conditions)
 
-        query += " LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
+        query += " ORDER BY u.id LIMIT ? OFFSET ?"
+        params.extend([limit + 1, offset])
 
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
+        result = await db.execute(query, params)
+        rows, next_cursor = split_page(result.fetchall(), limit, key=lambda row: (row[0],))
 
-        return [
-            {
-                "id": row[0],
-                "email": row[1],
-                "name": row[2],
-                "telegram": row[3]
-            }
-            for row in rows
-        ]
+        return {
+            "items": [
+                {
+                    "id": row[0],
+                    "email": row[1],
+                    "name": row[2],
+                    "telegram": row[3]
+                }
+                for row in rows
+            ],
+            "next_cursor": next_cursor
+        }
 
 
 async def get_participant(participant_id: int):
     """Получение участника по ID"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
+    async with get_db_async() as db:
+        cursor = await db.execute("""
             SELECT id, email, full_name, telegram_id
             FROM users WHERE id = ?
         """, (participant_id,))
@@ -173,11 +186,13 @@ async def get_participant(participant_id: int):
 
 async def delete_participant(participant_id: int):
     """Удаление участника"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (participant_id,))
+    async with get_db_async() as db:
+        cursor = await db.execute("DELETE FROM users WHERE id = ?", (participant_id,))
 
         if cursor.rowcount == 0:
             raise HTTPException(status_code=404, detail="Участник не найден")
 
+        db.on_commit(lambda: invalidate_user_cache(participant_id))
+        invalidate_on_commit(db, "users")
+
         return {"message": "Участник удалён"}
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    Асинхронный token bucket: rate токенов в секунду, не более capacity подряд.
+    Ожидающие обслуживаются по очереди (FIFO через lock).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """Забрать один токен; возвращает время ожидания в секундах"""
+        started = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return now - started
+                    wait = (1 - self.tokens) / self.rate
+                await asyncio.sleep(wait)
+
+    def try_acquire(self) -> bool:
+        """Неблокирующая попытка забрать токен"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.blocked_until <= now and self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def pause(self, seconds: float):
+        """Не выдавать токены seconds секунд (ответ 429 / RetryAfter)"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def is_idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now and not self._lock.locked()
+
+
+class KeyedTokenBuckets:
+    """Отдельный token bucket на ключ (например, chat_id); простаивающие бакеты удаляются"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def get(self, key) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._evict_idle()
+            bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets[key] = bucket
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    async def acquire(self, key) -> float:
+        return await self.get(key).acquire()
+
+    def _evict_idle(self):
+        # Полный бакет без ожидающих эквивалентен новому — его можно выбросить
+        for key in list(self._buckets):
+            if self._buckets[key].is_idle():
+                del self._buckets[key]
+            if len(self._buckets) < self.max_keys // 2:
+                break
+
+    def __len__(self):
+        return len(self._buckets)
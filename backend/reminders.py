@@ -0,0 +1,269 @@
+"""
+Напоминания «занятие начнётся через N минут».
+
+Планировщик держит в памяти min-heap моментов срабатывания (одна запись на занятие,
+а не на участника). При старте heap заполняется диапазонным запросом по индексу
+idx_class_slots_start_at на горизонт REMINDER_HORIZON_HOURS, затем горизонт
+сдвигается такими же диапазонными запросами — полного сканирования таблицы нет.
+Создание, перенос, отмена и удаление занятий обновляют heap точечно.
+Сработавшее напоминание ставится в outbox для участников занятия.
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from database import get_db_async
+from outbox import enqueue_notifications
+
+logger = logging.getLogger(__name__)
+
+REMINDER_LEAD_MINUTES = int(os.getenv("REMINDER_LEAD_MINUTES", "30"))
+REMINDER_HORIZON_HOURS = int(os.getenv("REMINDER_HORIZON_HOURS", "48"))
+REMINDER_HORIZON_REFRESH = float(os.getenv("REMINDER_HORIZON_REFRESH", "3600"))  # секунд
+REMINDER_LOAD_BATCH = 5000
+
+# Формат class_slots.start_at (результат SQLite datetime())
+START_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def parse_start_at(start_at: Optional[str]) -> Optional[datetime]:
+    if not start_at:
+        return None
+    try:
+        return datetime.fromisoformat(start_at)
+    except ValueError:
+        return None
+
+
+class ReminderScheduler:
+    """Min-heap напоминаний с ленивым удалением устаревших записей"""
+
+    def __init__(self, lead: timedelta, horizon: timedelta):
+        self.lead = lead
+        self.horizon = horizon
+        self._heap = []  # (fire_at, seq, slot_id)
+        self._scheduled = {}  # slot_id -> fire_at (актуальная запись)
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self.loaded_until: Optional[datetime] = None
+        self.fired = 0
+        self.reminders_queued = 0
+
+    # ---------- heap ----------
+
+    def _get_wakeup(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def schedule(self, slot_id: int, start_at: datetime):
+        fire_at = start_at - self.lead
+        if self._scheduled.get(slot_id) == fire_at:
+            return
+        self._scheduled[slot_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, next(self._seq), slot_id))
+        # Новое напоминание может оказаться раньше текущего ожидания
+        if self._heap[0][2] == slot_id:
+            self._get_wakeup().set()
+
+    def cancel(self, slot_id: int):
+        # Запись в heap остаётся и будет пропущена при извлечении
+        if self._scheduled.pop(slot_id, None) is not None:
+            self._compact_if_needed()
+
+    def _compact_if_needed(self):
+        if len(self._heap) > 2 * len(self._scheduled) + 1000:
+            self._heap = [
+                (fire_at, next(self._seq), slot_id)
+                for slot_id, fire_at in self._scheduled.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now: datetime) -> list:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, _, slot_id = heapq.heappop(self._heap)
+            if self._scheduled.get(slot_id) == fire_at:
+                del self._scheduled[slot_id]
+                due.append(slot_id)
+        return due
+
+    def _seconds_until_next(self, now: datetime) -> float:
+        while self._heap and self._scheduled.get(self._heap[0][2]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        if not self._heap:
+            return REMINDER_HORIZON_REFRESH
+        return min(REMINDER_HORIZON_REFRESH, max(0.0, (self._heap[0][0] - now).total_seconds()))
+
+    # ---------- загрузка из БД ----------
+
+    async def load_range(self, start: datetime, end: datetime) -> int:
+        """Занятия со start_at в [start, end): диапазонный запрос по покрывающему индексу, пачками"""
+        loaded = 0
+        last = (start.strftime(START_AT_FORMAT), 0)
+        end_key = end.strftime(START_AT_FORMAT)
+        while True:
+            async with get_db_async() as db:
+                cursor = await db.execute("""
+                    SELECT id, start_at FROM class_slots
+                    WHERE (start_at, id) > (?, ?) AND start_at < ? AND status = 'scheduled'
+                    ORDER BY start_at, id
+                    LIMIT ?
+                """, (*last, end_key, REMINDER_LOAD_BATCH))
+                rows = cursor.fetchall()
+
+            for slot_id, start_at in rows:
+                parsed = parse_start_at(start_at)
+                if parsed is not None:
+                    self.schedule(slot_id, parsed)
+                    loaded += 1
+
+            if len(rows) < REMINDER_LOAD_BATCH:
+                return loaded
+            last = (rows[-1][1], rows[-1][0])
+
+    async def rebuild(self):
+        """Полная перестройка при старте: занятия от текущего момента до горизонта"""
+        self._heap = []
+        self._scheduled = {}
+        now = datetime.now().replace(microsecond=0)
+        self.loaded_until = now + self.horizon
+        loaded = await self.load_range(now, self.loaded_until)
+        logger.info(f"⏰ Напоминания: запланировано {loaded} занятий до {self.loaded_until}")
+
+    async def extend_horizon(self):
+        """Догрузка следующего окна, без повторного чтения уже загруженного"""
+        new_until = datetime.now().replace(microsecond=0) + self.horizon
+        if self.loaded_until is not None and new_until > self.loaded_until:
+            loaded = await self.load_range(self.loaded_until, new_until)
+            self.loaded_until = new_until
+            if loaded:
+                logger.info(f"⏰ Напоминания: догружено {loaded} занятий до {self.loaded_until}")
+
+    async def refresh_slot(self, slot_id: int):
+        """Точечное обновление после создания/изменения занятия"""
+        async with get_db_async() as db:
+            cursor = await db.execute("SELECT start_at, status FROM class_slots WHERE id = ?", (slot_id,))
+            row = cursor.fetchone()
+
+        start_at = parse_start_at(row[0]) if row else None
+        in_window = (
+            start_at is not None
+            and row[1] == "scheduled"
+            and start_at > datetime.now()
+            and (self.loaded_until is None or start_at < self.loaded_until)
+        )
+        if in_window:
+            self.schedule(slot_id, start_at)
+        else:
+            self.cancel(slot_id)
+
+    # ---------- отправка ----------
+
+    async def fire(self, slot_id: int) -> int:
+        """
+        Постановка напоминания в outbox для участников занятия.
+        Время занятия перечитывается из БД: heap другого процесса API не знает о переносе,
+        сделанном здесь, и наоборот. Если по актуальному start_at напоминать ещё рано,
+        занятие перепланируется вместо отправки.
+        """
+        async with get_db_async() as db:
+            # Проверка «уже напомнили» и постановка — под блокировкой записи:
+            # процессы API, сработавшие одновременно, не поставят напоминание дважды
+            await db.execute("BEGIN IMMEDIATE")
+            cursor = await db.execute("""
+                SELECT cs.date_time, cs.location, cs.status, c.name, cs.start_at
+                FROM class_slots cs
+                LEFT JOIN courses c ON c.id = cs.course_id
+                WHERE cs.id = ?
+            """, (slot_id,))
+            slot = cursor.fetchone()
+            if not slot or slot[2] != "scheduled":
+                return 0
+
+            start_at = parse_start_at(slot[4])
+            now = datetime.now()
+            if start_at is None or start_at <= now:
+                return 0
+            if start_at - self.lead > now:
+                self.schedule(slot_id, start_at)
+                return 0
+
+            cursor = await db.execute("""
+                SELECT u.id, u.telegram_id
+                FROM users u
+                INNER JOIN participants p ON u.id = p.user_id
+                WHERE p.class_slot_id = ?
+                AND u.telegram_id IS NOT NULL
+            """, (slot_id,))
+            participants = [{"id": row[0], "telegram_chat_id": row[1]} for row in cursor.fetchall()]
+
+            # После перезапуска не напоминаем повторно (индекс idx_outbox_slot_event);
+            # после переноса занятия напоминание о новом времени уходит снова
+            cursor = await db.execute("""
+                SELECT chat_id FROM outbox
+                WHERE slot_id = ? AND event_type = 'reminder'
+                AND json_extract(payload, '$.start_at') IS ?
+            """, (slot_id, slot[4]))
+            reminded = {row[0] for row in cursor.fetchall()}
+            participants = [p for p in participants if str(p["telegram_chat_id"]) not in reminded]
+
+            slot_data = {
+                "course_name": slot[3] or "Неизвестный курс",
+                "start_time": slot[0],
+                "end_time": slot[0],
+                "location": slot[1] or "Не указано",
+                "status": slot[2],
+                "start_at": slot[4]
+            }
+            return await enqueue_notifications(db, "reminder", slot_id, participants, slot_data)
+
+    async def run(self):
+        """Фоновая задача: ожидание ближайшего напоминания и сдвиг горизонта"""
+        await self.rebuild()
+        next_refresh = asyncio.get_running_loop().time() + REMINDER_HORIZON_REFRESH
+        wakeup = self._get_wakeup()
+        while True:
+            try:
+                now = datetime.now()
+                for slot_id in self._pop_due(now):
+                    queued = await self.fire(slot_id)
+                    self.fired += 1
+                    self.reminders_queued += queued
+                    if queued:
+                        logger.info(f"⏰ Напоминание о занятии {slot_id}: в очереди {queued}")
+
+                if asyncio.get_running_loop().time() >= next_refresh:
+                    await self.extend_horizon()
+                    next_refresh = asyncio.get_running_loop().time() + REMINDER_HORIZON_REFRESH
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Ошибка планировщика напоминаний: {e}")
+
+            timeout = self._seconds_until_next(datetime.now())
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            wakeup.clear()
+
+    def stats(self) -> dict:
+        return {
+            "lead_minutes": int(self.lead.total_seconds() // 60),
+            "pending": len(self._scheduled),
+            "heap_size": len(self._heap),
+            "loaded_until": self.loaded_until.strftime(START_AT_FORMAT) if self.loaded_until else None,
+            "fired": self.fired,
+            "reminders_queued": self.reminders_queued
+        }
+
+
+reminder_scheduler = ReminderScheduler(
+    lead=timedelta(minutes=REMINDER_LEAD_MINUTES),
+    horizon=timedelta(hours=REMINDER_HORIZON_HOURS)
+)
@@ -0,0 +1,243 @@
+import os
+import threading
+import time
+import logging
+import zlib
+from collections import OrderedDict
+from typing import Iterable, Optional
+from urllib.parse import urlencode
+from fastapi import Response
+from database import get_db_async
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))  # секунд
+
+
+class CacheBackend:
+    """Интерфейс хранилища кэша ответов (можно подменить, например, на Redis)"""
+
+    def get(self, key: str):
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float, tags: Iterable[str]):
+        raise NotImplementedError
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InMemoryCacheBackend(CacheBackend):
+    """LRU + TTL в памяти процесса с индексом тегов для точечной инвалидации"""
+
+    def __init__(self, max_size: int = RESPONSE_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._keys_by_tag = {}  # tag -> set(key)
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: float, tags: Iterable[str]):
+        tags = frozenset(tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tags)
+            for tag in tags:
+                self._keys_by_tag.setdefault(tag, set()).add(key)
+
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        removed = 0
+        with self._lock:
+            for tag in tags:
+                for key in list(self._keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_tag.clear()
+
+    def _remove(self, key: str):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._keys_by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_tag[tag]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
+
+
+class ResponseCache:
+    """
+    Кэш ответов GET-эндпоинтов: ключ — путь + параметры запроса,
+    инвалидация — по тегам из мутирующих операций.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: float = RESPONSE_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # Растёт при каждой инвалидации: загруженное во время сброса значение не кладём в кэш
+        self._epoch = 0
+
+    @staticmethod
+    def make_key(request) -> str:
+        """
+        Ключ кэша из пути и отсортированных query-параметров.
+        Если ETag ответа уже построен (check_not_modified), в ключ входят те же версии таблиц:
+        тело из кэша всегда соответствует ETag, даже если запись не сбросила теги кэша.
+        """
+        key = _request_key(request)
+        versions = getattr(request.state, "table_versions", None)
+        if versions:
+            key += f"#{_version_part(versions)}"
+        return key
+
+    async def get_or_load(self, key: str, tags, loader, ttl: Optional[float] = None):
+        """
+        Значение из кэша или результат await loader().
+        tags — список тегов или функция value -> теги (если они зависят от загруженных данных).
+        """
+        value = self.backend.get(key)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            self.misses += 1
+            epoch = self._epoch
+
+        value = await loader()
+        if epoch == self._epoch:
+            resolved_tags = tags(value) if callable(tags) else tags
+            self.backend.set(key, value, self.ttl if ttl is None else ttl, resolved_tags)
+        return value
+
+    def invalidate(self, *tags: str):
+        removed = self.backend.invalidate_tags(tags)
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += removed
+        if removed:
+            logger.debug(f"Кэш ответов: сброшено {removed} записей по тегам {tags}")
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "invalidations": self.invalidations
+            }
+        stats.update(self.backend.stats())
+        return stats
+
+
+response_cache = ResponseCache(InMemoryCacheBackend())
+
+
+def invalidate_on_commit(db, *tags: str):
+    """Сбросить теги кэша после коммита транзакции db"""
+    db.on_commit(lambda: response_cache.invalidate(*tags))
+
+
+# ========== ETAG / УСЛОВНЫЕ GET ==========
+
+async def get_table_versions(tables: Iterable[str]) -> dict:
+    """Текущие значения счётчиков изменений таблиц (ведутся триггерами в table_versions)"""
+    tables = list(tables)
+    placeholders = ", ".join("?" for _ in tables)
+    async with get_db_async() as db:
+        cursor = await db.execute(
+            f"SELECT table_name, version FROM table_versions WHERE table_name IN ({placeholders})",
+            tables
+        )
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def _request_key(request) -> str:
+    query = urlencode(sorted(request.query_params.multi_items()))
+    return f"{request.url.path}?{query}"
+
+
+def _version_part(versions: dict) -> str:
+    return ".".join(f"{versions.get(table, 0)}" for table in sorted(versions))
+
+
+def make_etag(key: str, versions: dict) -> str:
+    """Сильный ETag из версий таблиц и ключа запроса (без хеширования тела ответа)"""
+    return f'"v{_version_part(versions)}-{zlib.crc32(key.encode()):08x}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Для If-None-Match сравнение слабое: префикс W/ не учитываем
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
+async def check_not_modified(request, response: Response, tables: Iterable[str]) -> Optional[Response]:
+    """
+    Ставит ETag на ответ. Если клиент прислал актуальный If-None-Match,
+    возвращает готовый 304 Not Modified — тело можно не собирать.
+    """
+    versions = await get_table_versions(tables)
+    etag = make_etag(_request_key(request), versions)
+    # Тело ответа берётся из кэша по ключу с этими же версиями (ResponseCache.make_key)
+    request.state.table_versions = versions
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return None
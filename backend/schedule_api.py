@@ -1,10 +1,15 @@
 from fastapi import UploadFile, File, HTTPException
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional
 from pydantic import BaseModel
-from database import get_db
-from parser import parse_excel_schedule
+from database import get_db, get_db_async
+from import_jobs import create_import_job, create_batch_import_job
 import os
-import tempfile
+import hashlib
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
 
 
 # Модели данных
@@ -18,79 +23,279 @@ class ScheduleEntry(BaseModel):
     room: str = None
 
 
+# Размер пачки executemany при импорте расписания
+SCHEDULE_IMPORT_BATCH_SIZE = int(os.getenv("SCHEDULE_IMPORT_BATCH_SIZE", "5000"))
+
+_INSERT_SCHEDULE_SQL = """
+    INSERT INTO schedule (course_id, day_of_week, time_slot, subject, teacher, room, fingerprint)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def entry_fingerprint(course_name: str, day_of_week: int, time_slot: str, subject: str,
+                      teacher: Optional[str], room: Optional[str]) -> str:
+    """Отпечаток строки расписания (тот же, что заполняет миграция 14)"""
+    raw = json.dumps([course_name, int(day_of_week), time_slot, subject, teacher, room], ensure_ascii=False)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
 # Вспомогательные функции для работы с БД
-def get_or_create_course(course_name: str) -> int:
-    """Получить ID курса или создать новый"""
+def load_course_ids(conn) -> Dict[str, int]:
+    """Справочник name → id всех курсов одним запросом (по индексу idx_courses_name)"""
+    cursor = conn.execute("SELECT name, MIN(id) FROM courses GROUP BY name")
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def find_previous_import(file_hash: str) -> Optional[dict]:
+    """
+    Последний импорт файла с таким же sha256, если его результат всё ещё актуален:
+    более поздние импорты не трогали те же курсы и число строк этих курсов не изменилось
+    """
     with get_db() as conn:
-        cursor = conn.cursor()
+        row = conn.execute("""
+            SELECT id, filename, rows, inserted, updated, deleted, course_ids, created_at
+            FROM schedule_imports WHERE file_hash = ?
+            ORDER BY id DESC LIMIT 1
+        """, (file_hash,)).fetchone()
+        if not row:
+            return None
+
+        course_ids = set(json.loads(row[6]))
+        cursor = conn.execute("SELECT course_ids FROM schedule_imports WHERE id > ?", (row[0],))
+        if any(course_ids & set(json.loads(later[0])) for later in cursor.fetchall()):
+            return None
+
+        current_rows = 0
+        ids = list(course_ids)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            current_rows += conn.execute(
+                f"SELECT COUNT(*) FROM schedule WHERE course_id IN ({placeholders})", chunk
+            ).fetchone()[0]
+        if current_rows != row[2]:
+            return None
+
+    return {
+        "id": row[0],
+        "filename": row[1],
+        "rows": row[2],
+        "inserted": row[3],
+        "updated": row[4],
+        "deleted": row[5],
+        "created_at": row[7]
+    }
+
+
+class _CourseRows:
+    """Текущие строки курса: отпечаток → id и (день, пара, предмет) → id ещё не сопоставленных строк"""
+
+    def __init__(self, rows: list):
+        self.by_fingerprint = {}
+        self.by_key = {}
+        for row_id, day_of_week, time_slot, subject, fingerprint in rows:
+            self.by_fingerprint.setdefault(fingerprint, []).append(row_id)
+            self.by_key.setdefault((day_of_week, time_slot, subject), []).append(row_id)
+        self.unmatched = {row_id for row_id, *_ in rows}
 
-        # Проверяем существование
-        cursor.execute("SELECT id FROM courses WHERE name = ?", (course_name,))
-        result = cursor.fetchone()
+    def take_exact(self, fingerprint: str) -> bool:
+        ids = self.by_fingerprint.get(fingerprint)
+        while ids:
+            row_id = ids.pop()
+            if row_id in self.unmatched:
+                self.unmatched.discard(row_id)
+                return True
+        return False
 
-        if result:
-            return result[0]
+    def take_by_key(self, key: tuple) -> Optional[int]:
+        ids = self.by_key.get(key)
+        while ids:
+            row_id = ids.pop()
+            if row_id in self.unmatched:
+                self.unmatched.discard(row_id)
+                return row_id
+        return None
 
-        # Создаём новый
-        cursor.execute("INSERT INTO courses (name) VALUES (?)", (course_name,))
-        return cursor.lastrowid
 
+def save_schedule_entries(entries: Iterable[dict], batch_size: int = SCHEDULE_IMPORT_BATCH_SIZE,
+                          on_batch: Optional[Callable[[int], None]] = None,
+                          file_hash: Optional[str] = None, filename: Optional[str] = None) -> dict:
+    """
+    Инкрементальное сохранение расписания.
+    Для каждого курса из импорта сравниваются отпечатки строк: совпавшие не трогаются,
+    изменившиеся (тот же день, пара и предмет) обновляются, новые вставляются,
+    исчезнувшие из файла удаляются. Курсы, которых нет в импорте, не затрагиваются.
+
+    entries читаются потоком (может быть генератором): в памяти только текущие строки
+    затронутых курсов и не более batch_size ещё не записанных строк файла. Каждая пачка
+    пишется своей короткой транзакцией BEGIN IMMEDIATE, между пачками блокировка записи
+    свободна; on_batch(обработано строк) — после каждой пачки. Удаление исчезнувших строк
+    и запись file_hash в schedule_imports — последней транзакцией, поэтому прерванный
+    импорт не считается выполненным и при повторе доводится до конца.
+    Возвращает статистику импорта.
+    """
+    started = time.perf_counter()
+    rows = 0
+    courses_created = 0
+    unchanged = 0
+    inserted = 0
+    updated = 0
+    deleted = 0
+    existing = {}  # course_name -> _CourseRows
+    # Новые и изменившиеся строки текущей пачки: при повторном импорте их немного
+    pending = []
 
-def save_schedule_entries(entries: List[dict]):
-    """Сохранение записей расписания в БД"""
     with get_db() as conn:
-        cursor = conn.cursor()
+        course_ids = load_course_ids(conn)
+
+        def write_batch(final: bool = False):
+            nonlocal courses_created, inserted, updated, deleted
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for course_name in {course_name for course_name, _, _ in pending}:
+                    if course_name in course_ids:
+                        continue
+                    # Курс мог создать параллельный импорт
+                    row = conn.execute("SELECT MIN(id) FROM courses WHERE name = ?", (course_name,)).fetchone()
+                    if row[0] is None:
+                        course_ids[course_name] = conn.execute(
+                            "INSERT INTO courses (name) VALUES (?)", (course_name,)
+                        ).lastrowid
+                        courses_created += 1
+                    else:
+                        course_ids[course_name] = row[0]
+
+                # Строки курса с тем же днём, парой и предметом — обновление, остальные — вставка
+                inserts = []
+                updates = []
+                for course_name, entry, fingerprint in pending:
+                    row_id = existing[course_name].take_by_key(
+                        (entry['day_of_week'], entry['time_slot'], entry['subject'])
+                    )
+                    if row_id is not None:
+                        updates.append((entry.get('teacher'), entry.get('room'), fingerprint, row_id))
+                    else:
+                        inserts.append((
+                            course_ids[course_name],
+                            entry['day_of_week'],
+                            entry['time_slot'],
+                            entry['subject'],
+                            entry.get('teacher'),
+                            entry.get('room'),
+                            fingerprint
+                        ))
+                if inserts:
+                    conn.executemany(_INSERT_SCHEDULE_SQL, inserts)
+                if updates:
+                    conn.executemany("UPDATE schedule SET teacher = ?, room = ?, fingerprint = ? WHERE id = ?", updates)
+                inserted += len(inserts)
+                updated += len(updates)
+
+                if final:
+                    deletes = [(row_id,) for course_rows in existing.values() for row_id in course_rows.unmatched]
+                    for start in range(0, len(deletes), batch_size):
+                        conn.executemany("DELETE FROM schedule WHERE id = ?", deletes[start:start + batch_size])
+                    deleted = len(deletes)
+
+                    if file_hash:
+                        conn.execute("""
+                            INSERT INTO schedule_imports
+                                (file_hash, filename, rows, inserted, updated, deleted, course_ids)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)
+                        """, (file_hash, filename, rows, inserted, updated, deleted,
+                              json.dumps(sorted(course_ids[name] for name in existing))))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            pending.clear()
 
         for entry in entries:
-            course_id = get_or_create_course(entry['course_name'])
-
-            # Добавляем в schedule
-            cursor.execute("""
-                INSERT INTO schedule (course_id, day_of_week, time_slot, subject, teacher, room)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                course_id,
-                entry['day_of_week'],
-                entry['time_slot'],
-                entry['subject'],
-                entry.get('teacher'),
-                entry.get('room')
-            ))
+            course_name = entry['course_name']
+            course_rows = existing.get(course_name)
+            if course_rows is None:
+                # Чтение без транзакции записи: блокировку держат только пачки
+                course_id = course_ids.get(course_name)
+                current = conn.execute("""
+                    SELECT id, day_of_week, time_slot, subject, fingerprint
+                    FROM schedule WHERE course_id = ?
+                """, (course_id,)).fetchall() if course_id is not None else []
+                course_rows = existing[course_name] = _CourseRows(current)
+
+            fingerprint = entry_fingerprint(
+                course_name, entry['day_of_week'], entry['time_slot'], entry['subject'],
+                entry.get('teacher'), entry.get('room')
+            )
+            if course_rows.take_exact(fingerprint):
+                unchanged += 1
+            else:
+                pending.append((course_name, entry, fingerprint))
+
+            rows += 1
+            if rows % batch_size == 0:
+                if pending:
+                    write_batch()
+                if on_batch:
+                    on_batch(rows)
+
+        write_batch(final=True)
+
+    if on_batch:
+        on_batch(rows)
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "rows": rows,
+        "courses_created": courses_created,
+        "unchanged": unchanged,
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": deleted,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed) if elapsed else rows
+    }
+    logger.info(
+        f"📥 Импорт расписания: {rows} строк (новых {inserted}, изменено {updated}, удалено {deleted}, "
+        f"без изменений {unchanged}), новых курсов {courses_created} "
+        f"за {stats['seconds']} с ({stats['rows_per_second']} строк/с)"
+    )
+    return stats
 
 
 async def upload_schedule(file: UploadFile = File(...)):
-    """Загрузка расписания из Excel файла"""
+    """
+    Загрузка расписания из Excel: файл сохраняется на диск, импорт идёт в фоне.
+    Возвращает задачу; прогресс — get_import_job(job_id)
+    """
     if not file.filename.endswith(('.xlsx', '.xls')):
         raise HTTPException(status_code=400, detail="File must be Excel (.xlsx or .xls)")
 
-    # Сохраняем временный файл
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_file:
-        content = await file.read()
-        temp_file.write(content)
-        temp_path = temp_file.name
+    job = await create_import_job(file)
+    job["status_url"] = f"/api/schedule/upload/{job['id']}"
+    return job
 
-    try:
-        # Парсим расписание
-        entries = parse_excel_schedule(temp_path)
 
-        # Сохраняем в БД
-        save_schedule_entries(entries)
+async def upload_schedule_batch(files: List[UploadFile], all_sheets: bool = True):
+    """
+    Пакетная загрузка: несколько книг (например, по одной на институт), по умолчанию все листы.
+    Листы разбираются параллельно, результат — одна задача с отчётом о конфликтах
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    for file in files:
+        if not file.filename.endswith(('.xlsx', '.xls')):
+            raise HTTPException(status_code=400, detail=f"File must be Excel (.xlsx or .xls): {file.filename}")
 
-        return {
-            "message": "Schedule uploaded successfully",
-            "entries_count": len(entries)
-        }
-    finally:
-        os.unlink(temp_path)
+    job = await create_batch_import_job(files, all_sheets)
+    job["status_url"] = f"/api/schedule/upload/{job['id']}"
+    return job
 
 
 async def get_schedule_by_course(course_name: str):
     """Получение расписания для курса"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Ищем course_id
-        cursor.execute("SELECT id FROM courses WHERE name = ?", (course_name,))
+        cursor = await db.execute("SELECT id FROM courses WHERE name = ?", (course_name,))
         course = cursor.fetchone()
 
         if not course:
@@ -99,7 +304,7 @@ async def get_schedule_by_course(course_name: str):
         course_id = course[0]
 
         # Получаем расписание
-        cursor.execute("""
+        cursor = await db.execute("""
             SELECT id, day_of_week, time_slot, subject, teacher, room
             FROM schedule
             WHERE course_id = ?
@@ -124,9 +329,8 @@ async def get_schedule_by_course(course_name: str):
 
 async def get_all_courses():
     """Получение списка всех курсов"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, name FROM courses ORDER BY name")
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT id, name FROM courses ORDER BY name")
 
         rows = cursor.fetchall()
         return [{"id": row[0], "name": row[1]} for row in rows]
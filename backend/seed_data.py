@@ -132,11 +132,12 @@ def seed_database():
         for course_id, slots in all_slots:
             slot_ids = []
             for title, date_time, location, instructor, max_part, status in slots:
+                date_time_str = date_time.strftime("%Y-%m-%d %H:%M:%S")
                 cursor.execute("""
-                    INSERT INTO class_slots (course_id, title, date_time, location, instructor, max_participants, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (course_id, title, date_time.strftime("%Y-%m-%d %H:%M:%S"), location, instructor, max_part,
-                      status))
+                    INSERT INTO class_slots (course_id, title, date_time, start_at, location, instructor, max_participants,
+                                             status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (course_id, title, date_time_str, date_time_str, location, instructor, max_part, status))
                 slot_ids.append(cursor.lastrowid)
                 total_slots += 1
             slot_ids_by_course[course_id] = slot_ids
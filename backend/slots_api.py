@@ -1,5 +1,7 @@
 from fastapi import HTTPException
-from database import get_db
+from database import get_db_async
+from response_cache import invalidate_on_commit
+from pagination import decode_cursor, page_limit, split_page
 from models import ClassSlotCreate, ClassSlotUpdate, ClassSlotResponse
 from typing import Optional
 import logging
@@ -9,22 +11,22 @@ logger = logging.getLogger(__name__)
 
 async def create_class_slot(data: ClassSlotCreate) -> dict:
     """Создание нового слота (занятия)"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Проверяем существование курса
-        cursor.execute("SELECT id FROM courses WHERE id = ?", (data.course_id,))
+        cursor = await db.execute("SELECT id FROM courses WHERE id = ?", (data.course_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Курс с ID {data.course_id} не найден")
 
         # Создаём слот
-        cursor.execute("""
-            INSERT INTO class_slots (course_id, title, date_time, location, instructor, max_participants, status)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
+        cursor = await db.execute("""
+            INSERT INTO class_slots (course_id, title, date_time, start_at, location, instructor, max_participants, status)
+            VALUES (?, ?, ?, COALESCE(datetime(?), ?), ?, ?, ?, ?)
         """, (
             data.course_id,
             data.title,
             data.date_time,
+            data.date_time,
+            data.date_time,
             data.location,
             data.instructor,
             data.max_participants,
@@ -32,6 +34,7 @@ async def create_class_slot(data: ClassSlotCreate) -> dict:
         ))
 
         slot_id = cursor.lastrowid
+        invalidate_on_commit(db, "schedule")
 
         logger.info(f"✅ Создан слот ID={slot_id}: {data.title}")
 
@@ -47,11 +50,71 @@ async def create_class_slot(data: ClassSlotCreate) -> dict:
         }
 
 
+async def get_class_slots_page(
+        date: Optional[str] = None,
+        date_from: Optional[str] = None,
+        date_to: Optional[str] = None,
+        limit: int = 100,
+        offset: int = 0,
+        cursor: Optional[str] = None
+) -> dict:
+    """
+    Список занятий для расписания/календаря.
+    Постраничный вывод по ключу (start_at, id): возвращает {"items": [...], "next_cursor": ...}
+    """
+    limit = page_limit(limit)
+    async with get_db_async() as db:
+        query = """
+            SELECT id, title, date_time, location, instructor, status, start_at
+            FROM class_slots
+            WHERE 1=1
+        """
+        params = []
+
+        # Диапазонные условия по start_at используют индекс idx_class_slots_start_at
+        if date_from or date_to:
+            if date_from:
+                query += " AND start_at >= ?"
+                params.append(date_from)
+            if date_to:
+                query += " AND start_at < date(?, '+1 day')"
+                params.append(date_to)
+        elif date:
+            query += " AND start_at >= ? AND start_at < date(?, '+1 day')"
+            params.extend([date, date])
+
+        if cursor:
+            after_start_at, after_id = decode_cursor(cursor, 2)
+            query += " AND (start_at, id) < (?, ?)"
+            params.extend([after_start_at, after_id])
+            offset = 0
+
+        query += " ORDER BY start_at DESC, id DESC LIMIT ? OFFSET ?"
+        params.extend([limit + 1, offset])
+
+        result = await db.execute(query, params)
+        rows, next_cursor = split_page(result.fetchall(), limit, key=lambda r: (r[6], r[0]))
+
+        return {
+            "items": [
+                {
+                    "id": r[0],
+                    "title": r[1] or "Без названия",
+                    "date_time": str(r[2]),
+                    "room": r[3],
+                    "teacher": r[4],
+                    "status": r[5]
+                }
+                for r in rows
+            ],
+            "next_cursor": next_cursor
+        }
+
+
 async def get_class_slot(slot_id: int) -> dict:
     """Получение слота по ID"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("""
+    async with get_db_async() as db:
+        cursor = await db.execute("""
             SELECT id, course_id, title, date_time, location, instructor, max_participants, status
             FROM class_slots
             WHERE id = ?
@@ -75,11 +138,9 @@ async def get_class_slot(slot_id: int) -> dict:
 
 async def update_class_slot(slot_id: int, data: ClassSlotUpdate) -> dict:
     """Обновление слота"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Проверяем существование слота
-        cursor.execute("SELECT id FROM class_slots WHERE id = ?", (slot_id,))
+        cursor = await db.execute("SELECT id FROM class_slots WHERE id = ?", (slot_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Слот с ID {slot_id} не найден")
 
@@ -94,6 +155,9 @@ async def update_class_slot(slot_id: int, data: ClassSlotUpdate) -> dict:
         if data.date_time is not None:
             updates.append("date_time = ?")
             params.append(data.date_time)
+            # Держим нормализованное время начала в синхроне с date_time
+            updates.append("start_at = COALESCE(datetime(?), ?)")
+            params.extend([data.date_time, data.date_time])
 
         if data.location is not None:
             updates.append("location = ?")
@@ -117,7 +181,8 @@ async def update_class_slot(slot_id: int, data: ClassSlotUpdate) -> dict:
         # Выполняем обновление
         params.append(slot_id)
         query = f"UPDATE class_slots SET {', '.join(updates)} WHERE id = ?"
-        cursor.execute(query, params)
+        await db.execute(query, params)
+        invalidate_on_commit(db, "schedule", f"slot:{slot_id}")
 
         logger.info(f"✅ Обновлён слот ID={slot_id}")
 
@@ -127,16 +192,15 @@ async def update_class_slot(slot_id: int, data: ClassSlotUpdate) -> dict:
 
 async def delete_class_slot(slot_id: int) -> dict:
     """Удаление слота"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-
+    async with get_db_async() as db:
         # Проверяем существование слота
-        cursor.execute("SELECT id FROM class_slots WHERE id = ?", (slot_id,))
+        cursor = await db.execute("SELECT id FROM class_slots WHERE id = ?", (slot_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Слот с ID {slot_id} не найден")
 
         # Удаляем слот (каскадно удалятся все связанные участники)
-        cursor.execute("DELETE FROM class_slots WHERE id = ?", (slot_id,))
+        await db.execute("DELETE FROM class_slots WHERE id = ?", (slot_id,))
+        invalidate_on_commit(db, "schedule", f"slot:{slot_id}")
 
         logger.info(f"🗑️  Удалён слот ID={slot_id}")
 
@@ -153,14 +217,13 @@ async def update_class_slot_status(slot_id: int, new_status: str) -> dict:
             detail=f"Недопустимый статус. Допустимые значения: {', '.join(valid_statuses)}"
         )
 
-    with get_db() as conn:
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT id FROM class_slots WHERE id = ?", (slot_id,))
+    async with get_db_async() as db:
+        cursor = await db.execute("SELECT id FROM class_slots WHERE id = ?", (slot_id,))
         if not cursor.fetchone():
             raise HTTPException(status_code=404, detail=f"Слот с ID {slot_id} не найден")
 
-        cursor.execute("UPDATE class_slots SET status = ? WHERE id = ?", (new_status, slot_id))
+        await db.execute("UPDATE class_slots SET status = ? WHERE id = ?", (new_status, slot_id))
+        invalidate_on_commit(db, "schedule", f"slot:{slot_id}")
 
         logger.info(f"✅ Статус слота ID={slot_id} изменён на {new_status}")
 
@@ -0,0 +1,56 @@
+"""
+Общие фикстуры тестов: временная БД со всеми миграциями и очистка таблиц между тестами.
+Переменные окружения задаются до импорта модулей backend: пул БД создаётся при импорте,
+а .env не должен подставить настоящие токены Telegram и SMTP.
+"""
+
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_tmp_dir = tempfile.mkdtemp(prefix="schedule-tests-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp_dir, "test.db")
+os.environ["TELEGRAM_BOT_TOKEN"] = ""
+os.environ["TELEGRAM_API_BASE_URL"] = "http://127.0.0.1:9/bot"
+os.environ["SMTP_USER"] = ""
+os.environ["SMTP_PASSWORD"] = ""
+
+import pytest
+from database import get_db, init_db
+
+# Порядок важен: сначала зависимые таблицы
+_TABLES = ("outbox", "digest_events", "participants", "class_slots", "schedule", "schedule_imports",
+           "courses", "users")
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    init_db()
+    yield os.environ["DATABASE_PATH"]
+
+
+@pytest.fixture(autouse=True)
+def clean_tables(database):
+    yield
+    with get_db() as conn:
+        for table in _TABLES:
+            conn.execute(f"DELETE FROM {table}")
+
+
+
+@pytest.fixture
+def make_user():
+    """Пользователь с Telegram чатом chat_id; fields — дополнительные колонки users. Возвращает id"""
+    def make(chat_id, **fields):
+        with get_db() as conn:
+            user_id = conn.execute(
+                "INSERT INTO users (email, password_hash, full_name, telegram_id) VALUES (?, '-', ?, ?)",
+                (f"user{chat_id}@test.ru", f"Пользователь {chat_id}", str(chat_id))
+            ).lastrowid
+            for column, value in fields.items():
+                conn.execute(f"UPDATE users SET {column} = ? WHERE id = ?", (value, user_id))
+        return user_id
+    return make
@@ -0,0 +1,62 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+from auth import TokenCache, create_access_token
+from participants_api import delete_participant
+
+
+def user(user_id):
+    return {"id": user_id, "email": f"user{user_id}@test.ru", "full_name": f"Пользователь {user_id}"}
+
+
+def test_lru_eviction_and_per_user_invalidation():
+    cache = TokenCache(max_size=2, ttl=60)
+    cache.put("a", user(1))
+    cache.put("b", user(1))
+    assert cache.get("a") == user(1)
+    cache.put("c", user(2))
+
+    # Вытеснен давно не использованный «b»
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    cache.invalidate_user(1)
+    assert cache.get("a") is None
+    assert cache.get("c") == user(2)
+
+
+def test_entry_does_not_outlive_the_token():
+    cache = TokenCache(ttl=60)
+    cache.put("expired", user(1), token_exp=time.time() - 1)
+    assert cache.get("expired") is None
+
+    cache.put("short", user(1), token_exp=time.time() + 0.05)
+    assert cache.get("short") == user(1)
+    time.sleep(0.06)
+    assert cache.get("short") is None
+
+
+def test_cached_user_is_a_copy():
+    cache = TokenCache()
+    cache.put("a", user(1))
+    cache.get("a")["full_name"] = "Изменено"
+    assert cache.get("a") == user(1)
+
+
+async def test_deleted_user_loses_access_immediately(make_user):
+    from main import get_current_user
+
+    auth._token_cache.clear()
+    user_id = make_user(701)
+    token = create_access_token({"user_id": user_id})
+
+    assert (await get_current_user(authorization=None, access_token=token))["id"] == user_id
+    assert auth._token_cache.get(token) is not None
+
+    await delete_participant(user_id)
+    with pytest.raises(HTTPException) as error:
+        await get_current_user(authorization=None, access_token=token)
+    assert error.value.status_code == 401
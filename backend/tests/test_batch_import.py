@@ -0,0 +1,70 @@
+import openpyxl
+
+from database import get_db
+from import_jobs import _register_job, _run_batch_job, get_import_job, merge_units, shutdown_import_jobs
+
+
+def entry(subject, course="606-51", day=1, time_slot="08:30-10:00", teacher="Иванов", room="101"):
+    return {"course_name": course, "day_of_week": day, "time_slot": time_slot, "subject": subject,
+            "teacher": teacher, "room": room}
+
+
+AUTUMN = {"file": "a.xlsx", "sheet": "Осень"}
+SPRING = {"file": "b.xlsx", "sheet": "Весна"}
+
+
+def test_exact_duplicates_are_dropped_in_order():
+    entries, duplicates, conflicts = merge_units([
+        (AUTUMN, [entry("Математика"), entry("Физика", day=2)]),
+        (SPRING, [entry("Математика"), entry("Химия", day=3)]),
+    ])
+    assert [e["subject"] for e in entries] == ["Математика", "Физика", "Химия"]
+    assert (duplicates, conflicts) == (1, [])
+
+
+def test_conflicts_are_reported_but_rows_are_kept():
+    entries, duplicates, conflicts = merge_units([
+        (AUTUMN, [entry("Математика")]),
+        (SPRING, [entry("Физика"), entry("Химия", course="603-51м")]),
+    ])
+    assert len(entries) == 3 and duplicates == 0
+    assert [(c["type"], c["first"]["sheet"], c["second"]["subject"]) for c in conflicts] == [
+        ("course", "Осень", "Физика"),
+        ("room", "Осень", "Химия"),
+    ]
+
+
+def write_workbook(path, sheets: dict):
+    workbook = openpyxl.Workbook()
+    workbook.remove(workbook.active)
+    for title, rows in sheets.items():
+        sheet = workbook.create_sheet(title)
+        for row in rows:
+            sheet.append(row)
+    workbook.save(path)
+    return str(path)
+
+
+async def test_batch_job_merges_all_sheets_of_all_files(tmp_path):
+    first = write_workbook(tmp_path / "a.xlsx", {
+        "Осень": [("606-51",), ("ПН",), (1, "Математика", "Иванов", "101")],
+        "Весна": [("606-51",), ("ВТ",), (2, "Физика", "Петров", "102")],
+    })
+    second = write_workbook(tmp_path / "b.xlsx", {
+        "Лист": [("606-51",), ("ПН",), (1, "Математика", "Иванов", "101"), ("603-51м",), ("СР",),
+                 (3, "Химия", None, "210")],
+    })
+
+    job = _register_job(kind="batch", filename="a.xlsx, b.xlsx")
+    try:
+        await _run_batch_job(job["id"], [("a.xlsx", first), ("b.xlsx", second)], True, "batch-hash")
+    finally:
+        await shutdown_import_jobs()
+
+    job = get_import_job(job["id"])
+    assert job["status"] == "done", job["error"]
+    assert (job["units_total"], job["rows_parsed"], job["duplicates"], job["conflicts_total"]) == (3, 4, 1, 0)
+    with get_db() as conn:
+        assert sorted(row[0] for row in conn.execute("SELECT subject FROM schedule")) == ["Математика", "Физика", "Химия"]
+    # Загруженные файлы удаляются после импорта
+    assert not (tmp_path / "a.xlsx").exists() and not (tmp_path / "b.xlsx").exists()
@@ -0,0 +1,77 @@
+from changes_api import compact_change_log, get_changes
+from database import get_db
+
+
+async def current_seq() -> int:
+    return (await get_changes(10 ** 9))["last_seq"]
+
+
+def add_slot(title: str) -> int:
+    with get_db() as conn:
+        course_id = conn.execute("INSERT INTO courses (name) VALUES (?)", (title,)).lastrowid
+        return conn.execute(
+            "INSERT INTO class_slots (course_id, title, date_time) VALUES (?, ?, '2030-03-01 10:00')",
+            (course_id, title)
+        ).lastrowid
+
+
+async def test_changes_collapse_to_the_latest_state():
+    since = await current_seq()
+    slot_id = add_slot("Лекция")
+    with get_db() as conn:
+        conn.execute("UPDATE class_slots SET location = '101' WHERE id = ?", (slot_id,))
+        conn.execute("UPDATE class_slots SET location = '202' WHERE id = ?", (slot_id,))
+
+    result = await get_changes(since)
+    slots = [change for change in result["changes"] if change["entity"] == "slot"]
+    assert len(slots) == 1
+    assert slots[0]["data"]["location"] == "202"
+    assert [change["entity"] for change in result["changes"]] == ["course", "slot"]
+    assert result["full_resync"] is False and result["has_more"] is False
+
+
+async def test_deleted_row_is_reported_as_delete():
+    since = await current_seq()
+    slot_id = add_slot("Семинар")
+    with get_db() as conn:
+        conn.execute("DELETE FROM class_slots WHERE id = ?", (slot_id,))
+
+    changes = (await get_changes(since))["changes"]
+    assert [(change["entity"], change["op"], change["data"]) for change in changes if change["entity"] == "slot"] == \
+        [("slot", "delete", None)]
+
+
+async def test_paging_continues_from_last_seq():
+    since = await current_seq()
+    for i in range(3):
+        add_slot(f"Занятие {i}")
+
+    seen = []
+    while True:
+        page = await get_changes(since, limit=2)
+        seen += [(change["entity"], change["id"]) for change in page["changes"]]
+        since = page["last_seq"]
+        if not page["has_more"]:
+            break
+    assert len(seen) == len(set(seen)) == 6
+
+
+async def test_compaction_forces_full_resync_for_old_cursors():
+    since = await current_seq()
+    add_slot("Старое")
+    with get_db() as conn:
+        conn.execute("UPDATE change_log SET changed_at = datetime('now', '-30 days') WHERE seq > ?", (since,))
+    add_slot("Новое")
+
+    assert await compact_change_log(retention_days=7) >= 2
+
+    # Курсор до границы компактизации — полная пересинхронизация
+    assert (await get_changes(since))["full_resync"] is True
+    with get_db() as conn:
+        compacted = conn.execute("SELECT value FROM sync_state WHERE key = 'compacted_through'").fetchone()[0]
+    result = await get_changes(compacted)
+    assert result["full_resync"] is False
+    assert {change["data"]["name"] for change in result["changes"] if change["entity"] == "course"} == {"Новое"}
+
+    # Курсор из будущего (например, после восстановления БД) — тоже пересинхронизация
+    assert (await get_changes(result["last_seq"] + 100))["full_resync"] is True
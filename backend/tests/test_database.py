@@ -0,0 +1,81 @@
+import os
+import threading
+
+import pytest
+
+from database import ConnectionPool, get_db, get_db_async
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(os.path.join(tmp_path, "pool.db"), size=2, timeout=0.2)
+    yield pool
+    pool.close_all()
+
+
+def test_pool_reuses_configured_connections(pool):
+    conn = pool.acquire()
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    pool.release(conn)
+
+    assert pool.acquire() is conn
+    stats = pool.stats()
+    assert stats["created"] == 1 and stats["checkouts"] == 2 and stats["in_use"] == 1
+
+
+def test_pool_is_bounded(pool):
+    first, second = pool.acquire(), pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    assert pool.stats()["timeouts"] == 1
+
+    # Освобождённое подключение достаётся ожидающему
+    threading.Timer(0.05, pool.release, (first,)).start()
+    assert pool.acquire() is first
+    assert pool.stats()["waits"] == 1
+    pool.release(first)
+    pool.release(second)
+
+
+def test_broken_connection_is_not_reused(pool):
+    conn = pool.acquire()
+    pool.release(conn, broken=True)
+    assert pool.stats()["created"] == 0
+    assert pool.acquire() is not conn
+
+
+def count_users() -> int:
+    with get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+
+def test_nested_get_db_shares_the_outer_transaction():
+    with pytest.raises(RuntimeError):
+        with get_db() as outer:
+            with get_db() as inner:
+                assert inner is outer
+                inner.execute("INSERT INTO users (email, password_hash, full_name) VALUES ('a@test.ru', '-', 'A')")
+            # Вложенный блок не коммитит: откат внешнего отменяет и его запись
+            raise RuntimeError()
+    assert count_users() == 0
+
+    with get_db() as outer:
+        with get_db() as inner:
+            inner.execute("INSERT INTO users (email, password_hash, full_name) VALUES ('b@test.ru', '-', 'B')")
+    assert count_users() == 1
+
+
+async def test_nested_async_and_sync_access_share_one_connection():
+    def insert(conn):
+        with get_db() as nested:
+            assert nested is conn
+            nested.execute("INSERT INTO users (email, password_hash, full_name) VALUES ('c@test.ru', '-', 'C')")
+
+    with pytest.raises(RuntimeError):
+        async with get_db_async() as db:
+            async with get_db_async() as inner:
+                assert inner is db
+                await inner.run(insert)
+            raise RuntimeError()
+    assert count_users() == 0
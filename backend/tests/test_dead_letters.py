@@ -0,0 +1,102 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from auth import is_admin
+from database import get_db
+import outbox
+from outbox import OUTBOX_MAX_ATTEMPTS, claim_batch, complete_batch, list_dead_letters, retry_dead_letters
+
+
+def insert_row(chat_id, user_id=None, status="queued", attempts=0):
+    with get_db() as conn:
+        return conn.execute("""
+            INSERT INTO outbox (event_type, user_id, chat_id, shard_key, payload, status, attempts, available_at)
+            VALUES ('new', ?, ?, ?, '{}', ?, ?, 0)
+        """, (user_id, str(chat_id), outbox.shard_key(chat_id), status, attempts)).lastrowid
+
+
+def statuses() -> dict:
+    with get_db() as conn:
+        return {row[0]: row[1] for row in conn.execute("SELECT id, status FROM outbox")}
+
+
+async def test_permanent_and_exhausted_failures_become_dead(make_user):
+    transient = insert_row(1)
+    permanent = insert_row(2)
+    exhausted = insert_row(3, attempts=OUTBOX_MAX_ATTEMPTS - 1)
+    user_id = make_user(4)
+    blocked = insert_row(4, user_id=user_id)
+
+    batch = await claim_batch("w1", 10)
+    attempts = {row["id"]: row["attempts"] for row in batch}
+    await complete_batch("w1", [], [
+        (transient, attempts[transient], "Timed out", False),
+        (permanent, attempts[permanent], "Bad Request: message is too long", True),
+        (exhausted, attempts[exhausted], "Timed out", False),
+        (blocked, attempts[blocked], "Forbidden: bot was blocked by the user", True),
+    ], invalid_chats=[(user_id, "4", "Forbidden: bot was blocked by the user")])
+
+    assert statuses() == {transient: "failed", permanent: "dead", exhausted: "dead", blocked: "dead"}
+    with get_db() as conn:
+        assert conn.execute("SELECT telegram_error FROM users WHERE id = ?", (user_id,)).fetchone()[0] \
+            == "Forbidden: bot was blocked by the user"
+
+
+async def test_list_dead_letters_pages_newest_first(make_user):
+    ids = [insert_row(chat_id, status="dead") for chat_id in range(1, 6)]
+    insert_row(99, status="sent")
+
+    page = await list_dead_letters(limit=3)
+    assert [item["id"] for item in page["items"]] == ids[:1:-1]
+    page = await list_dead_letters(limit=3, cursor=page["next_cursor"])
+    assert [item["id"] for item in page["items"]] == ids[1::-1]
+    assert page["next_cursor"] is None
+
+
+async def test_retry_skips_invalid_chats(make_user):
+    user_id = make_user(7, telegram_invalid_at="2025-01-01 00:00:00")
+    blocked = insert_row(7, user_id=user_id, status="dead", attempts=5)
+    other = insert_row(8, status="dead", attempts=5)
+    chosen = insert_row(9, status="dead", attempts=5)
+
+    assert await retry_dead_letters([chosen]) == 1
+    assert statuses() == {blocked: "dead", other: "dead", chosen: "queued"}
+
+    assert await retry_dead_letters() == 1
+    assert statuses()[other] == "queued"
+    with get_db() as conn:
+        assert conn.execute("SELECT MAX(attempts) FROM outbox WHERE status = 'queued'").fetchone()[0] == 0
+
+    # Пользователь переподписался новым чатом: старый chat_id больше не помечен недоступным
+    with get_db() as conn:
+        conn.execute("UPDATE users SET telegram_id = '70', telegram_invalid_at = NULL WHERE id = ?", (user_id,))
+    assert await retry_dead_letters() == 1
+
+
+async def test_expired_lease_returns_row_or_kills_it():
+    retried = insert_row(1)
+    doomed = insert_row(2, attempts=OUTBOX_MAX_ATTEMPTS - 1)
+    await claim_batch("crashed", 10)
+    with get_db() as conn:
+        conn.execute("UPDATE outbox SET lease_until = ?", (time.time() - 1,))
+
+    assert await outbox.release_expired_leases() == 2
+    assert statuses() == {retried: "failed", doomed: "dead"}
+
+
+@pytest.mark.parametrize("email, allowed", [("admin@test.ru", True), ("ADMIN@test.ru", True), ("user@test.ru", False)])
+def test_admin_emails(monkeypatch, email, allowed):
+    monkeypatch.setattr("auth.ADMIN_EMAILS", {"admin@test.ru"})
+    assert is_admin({"id": 1, "email": email}) is allowed
+
+
+async def test_dead_letter_endpoints_require_admin(monkeypatch):
+    from main import get_admin_user
+
+    monkeypatch.setattr("auth.ADMIN_EMAILS", {"admin@test.ru"})
+    assert (await get_admin_user({"id": 1, "email": "admin@test.ru"}))["id"] == 1
+    with pytest.raises(HTTPException) as error:
+        await get_admin_user({"id": 2, "email": "user@test.ru"})
+    assert error.value.status_code == 403
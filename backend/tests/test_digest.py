@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from database import get_db, get_db_async
+from digest import flush_digests
+from outbox import enqueue_notifications
+
+SLOT = {"course_name": "Математика", "start_time": "2030-03-01 10:00", "end_time": "2030-03-01 11:30",
+        "location": "101", "status": "scheduled"}
+
+
+async def record_event(user_id, chat_id):
+    async with get_db_async() as db:
+        await enqueue_notifications(db, "new", 1, [{"id": user_id, "telegram_chat_id": chat_id}], SLOT)
+
+
+def pending() -> tuple:
+    with get_db() as conn:
+        events = conn.execute("SELECT COUNT(*) FROM digest_events").fetchone()[0]
+        digests = conn.execute("SELECT COUNT(*) FROM outbox WHERE event_type = 'digest'").fetchone()[0]
+    return events, digests
+
+
+async def test_flush_sends_one_digest_per_user(make_user):
+    daily = make_user(601, notification_mode="daily")
+    weekly = make_user(602, notification_mode="weekly")
+    await record_event(daily, "601")
+    await record_event(weekly, "602")
+
+    assert await flush_digests("daily") == 1
+    assert pending() == (1, 1)
+    with get_db() as conn:
+        assert "Математика" in json.loads(conn.execute("SELECT payload FROM outbox").fetchone()[0])["text"]
+
+
+async def test_mode_change_flushes_events_of_the_old_mode(make_user):
+    from main import set_notification_mode
+
+    user_id = make_user(603, notification_mode="weekly")
+    await record_event(user_id, "603")
+    assert pending() == (1, 0)
+
+    await set_notification_mode("instant", u={"id": user_id})
+    assert pending() == (0, 1)
+    # Теперь события уходят сразу, мимо сводки
+    await record_event(user_id, "603")
+    assert pending() == (0, 1)
+    with get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM outbox WHERE event_type = 'new'").fetchone()[0] == 1
+
+
+async def test_concurrent_flushes_send_each_digest_once(make_user):
+    # Планировщик сводок запущен в каждом процессе API и срабатывает в один и тот же час
+    users = [make_user(610 + i, notification_mode="daily") for i in range(5)]
+    for i, user_id in enumerate(users):
+        await record_event(user_id, str(610 + i))
+
+    results = await asyncio.gather(flush_digests("daily"), flush_digests("daily"))
+
+    assert sum(results) == len(users)
+    assert pending() == (0, len(users))
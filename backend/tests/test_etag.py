@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from database import get_db
+from response_cache import etag_matches, make_etag, response_cache
+from schedule_api import save_schedule_entries
+
+
+@pytest.fixture
+def client():
+    from main import app
+
+    response_cache.clear()
+    return TestClient(app)
+
+
+def test_etag_depends_on_versions_and_key():
+    etag = make_etag("/api/courses?", {"courses": 3})
+    assert etag != make_etag("/api/courses?", {"courses": 4})
+    assert etag != make_etag("/api/courses?limit=5", {"courses": 3})
+
+
+def test_if_none_match_forms():
+    assert etag_matches('"a", W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches(None, '"b"')
+    assert not etag_matches('"a"', '"b"')
+
+
+def test_unchanged_list_is_304(client):
+    first = client.get("/api/courses")
+    etag = first.headers["etag"]
+
+    second = client.get("/api/courses", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["etag"] == etag
+
+
+def test_write_without_cache_invalidation_never_pairs_new_etag_with_old_body(client):
+    first = client.get("/api/courses")
+    assert first.json() == []
+
+    # Импорт пишет в БД из дочернего процесса и сбрасывает кэш API позже
+    save_schedule_entries([{"course_name": "ИВТ-101", "day_of_week": 1, "time_slot": "08:30-10:00",
+                            "subject": "Математика", "teacher": None, "room": None}])
+
+    second = client.get("/api/courses", headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert [course["name"] for course in second.json()] == ["ИВТ-101"]
+
+    third = client.get("/api/courses", headers={"If-None-Match": second.headers["etag"]})
+    assert third.status_code == 304
+
+
+def test_other_process_user_insert_refreshes_participants(client):
+    with get_db() as conn:
+        conn.execute("INSERT INTO users (email, password_hash, full_name) VALUES ('a@test.ru', '-', 'А')")
+        course_id = conn.execute("INSERT INTO courses (name) VALUES ('Курс')").lastrowid
+    url = f"/api/courses/{course_id}/participants"
+    first = client.get(url)
+
+    with get_db() as conn:
+        conn.execute("INSERT INTO users (email, password_hash, full_name) VALUES ('b@test.ru', '-', 'Б')")
+
+    second = client.get(url, headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert len(second.json()) == len(first.json()) + 1
@@ -0,0 +1,81 @@
+import pytest
+from fastapi import HTTPException
+
+from events import broker, event_stream
+from main import schedule_events
+
+
+class FakeRequest:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+@pytest.fixture
+def small_broker():
+    saved = broker.max_subscribers, broker.queue_size
+    broker.max_subscribers, broker.queue_size = 2, 3
+    yield broker
+    broker.max_subscribers, broker.queue_size = saved
+    broker._subscribers.clear()
+
+
+async def test_response_that_never_starts_holds_no_subscriber(small_broker):
+    # Клиент отключился до первой итерации: генератор ответа так и не запустился
+    for _ in range(5):
+        await schedule_events(FakeRequest())
+    assert small_broker.stats()["subscribers"] == 0
+
+
+async def test_slow_client_gets_overflow_and_is_released(small_broker):
+    stream = event_stream(FakeRequest())
+    assert await stream.__anext__() == "retry: 5000\n\n"
+    small_broker.publish("slot_deleted", {"id": 1})
+    assert small_broker.stats()["subscribers"] == 1
+
+    for slot_id in range(2, 6):
+        small_broker.publish("slot_deleted", {"id": slot_id})
+    assert small_broker.stats()["subscribers"] == 0
+    assert small_broker.dropped_subscribers >= 1
+
+    # Отключённый подписчик сразу получает overflow и поток завершается
+    chunks = [chunk async for chunk in stream]
+    assert len(chunks) == 1 and chunks[0].startswith("event: overflow")
+
+
+async def test_disconnect_releases_subscriber(small_broker):
+    request = FakeRequest()
+    stream = event_stream(request)
+    await stream.__anext__()
+    assert small_broker.stats()["subscribers"] == 1
+
+    await stream.aclose()
+    assert small_broker.stats()["subscribers"] == 0
+
+
+async def test_full_broker_rejects_with_503(small_broker):
+    streams = [event_stream(FakeRequest()) for _ in range(2)]
+    for stream in streams:
+        await stream.__anext__()
+
+    with pytest.raises(HTTPException) as error:
+        await schedule_events(FakeRequest())
+    assert error.value.status_code == 503
+    assert small_broker.stats()["subscribers"] == 2
+    for stream in streams:
+        await stream.aclose()
+
+
+async def test_stream_started_after_broker_filled_up(small_broker):
+    # Проверка в обработчике прошла, но места заняли до первой итерации генератора
+    streams = [event_stream(FakeRequest()) for _ in range(3)]
+    await streams[0].__anext__()
+    await streams[1].__anext__()
+
+    chunks = [chunk async for chunk in streams[2]]
+    assert "event: overflow" in chunks[0]
+    assert small_broker.stats()["subscribers"] == 2
+    for stream in streams[:2]:
+        await stream.aclose()
@@ -0,0 +1,16 @@
+from import_jobs import _register_job, _update_job, get_import_job
+
+
+def test_progress_after_finish_does_not_change_the_job():
+    job = _register_job(kind="single", filename="schedule.xlsx")
+    _update_job(job["id"], status="running", rows_parsed=10)
+    _update_job(job["id"], row_error={"row": 3, "error": "пустой предмет"})
+    _update_job(job["id"], final=True, status="done", rows_saved=10)
+
+    # Сообщения из очереди прогресса, пришедшие после итога
+    _update_job(job["id"], rows_parsed=12)
+    _update_job(job["id"], row_error={"row": 7, "error": "пустой предмет"})
+
+    job = get_import_job(job["id"])
+    assert (job["status"], job["rows_parsed"], job["errors_total"]) == ("done", 10, 1)
+    assert job["errors"] == [{"row": 3, "error": "пустой предмет"}]
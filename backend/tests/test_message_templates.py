@@ -0,0 +1,57 @@
+from message_templates import MessageCache, payload_version, render_digest, split_message
+
+SLOT = {"course_name": "Математика", "start_time": "2030-03-01 10:00", "end_time": "2030-03-01 11:30",
+        "location": "101", "status": "scheduled"}
+
+
+def test_one_render_per_slot_version_type_and_locale():
+    cache = MessageCache()
+    first = cache.render(SLOT, "new", "ru", slot_id=1)
+    for _ in range(10):
+        assert cache.render(dict(SLOT), "new", "ru", slot_id=1) == first
+    assert (cache.hits, cache.misses) == (10, 1)
+
+    # Каждая часть ключа даёт отдельное сообщение
+    assert cache.render(SLOT, "reminder", "ru", slot_id=1) != first
+    assert cache.render(SLOT, "new", "en", slot_id=1) != first
+    assert "202" in cache.render({**SLOT, "location": "202"}, "new", "ru", slot_id=1)
+    assert cache.misses == 4
+
+
+def test_slots_with_equal_payloads_share_text_but_not_entries():
+    cache = MessageCache()
+    assert cache.render(SLOT, "new", slot_id=1) == cache.render(SLOT, "new", slot_id=2)
+    assert cache.stats()["size"] == 2
+
+
+def test_unknown_locale_falls_back_to_default():
+    cache = MessageCache()
+    assert cache.render(SLOT, "new", "xx", slot_id=1) == cache.render(SLOT, "new", "ru", slot_id=1)
+    assert cache.stats()["size"] == 1
+
+
+def test_explicit_version_and_lru_limit():
+    cache = MessageCache(max_size=2)
+    version = payload_version(SLOT)
+    assert version == payload_version(dict(reversed(list(SLOT.items()))))
+    cache.render(SLOT, "new", slot_id=1, version=version)
+    cache.render(SLOT, "new", slot_id=1)
+    assert cache.hits == 1
+
+    cache.render(SLOT, "new", slot_id=2)
+    cache.render(SLOT, "new", slot_id=3)
+    assert cache.stats()["size"] == 2
+
+
+def test_values_are_escaped_for_html():
+    message = MessageCache().render({**SLOT, "course_name": "<b>C++ & Python</b>"}, "new")
+    assert "&lt;b&gt;C++ &amp; Python&lt;/b&gt;" in message
+
+
+def test_long_digest_is_split_by_lines():
+    events = [("new", {**SLOT, "course_name": f"Курс {i}"}) for i in range(300)]
+    parts = render_digest(events)
+    assert len(parts) > 1
+    assert all(len(part) <= 4000 for part in parts)
+    assert sum(part.count("Курс ") for part in parts) == 300
+    assert split_message("а" * 9000, limit=4000) == ["а" * 4000, "а" * 4000, "а" * 1000]
@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import migrations
+from migrations import backfill_in_batches, get_schema_version, latest_version, run_migrations
+
+
+def connect(path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), timeout=5)
+    conn.execute("PRAGMA busy_timeout = 5000")
+    return conn
+
+
+def lock_rows(path) -> list:
+    with connect(path) as conn:
+        return conn.execute("SELECT version, owner FROM migration_lock").fetchall()
+
+
+def test_fresh_database_gets_every_step_once(tmp_path):
+    conn = connect(tmp_path / "fresh.db")
+    applied = run_migrations(conn)
+
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert get_schema_version(conn) == latest_version()
+    assert run_migrations(conn) == []
+    assert lock_rows(tmp_path / "fresh.db") == []
+
+
+def test_legacy_slots_get_start_at(tmp_path):
+    conn = connect(tmp_path / "legacy.db")
+    conn.execute("""
+        CREATE TABLE class_slots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, course_id INTEGER, title TEXT NOT NULL,
+            date_time TEXT NOT NULL, location TEXT, instructor TEXT, max_participants INTEGER,
+            status TEXT DEFAULT 'scheduled', created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.execute("INSERT INTO class_slots (title, date_time) VALUES ('Лекция', '2025-03-01T10:00')")
+    conn.commit()
+
+    run_migrations(conn)
+    assert conn.execute("SELECT start_at FROM class_slots").fetchone()[0] == "2025-03-01 10:00:00"
+
+
+@pytest.fixture
+def extra_step(monkeypatch):
+    """Дополнительный шаг latest + 1 поверх настоящих миграций"""
+    def add(func):
+        version = latest_version() + 1
+        monkeypatch.setattr(migrations, "MIGRATIONS", [*migrations.MIGRATIONS, (version, "test step", func)])
+        return version
+    return add
+
+
+def test_failed_step_is_rolled_back_and_unlocked(tmp_path, extra_step):
+    conn = connect(tmp_path / "failed.db")
+    run_migrations(conn)
+    previous = get_schema_version(conn)
+
+    def broken(conn):
+        conn.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    extra_step(broken)
+    with pytest.raises(RuntimeError):
+        run_migrations(conn)
+
+    assert get_schema_version(conn) == previous
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'half_done'").fetchone() is None
+    assert lock_rows(tmp_path / "failed.db") == []
+
+
+def test_lock_is_held_across_backfill_commits(tmp_path, extra_step):
+    path = tmp_path / "backfill.db"
+    conn = connect(path)
+    run_migrations(conn)
+    conn.executemany("INSERT INTO courses (name) VALUES (?)", [(f"Курс {i}",) for i in range(10)])
+    conn.commit()
+    seen = []
+
+    def step(conn):
+        backfill_in_batches(conn, "courses", set_clause="description = 'x'", where="description IS NULL",
+                            batch_size=3)
+        # Пачки уже закоммичены, а шаг ещё не записан: другой процесс видит блокировку
+        seen.extend(lock_rows(path))
+
+    version = extra_step(step)
+    assert run_migrations(conn) == [version]
+    assert [row[0] for row in seen] == [version]
+    assert lock_rows(path) == []
+
+
+def test_waits_for_step_held_by_another_process(tmp_path, extra_step, monkeypatch):
+    path = tmp_path / "busy.db"
+    conn = connect(path)
+    run_migrations(conn)
+    monkeypatch.setattr(migrations, "MIGRATION_LOCK_POLL_SECONDS", 0.05)
+    calls = []
+    version = extra_step(lambda conn: calls.append("ran"))
+
+    # Шаг version выполняет другой процесс
+    conn.execute("INSERT INTO migration_lock (id, version, owner, heartbeat_at) VALUES (1, ?, 'other:1', ?)",
+                 (version, time.time()))
+    conn.commit()
+
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(run_migrations(connect(path))))
+    waiter.start()
+    time.sleep(0.3)
+    assert waiter.is_alive()
+
+    # Другой процесс завершил шаг
+    conn.execute("INSERT INTO schema_version (version, description) VALUES (?, 'test step')", (version,))
+    conn.execute("DELETE FROM migration_lock")
+    conn.commit()
+    waiter.join(timeout=5)
+
+    assert result == [[]]
+    assert calls == []
+
+
+def test_stale_lock_is_taken_over(tmp_path, extra_step):
+    conn = connect(tmp_path / "stale.db")
+    run_migrations(conn)
+    version = extra_step(lambda conn: None)
+
+    conn.execute("INSERT INTO migration_lock (id, version, owner, heartbeat_at) VALUES (1, ?, 'dead:1', ?)",
+                 (version, time.time() - migrations.MIGRATION_LOCK_STALE_SECONDS - 1))
+    conn.commit()
+
+    assert run_migrations(conn) == [version]
+    assert lock_rows(tmp_path / "stale.db") == []
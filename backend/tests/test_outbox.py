@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from database import get_db, get_db_async
+from outbox import enqueue_notifications, merge_payload
+
+
+def outbox_rows() -> list:
+    with get_db() as conn:
+        rows = conn.execute("SELECT event_type, chat_id, payload, status FROM outbox ORDER BY id").fetchall()
+    return [(event_type, chat_id, json.loads(payload), status) for event_type, chat_id, payload, status in rows]
+
+
+async def enqueue(event_type, slot_id, participants, payload) -> int:
+    async with get_db_async() as db:
+        return await enqueue_notifications(db, event_type, slot_id, participants, payload)
+
+
+@pytest.fixture
+def participant(make_user):
+    return {"id": make_user(1001), "telegram_chat_id": "1001"}
+
+
+def test_merge_keeps_new_as_new():
+    assert merge_payload("new", {"status": "scheduled"}, "status_changed",
+                         {"status": "cancelled", "old_status": "scheduled"}) == ("new", {"status": "cancelled"})
+
+
+def test_merge_cancels_round_trip():
+    assert merge_payload("status_changed", {"status": "cancelled", "old_status": "scheduled"}, "status_changed",
+                         {"status": "scheduled", "old_status": "cancelled"}) is None
+
+
+async def test_new_then_change_is_one_new_message(participant):
+    await enqueue("new", 1, [participant], {"status": "scheduled", "location": "101"})
+    await enqueue("status_changed", 1, [participant], {"status": "moved", "old_status": "scheduled",
+                                                       "location": "202"})
+
+    assert outbox_rows() == [("new", "1001", {"status": "moved", "location": "202"}, "queued")]
+
+
+async def test_changes_keep_first_old_status(participant):
+    await enqueue("status_changed", 1, [participant], {"status": "moved", "old_status": "scheduled"})
+    await enqueue("status_changed", 1, [participant], {"status": "cancelled", "old_status": "moved"})
+
+    assert outbox_rows() == [
+        ("status_changed", "1001", {"status": "cancelled", "old_status": "scheduled"}, "queued")
+    ]
+
+
+async def test_change_and_revert_cancel_each_other(participant):
+    await enqueue("status_changed", 1, [participant], {"status": "cancelled", "old_status": "scheduled"})
+    await enqueue("status_changed", 1, [participant], {"status": "scheduled", "old_status": "cancelled"})
+
+    assert outbox_rows() == []
+
+
+async def test_sent_message_is_not_merged_and_duplicate_is_dropped(participant):
+    payload = {"status": "cancelled", "old_status": "scheduled"}
+    await enqueue("status_changed", 1, [participant], payload)
+    with get_db() as conn:
+        conn.execute("UPDATE outbox SET status = 'sent'")
+
+    # Точно такое же сообщение в окне OUTBOX_DEDUP_WINDOW не ставится повторно
+    assert await enqueue("status_changed", 1, [participant], payload) == 0
+    # Другое событие после отправки — новое сообщение
+    assert await enqueue("status_changed", 1, [participant], {"status": "scheduled", "old_status": "cancelled"}) == 1
+    assert [row[3] for row in outbox_rows()] == ["sent", "queued"]
+
+
+async def test_cancel_restore_cancel_sends_every_change(participant):
+    cancel = {"status": "cancelled", "old_status": "scheduled"}
+    restore = {"status": "scheduled", "old_status": "cancelled"}
+    for payload in (cancel, restore):
+        assert await enqueue("status_changed", 1, [participant], payload) == 1
+        with get_db() as conn:
+            conn.execute("UPDATE outbox SET status = 'sent'")
+
+    # Такая же отмена уже была в окне, но последнее сообщение — о возврате
+    assert await enqueue("status_changed", 1, [participant], cancel) == 1
+    assert [row[2]["status"] for row in outbox_rows()] == ["cancelled", "scheduled", "cancelled"]
+
+
+async def test_repeat_of_other_slot_message_is_not_a_duplicate(participant):
+    payload = {"status": "cancelled", "old_status": "scheduled"}
+    await enqueue("status_changed", 1, [participant], payload)
+    assert await enqueue("status_changed", 2, [participant], payload) == 1
+
+
+async def test_repeated_chat_is_queued_once(participant):
+    assert await enqueue("new", 1, [participant, dict(participant)], {"status": "scheduled"}) == 1
+
+
+async def test_invalid_and_digest_recipients(make_user):
+    invalid = make_user(2001, telegram_invalid_at="2025-01-01 00:00:00")
+    digest = make_user(2002, notification_mode="daily")
+    instant = make_user(2003)
+    participants = [{"id": user_id, "telegram_chat_id": str(chat_id)}
+                    for user_id, chat_id in ((invalid, 2001), (digest, 2002), (instant, 2003))]
+
+    assert await enqueue("new", 1, participants, {"status": "scheduled"}) == 1
+    assert [row[1] for row in outbox_rows()] == ["2003"]
+    with get_db() as conn:
+        assert [row[0] for row in conn.execute("SELECT user_id FROM digest_events")] == [digest]
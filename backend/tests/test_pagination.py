@@ -0,0 +1,77 @@
+import pytest
+from fastapi import HTTPException
+
+from courses_api import get_courses
+from database import get_db
+from pagination import MAX_PAGE_SIZE, decode_cursor, encode_cursor, page_limit, split_page
+from slots_api import get_class_slots_page
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor("Математика", 42)
+    assert decode_cursor(cursor, 2) == ["Математика", 42]
+
+
+@pytest.mark.parametrize("cursor", ["не base64!", encode_cursor(1, 2, 3), encode_cursor()])
+def test_bad_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, 2)
+    assert error.value.status_code == 400
+
+
+def test_page_limit():
+    assert page_limit(10) == 10
+    assert page_limit(MAX_PAGE_SIZE * 10) == MAX_PAGE_SIZE
+    with pytest.raises(HTTPException):
+        page_limit(0)
+
+
+def test_split_page():
+    rows = [(1,), (2,), (3,)]
+    assert split_page(rows, 3, key=lambda row: row) == (rows, None)
+    page, cursor = split_page(rows, 2, key=lambda row: row)
+    assert page == rows[:2]
+    assert decode_cursor(cursor, 1) == [2]
+
+
+async def test_courses_pages_cover_all_rows_once():
+    # Одинаковые имена: порядок и граница страниц определяются парой (name, id)
+    with get_db() as conn:
+        conn.executemany("INSERT INTO courses (name) VALUES (?)", [(f"Курс {i % 4}",) for i in range(23)])
+
+    seen = []
+    cursor = None
+    while True:
+        page = await get_courses(limit=5, cursor=cursor)
+        seen.extend((item["name"], item["id"]) for item in page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 23
+    assert seen == sorted(seen)
+
+
+async def test_cursor_ignores_offset():
+    with get_db() as conn:
+        conn.executemany("INSERT INTO courses (name) VALUES (?)", [(f"Курс {i:02}",) for i in range(6)])
+
+    first = await get_courses(limit=3)
+    second = await get_courses(limit=3, offset=100, cursor=first["next_cursor"])
+    assert [item["name"] for item in second["items"]] == ["Курс 03", "Курс 04", "Курс 05"]
+    assert second["next_cursor"] is None
+
+
+async def test_slots_newest_first_by_start_at():
+    with get_db() as conn:
+        conn.executemany("""
+            INSERT INTO class_slots (title, date_time, start_at) VALUES (?, ?, datetime(?))
+        """, [(f"Занятие {day}", f"2025-03-{day:02} 10:00", f"2025-03-{day:02} 10:00") for day in range(1, 8)])
+
+    page = await get_class_slots_page(date_from="2025-03-02", date_to="2025-03-06", limit=3)
+    assert [item["title"] for item in page["items"]] == ["Занятие 6", "Занятие 5", "Занятие 4"]
+
+    page = await get_class_slots_page(date_from="2025-03-02", date_to="2025-03-06", limit=3,
+                                      cursor=page["next_cursor"])
+    assert [item["title"] for item in page["items"]] == ["Занятие 3", "Занятие 2"]
+    assert page["next_cursor"] is None
@@ -0,0 +1,60 @@
+import types
+
+import openpyxl
+import pytest
+
+from parser import iter_excel_schedule, list_sheets, parse_excel_schedule
+
+ROWS = [
+    ("606-51 (1 курс)",),
+    ("ПН",),
+    (1, "Математика", "Иванов", "101"),
+    (2, "Физика"),
+    (3, "-", "", ""),
+    ("ВТ",),
+    (1, "История", None, "305"),
+    ("603-51м",),
+    ("СР",),
+    (4, "Химия", "Петров", "210"),
+]
+
+
+@pytest.fixture
+def workbook_path(tmp_path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.title = "Осень"
+    for row in ROWS:
+        sheet.append(row)
+    workbook.create_sheet("Весна").append(("606-51",))
+    workbook["Весна"].append(("ПТ",))
+    workbook["Весна"].append((5, "Экономика", "Сидоров", "401"))
+    path = tmp_path / "schedule.xlsx"
+    workbook.save(path)
+    return str(path)
+
+
+def test_rows_are_parsed_with_course_and_day(workbook_path):
+    entries = parse_excel_schedule(workbook_path)
+    assert [(e["course_name"], e["day_of_week"], e["time_slot"], e["subject"]) for e in entries] == [
+        ("606-51 (1 курс)", 1, "08:30-10:00", "Математика"),
+        ("606-51 (1 курс)", 1, "10:10-11:40", "Физика"),
+        ("606-51 (1 курс)", 2, "08:30-10:00", "История"),
+        ("603-51м", 3, "13:40-15:10", "Химия"),
+    ]
+    # Короткая строка read_only дополняется пустыми ячейками
+    assert (entries[1]["teacher"], entries[1]["room"]) == (None, None)
+    assert entries[2]["teacher"] is None
+
+
+def test_stream_mode_yields_lazily(workbook_path):
+    entries = parse_excel_schedule(workbook_path, stream=True)
+    assert isinstance(entries, types.GeneratorType)
+    assert next(entries)["subject"] == "Математика"
+    # Закрытие генератора закрывает книгу
+    entries.close()
+
+
+def test_sheet_selection(workbook_path):
+    assert list_sheets(workbook_path) == ["Осень", "Весна"]
+    assert [e["subject"] for e in iter_excel_schedule(workbook_path, sheet_name="Весна")] == ["Экономика"]
@@ -0,0 +1,67 @@
+import asyncio
+import time
+
+import notifications
+from rate_limiter import KeyedTokenBuckets, TokenBucket
+
+
+async def test_burst_then_steady_rate():
+    bucket = TokenBucket(rate=50, capacity=3)
+    started = time.monotonic()
+    for _ in range(3):
+        assert await bucket.acquire() < 0.01
+    assert not bucket.try_acquire()
+
+    # Ещё 5 токенов при 50 в секунду — не быстрее 0.1 с
+    for _ in range(5):
+        await bucket.acquire()
+    assert time.monotonic() - started >= 0.09
+
+
+async def test_pause_blocks_until_retry_after():
+    bucket = TokenBucket(rate=1000, capacity=10)
+    bucket.pause(0.1)
+    assert not bucket.try_acquire()
+    assert await bucket.acquire() >= 0.09
+
+
+async def test_waiters_are_served_in_order():
+    bucket = TokenBucket(rate=100, capacity=1)
+    order = []
+
+    async def take(i):
+        await bucket.acquire()
+        order.append(i)
+
+    await asyncio.gather(*(take(i) for i in range(5)))
+    assert order == list(range(5))
+
+
+async def test_chats_have_separate_buckets():
+    buckets = KeyedTokenBuckets(rate=1, capacity=1)
+    assert await buckets.acquire(1) < 0.01
+    # Лимит одного чата не задерживает другой
+    assert await buckets.acquire(2) < 0.01
+    assert not buckets.get(1).try_acquire()
+
+
+def test_only_idle_buckets_are_evicted():
+    buckets = KeyedTokenBuckets(rate=1, capacity=1, max_keys=4)
+    for chat in range(4):
+        buckets.get(chat)
+    buckets.get(0).try_acquire()
+
+    buckets.get(4)
+    # Бакет 0 ещё помнит отправку: выброс дал бы чату лишний токен
+    assert list(buckets._buckets) == [0, 4]
+
+
+def test_global_rate_is_shared_between_shards():
+    saved = notifications._global_bucket
+    try:
+        notifications.configure_rate_share(3)
+        assert notifications._global_bucket.rate == notifications.TELEGRAM_GLOBAL_RATE / 3
+        notifications.configure_rate_share(0)
+        assert notifications._global_bucket.rate == notifications.TELEGRAM_GLOBAL_RATE
+    finally:
+        notifications._global_bucket = saved
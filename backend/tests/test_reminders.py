@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import get_db
+from reminders import START_AT_FORMAT, ReminderScheduler
+
+
+@pytest.fixture
+def scheduler():
+    return ReminderScheduler(lead=timedelta(minutes=30), horizon=timedelta(hours=24))
+
+
+def start_in(minutes: int) -> str:
+    return (datetime.now() + timedelta(minutes=minutes)).strftime(START_AT_FORMAT)
+
+
+def move_slot(minutes: int) -> str:
+    start_at = start_in(minutes)
+    with get_db() as conn:
+        conn.execute("UPDATE class_slots SET date_time = ?, start_at = ?", (start_at, start_at))
+    return start_at
+
+
+@pytest.fixture
+def slot(make_user):
+    """Занятие через 10 минут (напоминание за 30 минут уже пора отправить) с двумя участниками"""
+    with get_db() as conn:
+        slot_id = conn.execute(
+            "INSERT INTO class_slots (title, date_time, start_at) VALUES ('Лекция', ?, ?)",
+            (start_in(10), start_in(10))
+        ).lastrowid
+        conn.executemany("INSERT INTO participants (class_slot_id, user_id) VALUES (?, ?)",
+                         [(slot_id, make_user(chat_id)) for chat_id in (501, 502)])
+    return slot_id
+
+
+def test_rescheduled_slot_fires_at_new_time(scheduler):
+    start = datetime(2030, 3, 1, 10, 0)
+    scheduler.schedule(1, start)
+    scheduler.schedule(1, start + timedelta(hours=1))
+
+    assert scheduler._pop_due(start) == []
+    assert scheduler._pop_due(start + timedelta(hours=1)) == [1]
+
+
+def test_cancelled_slot_never_fires(scheduler):
+    start = datetime(2030, 3, 1, 10, 0)
+    scheduler.schedule(1, start)
+    scheduler.schedule(2, start)
+    scheduler.cancel(1)
+
+    assert scheduler._pop_due(start) == [2]
+
+
+async def test_fire_reminds_once_per_start_time(scheduler, slot):
+    assert await scheduler.fire(slot) == 2
+    # Перезапуск процесса: напоминание о том же времени не повторяется
+    assert await scheduler.fire(slot) == 0
+
+    move_slot(20)
+    assert await scheduler.fire(slot) == 2
+
+
+async def test_stale_heap_reschedules_instead_of_sending(scheduler, slot):
+    # Другой процесс перенёс занятие на 2 часа: heap этого процесса сработал по старому времени
+    start_at = move_slot(120)
+    assert await scheduler.fire(slot) == 0
+    assert scheduler._scheduled[slot] == datetime.strptime(start_at, START_AT_FORMAT) - scheduler.lead
+
+    # Настоящее напоминание о новом времени не подавлено
+    move_slot(15)
+    assert await scheduler.fire(slot) == 2
+
+
+async def test_started_slot_is_not_reminded(scheduler, slot):
+    move_slot(-5)
+    assert await scheduler.fire(slot) == 0
+
+
+async def test_cancelled_slot_is_not_reminded(scheduler, slot):
+    with get_db() as conn:
+        conn.execute("UPDATE class_slots SET status = 'cancelled'")
+    assert await scheduler.fire(slot) == 0
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from database import get_db
+from response_cache import InMemoryCacheBackend, ResponseCache, response_cache
+
+
+@pytest.fixture
+def cache():
+    return ResponseCache(InMemoryCacheBackend(max_size=2), ttl=30)
+
+
+@pytest.fixture
+def client():
+    from main import app
+
+    response_cache.clear()
+    return TestClient(app)
+
+
+def loader(value):
+    calls = []
+
+    async def load():
+        calls.append(value)
+        return value
+    return load, calls
+
+
+async def test_hit_after_miss(cache):
+    load, calls = loader({"a": 1})
+    assert await cache.get_or_load("k", ["t"], load) == {"a": 1}
+    assert await cache.get_or_load("k", ["t"], load) == {"a": 1}
+    assert calls == [{"a": 1}]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+async def test_invalidate_by_tag_only(cache):
+    await cache.get_or_load("a", ["courses"], loader(1)[0])
+    await cache.get_or_load("b", ["users"], loader(2)[0])
+    cache.invalidate("users")
+
+    assert cache.backend.get("a") == 1
+    assert cache.backend.get("b") is None
+
+
+async def test_tags_from_loaded_value(cache):
+    await cache.get_or_load("slot", lambda slot: [f"course_slots:{slot['course_id']}"], loader({"course_id": 7})[0])
+    cache.invalidate("course_slots:7")
+    assert cache.backend.get("slot") is None
+
+
+async def test_lru_and_ttl():
+    backend = InMemoryCacheBackend(max_size=2)
+    backend.set("a", 1, 30, [])
+    backend.set("b", 2, 30, [])
+    backend.get("a")
+    backend.set("c", 3, 30, [])
+    assert (backend.get("a"), backend.get("b"), backend.get("c")) == (1, None, 3)
+
+    backend.set("d", 4, 0, [])
+    assert backend.get("d") is None
+
+
+async def test_value_loaded_during_invalidation_is_not_cached(cache):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_load():
+        started.set()
+        await release.wait()
+        return "старое"
+
+    task = asyncio.create_task(cache.get_or_load("k", ["users"], slow_load))
+    await started.wait()
+    cache.invalidate("users")
+    release.set()
+
+    assert await task == "старое"
+    assert cache.backend.get("k") is None
+
+
+def test_registration_refreshes_cached_participants(client):
+    with get_db() as conn:
+        conn.execute("INSERT INTO users (email, password_hash, full_name) VALUES ('first@test.ru', '-', 'Первый')")
+        course_id = conn.execute("INSERT INTO courses (name) VALUES ('Курс')").lastrowid
+    url = f"/api/courses/{course_id}/participants"
+
+    before = client.get(url).json()
+    registered = client.post("/api/auth/register", json={
+        "email": "new@test.ru", "password": "secret123", "full_name": "Новый Студент"
+    })
+    assert registered.status_code == 200
+
+    after = client.get(url).json()
+    assert len(after) == len(before) + 1
+    assert "new@test.ru" in [user["email"] for user in after]
@@ -0,0 +1,88 @@
+import sqlite3
+
+import pytest
+
+from database import get_db
+from schedule_api import find_previous_import, save_schedule_entries
+
+
+def entry(i, teacher="Иванов", course="ИВТ-101"):
+    return {"course_name": course, "day_of_week": i % 6 + 1, "time_slot": f"{i:02}:00",
+            "subject": f"Предмет {i}", "teacher": teacher, "room": "101"}
+
+
+def committed_rows(database) -> int:
+    # Отдельное подключение видит только закоммиченное
+    with sqlite3.connect(database) as conn:
+        return conn.execute("SELECT COUNT(*) FROM schedule").fetchone()[0]
+
+
+def table() -> set:
+    with get_db() as conn:
+        return {tuple(row) for row in conn.execute("""
+            SELECT c.name, s.subject, s.teacher FROM schedule s JOIN courses c ON c.id = s.course_id
+        """)}
+
+
+def test_batches_are_committed_while_streaming(database):
+    seen = []
+
+    def stream():
+        for i in range(10):
+            seen.append(committed_rows(database))
+            yield entry(i)
+
+    stats = save_schedule_entries(stream(), batch_size=3)
+    assert stats["inserted"] == 10
+    # Перед 4-й строкой первая пачка уже в БД: файл не копится в памяти целиком
+    assert seen == [0, 0, 0, 3, 3, 3, 6, 6, 6, 9]
+
+
+def test_write_lock_is_free_between_batches(database):
+    def stream():
+        for i in range(6):
+            # Другой писатель не ждёт окончания импорта
+            with sqlite3.connect(database, timeout=0) as other:
+                other.execute("BEGIN IMMEDIATE")
+                other.execute("INSERT INTO courses (name) VALUES (?)", (f"Параллельный {i}",))
+            yield entry(i)
+
+    save_schedule_entries(stream(), batch_size=2)
+    with get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM courses WHERE name LIKE 'Параллельный%'").fetchone()[0] == 6
+
+
+def test_interrupted_import_is_not_recorded_and_completes_on_retry():
+    rows = [entry(i) for i in range(7)]
+    save_schedule_entries(rows, batch_size=3)
+    changed = [entry(i, teacher="Петров") for i in range(5)]
+
+    def broken():
+        yield from changed[:4]
+        raise ValueError("файл повреждён")
+
+    with pytest.raises(ValueError):
+        save_schedule_entries(broken(), batch_size=3, file_hash="v2")
+    assert find_previous_import("v2") is None
+
+    stats = save_schedule_entries(changed, batch_size=3, file_hash="v2")
+    assert table() == {("ИВТ-101", f"Предмет {i}", "Петров") for i in range(5)}
+    assert stats["deleted"] == 2
+    assert find_previous_import("v2") is not None
+
+
+def test_result_does_not_depend_on_batch_size():
+    old = [entry(i) for i in range(12)] + [entry(i, course="ИВТ-102") for i in range(4)]
+    new = ([entry(i, teacher="Петров" if i % 3 == 0 else "Иванов") for i in range(2, 15)]
+           + [entry(i, course="ИВТ-102") for i in range(4)])
+
+    results = []
+    for batch_size in (1, 4, 1000):
+        save_schedule_entries(old, batch_size=batch_size)
+        save_schedule_entries(new, batch_size=batch_size)
+        results.append(table())
+        with get_db() as conn:
+            conn.execute("DELETE FROM schedule")
+
+    assert results[0] == results[1] == results[2]
+    assert len(results[0]) == 17
@@ -0,0 +1,94 @@
+from database import get_db
+from import_jobs import _skip_if_imported
+from schedule_api import find_previous_import, save_schedule_entries
+
+
+def entry(subject, teacher="Иванов", course="ИВТ-101", day=1, time_slot="08:30-10:00", room="101"):
+    return {"course_name": course, "day_of_week": day, "time_slot": time_slot, "subject": subject,
+            "teacher": teacher, "room": room}
+
+
+VERSION_1 = [entry("Математика"), entry("Физика", day=2), entry("Химия", day=3), entry("История", day=4)]
+# Математика без изменений, у Физики новый преподаватель, Химии и Истории больше нет, Биология новая
+VERSION_2 = [entry("Математика"), entry("Физика", teacher="Петров", day=2), entry("Биология", day=5)]
+
+
+def schedule_rows() -> dict:
+    with get_db() as conn:
+        return {row[1]: (row[0], row[2]) for row in conn.execute("SELECT id, subject, teacher FROM schedule")}
+
+
+def counts(stats: dict) -> tuple:
+    return stats["unchanged"], stats["inserted"], stats["updated"], stats["deleted"]
+
+
+def test_reimport_applies_only_the_difference():
+    first = save_schedule_entries(VERSION_1, file_hash="v1")
+    assert (first["rows"], first["courses_created"], counts(first)) == (4, 1, (0, 4, 0, 0))
+    before = schedule_rows()
+
+    second = save_schedule_entries(iter(VERSION_2), file_hash="v2")
+    assert counts(second) == (1, 1, 1, 2)
+
+    after = schedule_rows()
+    assert set(after) == {"Математика", "Физика", "Биология"}
+    assert after["Математика"] == before["Математика"]
+    # Изменившаяся строка обновлена на месте, а не удалена и вставлена заново
+    assert after["Физика"] == (before["Физика"][0], "Петров")
+
+
+def test_identical_reimport_writes_nothing():
+    save_schedule_entries(VERSION_1)
+    before = schedule_rows()
+    assert counts(save_schedule_entries(VERSION_1)) == (4, 0, 0, 0)
+    assert schedule_rows() == before
+
+
+def test_duplicate_rows_are_matched_one_to_one():
+    rows = [entry("Математика"), entry("Математика")]
+    save_schedule_entries(rows)
+    assert counts(save_schedule_entries(rows[:1])) == (1, 0, 0, 1)
+
+
+def test_other_courses_are_untouched():
+    save_schedule_entries(VERSION_1)
+    assert counts(save_schedule_entries([entry("Музыка", course="ИВТ-102")])) == (0, 1, 0, 0)
+    with get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM schedule").fetchone()[0] == 5
+
+
+def test_previous_import_is_current_until_its_courses_change():
+    save_schedule_entries(VERSION_1, file_hash="v1", filename="v1.xlsx")
+    previous = find_previous_import("v1")
+    assert (previous["filename"], previous["rows"], previous["inserted"]) == ("v1.xlsx", 4, 4)
+    assert find_previous_import("unknown") is None
+
+    # Импорт другого курса результат не отменяет
+    save_schedule_entries([entry("Музыка", course="ИВТ-102")], file_hash="other")
+    assert find_previous_import("v1") is not None
+
+    # Более поздний импорт тех же курсов — файл нужно импортировать заново
+    save_schedule_entries(VERSION_2, file_hash="v2")
+    assert find_previous_import("v1") is None
+    save_schedule_entries(VERSION_1, file_hash="v1")
+    assert find_previous_import("v1") is not None
+
+    # Строки курса изменены в обход импорта
+    with get_db() as conn:
+        conn.execute("DELETE FROM schedule WHERE subject = 'История'")
+    assert find_previous_import("v1") is None
+
+
+async def test_already_imported_file_is_skipped(tmp_path):
+    save_schedule_entries(VERSION_1, file_hash="v1")
+    upload = tmp_path / "upload.xlsx"
+    upload.write_bytes(b"-")
+
+    job = await _skip_if_imported("v1", [str(upload)], kind="single", filename="v1.xlsx")
+    assert job["status"] == "done" and job["skipped"] is True
+    assert job["stats"]["previous_import"]["rows"] == 4
+    assert not upload.exists()
+
+    upload.write_bytes(b"-")
+    assert await _skip_if_imported("v2", [str(upload)], kind="single", filename="v2.xlsx") is None
+    assert upload.exists()
@@ -72,11 +72,18 @@ export default function ScheduleCalendar({ apiUrl, onEdit, onCreateNew }) {
                 const endStr = getLocalDateString(calendarDays[calendarDays.length - 1].date);
 
                 const token = localStorage.getItem('token');
-                const response = await axios.get(`${apiUrl}/api/schedule`, {
-                    headers: { Authorization: `Bearer ${token}` },
-                    params: { date_from: startStr, date_to: endStr }
-                });
-                setEvents(response.data);
+                // Забираем месяц постранично по курсору из заголовка X-Next-Cursor
+                let allEvents = [];
+                let cursor = null;
+                do {
+                    const response = await axios.get(`${apiUrl}/api/schedule`, {
+                        headers: { Authorization: `Bearer ${token}` },
+                        params: { date_from: startStr, date_to: endStr, limit: 1000, ...(cursor ? { cursor } : {}) }
+                    });
+                    allEvents = allEvents.concat(response.data);
+                    cursor = response.headers['x-next-cursor'];
+                } while (cursor);
+                setEvents(allEvents);
             } catch (error) {
                 console.error("Ошибка загрузки расписания:", error);
             } finally {